@@ -0,0 +1,132 @@
+"""
+Benchmarks of the metadata extraction, run on a synthetic pipeline output.
+
+    python benchmarks/run_benchmarks.py --size medium --save benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --size medium --compare benchmarks/baseline.json
+
+With --compare, the exit code is 1 if any benchmark is slower than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from emerlin2caom2 import file_metadata as msmd
+from emerlin2caom2 import fits_reader as fr
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic  # noqa: E402
+
+
+def bench_ms_file_info(storage_name):
+    msmd.get_local_file_info(os.path.join(storage_name, '{}_avg.ms'.format(synthetic.OBS_ID)))
+
+
+def bench_header_extraction(storage_name):
+    for directory in msmd.list_dir(os.path.join(storage_name, 'weblog', 'images')):
+        for entry in msmd.list_dir(directory.path):
+            fr.header_extraction(entry.path)
+
+
+def bench_weblog_scan(storage_name):
+    for sub_dir in ('plots', 'images'):
+        for directory in msmd.list_dir(os.path.join(storage_name, 'weblog', sub_dir)):
+            for entry in msmd.list_dir(directory.path):
+                msmd.get_local_file_info(entry.path, entry)
+
+
+def bench_build_metadata(storage_name):
+    from emerlin2caom2 import main_app
+    with tempfile.TemporaryDirectory() as xml_dir, \
+            patch('emerlin2caom2.casa_reader.get_snapshot', side_effect=synthetic.stub_snapshot):
+        main_app.EmerlinMetadata(storage_name, xml_dir, upload=False, write_xml_files=False,
+                                 casa_workers=0).build_metadata()
+
+
+BENCHMARKS = {
+    'get_local_file_info_ms': bench_ms_file_info,
+    'header_extraction': bench_header_extraction,
+    'weblog_scan': bench_weblog_scan,
+    'build_metadata': bench_build_metadata,
+}
+
+
+def run_benchmarks(storage_name, names, repeat):
+    """
+    Time each benchmark, keeping the fastest of repeat runs as the least affected by other activity.
+    :param storage_name: path of the synthetic pipeline output
+    :param names: names of the benchmarks to run, from BENCHMARKS
+    :param repeat: number of times to run each benchmark
+    :returns: dictionary of name to seconds, or to None if the benchmark could not be run
+    """
+    results = {}
+    for name in names:
+        times = []
+        try:
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                BENCHMARKS[name](storage_name)
+                times.append(time.perf_counter() - t0)
+        except ImportError as e:
+            print('{:<24} skipped: {}'.format(name, e))
+            results[name] = None
+            continue
+        results[name] = min(times)
+        print('{:<24} {:10.4f} s'.format(name, results[name]))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    :param results: dictionary of name to seconds
+    :param baseline: dictionary of name to seconds from an earlier run
+    :param tolerance: fractional slow down allowed, e.g. 0.2 for 20 %
+    :returns: list of names of the benchmarks that regressed
+    """
+    regressed = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if seconds is None or base is None:
+            continue
+        change = (seconds - base) / base
+        flag = 'REGRESSION' if change > tolerance else ''
+        print('{:<24} {:10.4f} s  baseline {:10.4f} s  {:+7.1%} {}'.format(name, seconds, base, change, flag))
+        if change > tolerance:
+            regressed.append(name)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark emerlin2caom2 on a synthetic pipeline output.')
+    parser.add_argument('--size', choices=synthetic.SIZES, default='small', help='size of the synthetic output')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the fastest is kept')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help='benchmarks to run')
+    parser.add_argument('--save', help='write the results to this json file as a baseline')
+    parser.add_argument('--compare', help='compare against a baseline json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='fractional slow down reported as a regression')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        storage_name = synthetic.make_pipeline_output(root, **synthetic.SIZES[args.size])
+        results = run_benchmarks(storage_name, args.only, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'size': args.size, 'python': platform.python_version(), 'machine': platform.node(),
+                       'results': results}, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline.get('size') != args.size:
+            print('Warning: baseline was run with size ' + str(baseline.get('size')))
+        if compare(results, baseline['results'], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Generate synthetic e-MERLIN pipeline outputs for benchmarking. The directory layout follows the pipeline: an
+averaged and a spectral measurement set, weblog/info/eMCP_info.txt, weblog/plots, weblog/images with WSClean
+style FITS images, and splits/*.ms. Measurement sets are mock directories of table files; they cannot be opened
+with casatools, so stub_snapshot provides the metadata that would have been read from them.
+"""
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from emerlin2caom2 import casa_reader as casa
+
+OBS_ID = 'TS8004_C_001_20190801'
+TARGETS = {'target': '1252+5634', 'phscal': '1302+5748', 'fluxcal': '1331+3030', 'bpcal': '1407+2827',
+           'ptcal': '0319+4130'}
+ANTENNAS = ['Mk2', 'Kn', 'De', 'Pi', 'Da', 'Cm']
+
+SIZES = {
+    'small': {'n_plots': 20, 'n_images': 2, 'n_splits': 1, 'n_table_files': 20, 'table_file_size': 64 * 1024,
+              'image_pixels': 256},
+    'medium': {'n_plots': 200, 'n_images': 5, 'n_splits': 2, 'n_table_files': 100,
+               'table_file_size': 1024 * 1024, 'image_pixels': 1024},
+    'large': {'n_plots': 1000, 'n_images': 5, 'n_splits': 5, 'n_table_files': 200,
+              'table_file_size': 16 * 1024 * 1024, 'image_pixels': 2048},
+}
+
+
+def write_emcp_info(fqn):
+    """
+    Write a minimal eMCP_info.txt, holding the entries read by main_app.
+    """
+    lines = ['targets: {}'.format(TARGETS['target']),
+             'phscals: {}'.format(TARGETS['phscal']),
+             'fluxcal: {}'.format(TARGETS['fluxcal']),
+             'bpcal: {}'.format(TARGETS['bpcal']),
+             'ptcal: {}'.format(TARGETS['ptcal']),
+             'pipeline_path: /opt/eMERLIN_CASA_pipeline/',
+             'pipeline_version: v1.1.19',
+             'run: 1']
+    with open(fqn, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def write_mock_ms(ms_dir, n_table_files, table_file_size):
+    """
+    Write a directory shaped like a measurement set: a main table and sub-tables, each a directory of table files.
+    The files hold repeated bytes, as the time to hash them does not depend on their content.
+    """
+    block = bytes(range(256)) * 4096
+    subtables = ['', 'ANTENNA', 'FEED', 'FIELD', 'OBSERVATION', 'SPECTRAL_WINDOW', 'POLARIZATION']
+    for i in range(n_table_files):
+        table_dir = os.path.join(ms_dir, subtables[i % len(subtables)])
+        os.makedirs(table_dir, exist_ok=True)
+        with open(os.path.join(table_dir, 'table.f{}'.format(i)), 'wb') as file:
+            remaining = table_file_size
+            while remaining > 0:
+                file.write(block[:remaining])
+                remaining -= len(block)
+        with open(os.path.join(table_dir, 'table.info'), 'w') as file:
+            file.write('Type = Measurement Set\n')
+
+
+def write_wsclean_fits(fqn, pixels, freq=5.07e9):
+    """
+    Write a FITS image with the header keywords WSClean writes, as read by fits_reader.header_extraction.
+    """
+    hdu = fits.PrimaryHDU(np.zeros((1, 1, pixels, pixels), dtype=np.float32))
+    header = hdu.header
+    header['EQUINOX'] = 2000.
+    header['CTYPE1'], header['CRVAL1'], header['CDELT1'] = 'RA---SIN', 193.0, -1.5e-5
+    header['CTYPE2'], header['CRVAL2'], header['CDELT2'] = 'DEC--SIN', 56.57, 1.5e-5
+    header['CTYPE3'], header['CRVAL3'], header['CDELT3'] = 'FREQ', freq, 5.12e8
+    header['WSCVERSI'] = '2.10'
+    hdu.writeto(fqn, overwrite=True)
+
+
+def make_pipeline_output(root, n_plots=20, n_images=2, n_splits=1, n_table_files=20, table_file_size=64 * 1024,
+                         image_pixels=256):
+    """
+    Generate a synthetic pipeline output.
+    :param root: directory in which the output is created
+    :param n_plots: number of plots in weblog/plots
+    :param n_images: number of image directories in weblog/images, each with an image, residual and model
+    :param n_splits: number of measurement sets in splits, at most one per source
+    :param n_table_files: number of table files in each mock measurement set
+    :param table_file_size: bytes in each table file
+    :param image_pixels: width and height of each FITS image
+    :returns: path of the pipeline output
+    """
+    storage_name = os.path.join(root, OBS_ID)
+    sources = list(TARGETS.values())
+    os.makedirs(os.path.join(storage_name, 'weblog', 'info'), exist_ok=True)
+    write_emcp_info(os.path.join(storage_name, 'weblog', 'info', 'eMCP_info.txt'))
+
+    for name in ('avg', 'sp'):
+        write_mock_ms(os.path.join(storage_name, '{}_{}.ms'.format(OBS_ID, name)), n_table_files, table_file_size)
+    for source in sources[:n_splits]:
+        write_mock_ms(os.path.join(storage_name, 'splits', '{}.ms'.format(source)), n_table_files, table_file_size)
+
+    plot_kinds = ['caltables', 'plots_data', 'plots_uvcov']
+    for i in range(n_plots):
+        plot_dir = os.path.join(storage_name, 'weblog', 'plots', plot_kinds[i % len(plot_kinds)])
+        os.makedirs(plot_dir, exist_ok=True)
+        with open(os.path.join(plot_dir, '{}_{}_{}.png'.format(OBS_ID, sources[i % len(sources)], i)), 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n' + bytes(4096))
+
+    for i in range(n_images):
+        source = sources[i % len(sources)]
+        image_dir = os.path.join(storage_name, 'weblog', 'images', '{}_{}'.format(source, i))
+        os.makedirs(image_dir, exist_ok=True)
+        for kind in ('image', 'residual', 'model'):
+            write_wsclean_fits(os.path.join(image_dir, '{}_{}-{}.fits'.format(OBS_ID, source, kind)), image_pixels)
+    return storage_name
+
+
+def stub_snapshot(ms_file):
+    """
+    Replacement for casa_reader.get_snapshot, returning a snapshot filled in as if it had been read from an
+    e-MERLIN measurement set, so that no casatools table is opened.
+    :param ms_file: Name of the measurement set
+    :returns: MSMetadataSnapshot
+    """
+    snapshot = casa.MSMetadataSnapshot(ms_file)
+    sources = list(TARGETS.values())
+    nfield = len(sources)
+    t0 = 5.0e9
+    field_time = [t0 + 600. * i + np.arange(0., 600., 4.) for i in range(nfield)]
+    # 4 spectral windows of 128 channels of 4 MHz from 4.82 GHz, as in C band
+    chan_freqs = [4.82e9 + 512e6 * i + 4e6 * (np.arange(128) + 0.5) for i in range(4)]
+    chan_widths = [np.full(128, 4e6) for _ in range(4)]
+    spw = casa.spectral_windows(chan_freqs, chan_widths)
+    phs_cntr = [{'m0': {'value': np.deg2rad(15. * (i + 1))}, 'm1': {'value': np.deg2rad(40. + i)}}
+                for i in range(nfield)]
+    snapshot._msmd_elements = {
+        'mssources': sources,
+        'phs_cntr': phs_cntr,
+        'field_intervals': [casa.time_intervals(x, 4.) for x in field_time],
+        'tel_name': ['e-MERLIN'],
+        'antennas': ANTENNAS,
+        'ante_off': [{'longitude offset': {'value': 0.}, 'latitude offset': {'value': 0.},
+                      'elevation offset': {'value': 0.}} for _ in ANTENNAS],
+        'ante_pos': [{'m0': {'value': 0.}, 'm1': {'value': 0.9}, 'm2': {'value': 6.4e6}} for _ in ANTENNAS],
+        'obs_pos': {'m0': {'value': 0.}, 'm1': {'value': 0.9}, 'm2': {'value': 6.4e6}},
+        'spw': spw,
+        'wl_upper': np.max(spw['wl_upper']),
+        'wl_lower': np.min(spw['wl_lower']),
+        'chan_res': np.sum(spw['wl_upper'] - spw['wl_lower']) / 512,
+        'nchan': 512,
+        'prop_id': 'TS8004',
+        'int_time': 4.,
+        'bp_name': casa.emerlin_band(4.82e9),
+    }
+    intervals = casa.merge_intervals(snapshot._msmd_elements['field_intervals'], 8.)
+    snapshot._msmd_elements['time_intervals'] = intervals
+    snapshot._msmd_elements['exposure'] = float(np.sum(intervals[:, 1] - intervals[:, 0]))
+    snapshot._subtables = {
+        'ANTENNA': {'DISH_DIAMETER': np.array([75., 25., 25., 25., 25., 32.]),
+                    'POSITION': np.array([[3.82e6 + 2.17e5 * i / len(ANTENNAS) for i in range(len(ANTENNAS))],
+                                          [-1.5e5] * len(ANTENNAS), [5.07e6] * len(ANTENNAS)]),
+                    'FLAG_ROW': np.zeros(len(ANTENNAS), dtype=bool)},
+        'FEED': {'POLARIZATION_TYPE': np.array([['R'] * len(ANTENNAS), ['L'] * len(ANTENNAS)]),
+                 'NUM_RECEPTORS': np.array([2] * len(ANTENNAS))},
+        'FIELD': {'NAME': np.array(sources),
+                  'REFERENCE_DIR': np.array([[[x['m0']['value'] for x in phs_cntr]],
+                                             [[x['m1']['value'] for x in phs_cntr]]])},
+        'OBSERVATION': {'RELEASE_DATE': np.array([t0]), 'TIME_RANGE': np.array([[field_time[0][0]],
+                                                                                 [field_time[-1][-1]]])},
+        'SPECTRAL_WINDOW': {'CHAN_FREQ': chan_freqs, 'CHAN_WIDTH': chan_widths},
+    }
+    return snapshot
@@ -1,20 +1,83 @@
 import requests
-import pyvo as vo
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from emerlin2caom2 import metrics
+from emerlin2caom2 import settings_file as set_f
+
+# maximum number of uris in one TAP query
+TAP_CHUNK_SIZE = 100
+
+_session = None
+_tap_services = {}
+
+
+def get_session():
+    """
+    Shared HTTP session, created on first use. Connections are pooled and kept alive between requests, and
+    requests failing with 429 or a 5xx status are retried with exponential backoff. POST is not retried on a
+    status code, as the record may already have been created, but like every method it is retried if the
+    connection could not be made.
+    :returns: requests.Session
+    """
+    global _session
+    if _session is None:
+        retry = Retry(total=set_f.request_retries, backoff_factor=set_f.request_backoff,
+                      status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=set_f.request_pool_size, pool_maxsize=set_f.request_pool_size,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if set_f.rootca:
+            session.verify = set_f.rootca
+        _session = session
+    return _session
+
+
+def close_session():
+    """
+    Close the shared HTTP session and its pooled connections, and drop the cached TAP services using it.
+    """
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+    # the TAP services hold a reference to the session
+    _tap_services.clear()
 
 
 def request_post(self, xml_output_name):
     """
     Post (new) target XML data onto the database.
     Note this is flipped and was formerly 'put' in torkeep.
-    :param xml_output_name: ObservationID of xml file to post
+    :param xml_output_name: ObservationID of xml file to post, or the XML document itself as bytes
     """
-    post_file = xml_output_name
     url_post = self.base_url
     headers_post = {'Content-type': 'application/xml', 'accept': 'application/xml'}
-    res = requests.post(url_post, data=open(post_file, 'rb'), headers=headers_post)
+    if isinstance(xml_output_name, bytes):
+        xml_data = xml_output_name
+    else:
+        with open(xml_output_name, 'rb') as f:
+            xml_data = f.read()
+    with metrics.timed('http.post', url_post):
+        res = get_session().post(url_post, data=xml_data, headers=headers_post, timeout=set_f.request_timeout)
     # print(res.status_code) # can remove once code no longer needs debugging
     return res.status_code
 
+def request_put(self, to_put, xml_data):
+    """
+    Replace an existing record on the database in a single request, rather than delete and post.
+    :param to_put: ObservationID of the record to replace
+    :param xml_data: XML document as bytes, with the caom2 id of the record
+    """
+    url_put = self.base_url + '/' + to_put
+    headers_put = {'Content-type': 'application/xml', 'accept': 'application/xml'}
+    with metrics.timed('http.put', url_put):
+        res = get_session().put(url_put, data=xml_data, headers=headers_put, timeout=set_f.request_timeout)
+    return res.status_code
+
 def request_delete(self, to_del):
     """
     Deletes target XML data on the database.
@@ -22,11 +85,8 @@ def request_delete(self, to_del):
     """
     url_del = self.base_url + '/' + to_del
     # print(url_del) # can remove once code no longer needs debugging
-    res = requests.delete(url_del)
-    if res.status_code == 204:
-        print(to_del + " has been deleted.")
-    else:
-        print(str(res.status_code) + ": Delete may have failed for " + to_del) # can remove once code no longer needs debugging
+    with metrics.timed('http.delete', url_del):
+        res = get_session().delete(url_del, timeout=set_f.request_timeout)
     return res.status_code
 
 def request_get(self, file_to_get=''):
@@ -38,10 +98,63 @@ def request_get(self, file_to_get=''):
     #url_get = self.base_url + '/' + file_to_get
     url_get = self.base_url
     print(url_get) # can remove once code no longer needs debugging
-    res = requests.get(url_get, params=payload)
+    res = get_session().get(url_get, params=payload, timeout=set_f.request_timeout)
     print(res) # can remove once code no longer needs debugging
 
 
+def get_tap_service(self):
+    """
+    TAP service of the database, created once per url and sharing the pooled HTTP session.
+    :returns: pyvo TAPService
+    """
+    import pyvo as vo  # slow to import, only needed for upload
+
+    url_tap = self.base_url.split('/observations')[0] + '/tap'
+    if url_tap not in _tap_services:
+        _tap_services[url_tap] = vo.dal.TAPService(url_tap, session=get_session())
+    return _tap_services[url_tap]
+
+
+def adql_string(value):
+    """
+    Quote a value as an ADQL string literal, escaping any single quotes within it.
+    :param value: string to quote
+    :returns: quoted literal
+    """
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def find_existing_bulk(self, obs_uris, chunk_size=TAP_CHUNK_SIZE):
+    """
+    Look up the records of many observations with one TAP query per chunk_size uris, rather than one per
+    observation.
+    :param obs_uris: observation uris
+    :param chunk_size: Maximum number of uris in each query
+    :returns: dictionary of uri to the record id, or to a list of ids if there are duplicate records.
+              uris with no record are not included.
+    """
+    service = get_tap_service(self)
+    uris = sorted(set(str(x) for x in obs_uris))
+    found = {}
+    for i in range(0, len(uris), chunk_size):
+        uri_list = ', '.join(adql_string(x) for x in uris[i:i + chunk_size])
+        with metrics.timed('http.tap'):
+            resultset = service.search("SELECT uri, id FROM Observation WHERE uri IN ({})".format(uri_list))
+        for row in resultset:
+            found.setdefault(str(row['uri']), []).append(str(row['id']))
+
+    existing = {}
+    for uri, ids in found.items():
+        if len(ids) > 1:
+            print("Duplicate Records found for: " + uri)
+            for machine_id in ids:
+                print(machine_id)
+            existing[uri] = ids
+        else:
+            existing[uri] = ids[0]
+    return existing
+
+
 def find_existing(self, obs_id):
     """
     Use pyvo TAP service to query for existing record before
@@ -49,22 +162,11 @@ def find_existing(self, obs_id):
     :param obs_id: observation uri or unique identifier.
     :returns: if exists, the uuid aka primary key for db record(s) for this uri.
     """
-    url_tap = self.base_url.split('/observations')[0] + '/tap'
-    service = vo.dal.TAPService(url_tap)
-    uuid_query = "SELECT id FROM Observation WHERE uri="+"'"+obs_id+"'"
-    resultset = service.search(uuid_query)
-    if len(resultset) > 1:
-        print("Duplicate Records found for: " + obs_id)
-        for row in resultset:
-            print(row['id'])
-        return resultset
-        # Add Error logging here.
-    elif len(resultset) == 1:
-        # print(resultset[0]['id'])
-        return resultset[0]['id']
-    else:
-        print("No existing record found for " + obs_id + ". Ok to ingest.")
+    machine_id = find_existing_bulk(self, [obs_id]).get(str(obs_id))
+    if machine_id is None:
+        print("No existing record found for " + str(obs_id) + ". Ok to ingest.")
         # Add Error logging here.
+    return machine_id
 
 def request_tap(self, obs_id):
     """
@@ -76,7 +178,7 @@ def request_tap(self, obs_id):
 
     if url_tap:
         print('location: ' + url_tap)
-        res = requests.get(url_tap)
+        res = get_session().get(url_tap, timeout=set_f.request_timeout)
         print(res)
         print(res.text)
         print(res.text[1][0])
@@ -0,0 +1,114 @@
+import datetime
+import glob
+import multiprocessing
+import os
+import traceback
+
+from emerlin2caom2 import settings_file as set_f
+
+__all__ = [
+    'read_storage_list',
+    'run_batch'
+]
+
+
+def read_storage_list(sources):
+    """
+    Expand the inputs of a batch run into a list of pipeline output directories.
+    :param sources: list of list files (one storage directory per line, # for comments) or glob patterns
+    :returns: sorted list of storage directories, without duplicates
+    """
+    storage_names = set()
+    for source in sources:
+        if os.path.isfile(source):
+            with open(source) as file:
+                lines = [line.strip() for line in file]
+            storage_names.update(line for line in lines if line and not line.startswith('#'))
+        else:
+            storage_names.update(x for x in glob.glob(source) if os.path.isdir(x))
+    return sorted(x.rstrip('/') for x in storage_names)
+
+
+def read_log(log_file):
+    """
+    :param log_file: name of a success or retry log
+    :returns: set of storage directories listed in the log, empty if it does not exist
+    """
+    if not os.path.exists(log_file):
+        return set()
+    with open(log_file) as file:
+        return {line.split('\t')[0].strip() for line in file if line.strip()}
+
+
+def append_log(log_file, *fields):
+    """
+    Append one tab separated line to a log file, flushed straight away so a crash loses nothing.
+    """
+    with open(log_file, 'a') as file:
+        file.write('\t'.join(str(x) for x in fields) + '\n')
+
+
+def process_storage(storage_name):
+    """
+    Build and ingest the metadata of one pipeline output. Runs in a fresh worker process, so casatools state is
+    never shared between runs.
+    :param storage_name: path of the pipeline output directory
+    :returns: storage_name, and the formatted traceback if it failed or None
+    """
+    try:
+        from emerlin2caom2 import main_app
+        main_app.EmerlinMetadata.from_settings(storage_name).build_metadata()
+        return storage_name, None
+    except Exception:
+        return storage_name, traceback.format_exc()
+
+
+def run_batch(sources, workers=None, log_dir=None, skip_done=True):
+    """
+    Process many pipeline outputs on a pool of worker processes. Storage directories already in the success log
+    are skipped, so a batch interrupted by a crash can be resumed by running it again. Failures are not retried
+    within the batch; they are written to the retry file, which can be passed as a source to a later batch.
+    :param sources: list of list files or glob patterns, see read_storage_list
+    :param workers: number of worker processes, defaults to set_f.batch_workers
+    :param log_dir: directory for the todo, success, failure, retry and progress files,
+                    defaults to set_f.log_file_directory
+    :param skip_done: If True, storage directories already in the success log are skipped. If False every one is
+                      processed, e.g. when discovery finds a pipeline output that was rerun in place
+    :returns: dictionary of counts of succeeded, failed and skipped runs
+    """
+    workers = workers or set_f.batch_workers
+    log_dir = log_dir or set_f.log_file_directory or '.'
+    os.makedirs(log_dir, exist_ok=True)
+    success_log = os.path.join(log_dir, set_f.success_log_file_name)
+    failure_log = os.path.join(log_dir, set_f.failure_log_file_name)
+    retry_file = os.path.join(log_dir, set_f.retry_file_name)
+    progress_file = os.path.join(log_dir, set_f.progress_file_name)
+
+    todo = read_storage_list(sources)
+    with open(os.path.join(log_dir, set_f.todo_file_name), 'w') as file:
+        file.writelines(x + '\n' for x in todo)
+
+    done = read_log(success_log) if skip_done else set()
+    pending = [x for x in todo if x not in done]
+    counts = {'succeeded': 0, 'failed': 0, 'skipped': len(todo) - len(pending)}
+    # the retry file only lists failures of the latest batch
+    open(retry_file, 'w').close()
+
+    # spawn a new process per run: casatools tools are process-wide singletons and are not fork safe
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=workers, maxtasksperchild=1) as pool:
+        for storage_name, error in pool.imap_unordered(process_storage, pending):
+            now = datetime.datetime.now().isoformat(timespec='seconds')
+            if error is None:
+                counts['succeeded'] += 1
+                append_log(success_log, storage_name, now)
+            else:
+                counts['failed'] += 1
+                append_log(failure_log, storage_name, now, error.strip().splitlines()[-1])
+                append_log(retry_file, storage_name)
+                print('Failed to process ' + storage_name + ':\n' + error)
+            append_log(progress_file, now, 'processed {} of {}, {} failed'.format(
+                counts['succeeded'] + counts['failed'], len(pending), counts['failed']))
+
+    print('Batch complete: {succeeded} succeeded, {failed} failed, {skipped} skipped.'.format(**counts))
+    return counts
@@ -1,14 +1,467 @@
 # This module extracts metadata from eMERLIN measurement sets via casa
-# -built operations.  When more table.open operations are added, it 
-# would be good to combine them all into one open.
-import casatools
+# -built operations.  All table opens for a measurement set go through
+# MSMetadataSnapshot, so each table is opened once per run.
 import math
+import multiprocessing
+import os
+import threading
 import numpy as np
 import datetime
+from contextlib import contextmanager
+
+from emerlin2caom2 import metrics
+
+# rows of the main table read per getcol call when a column is scanned
+CHUNK_ROWS = 1000000
+# bin edges in m for baseline length histograms; the longest e-MERLIN baseline is 217 km
+UV_BINS = np.linspace(0., 250e3, 51)
+# gaps in the data longer than this many integrations split the time samples, shorter ones are bridged
+TIME_GAP_INTEGRATIONS = 2.
+
+
+# casatools tools are not thread or fork safe, so every thread of every process gets its own instances
+_tools = threading.local()
+
+
+def get_tool(tool_name):
+    """
+    Get the casatools tool of the calling thread, creating it on first use. casatools is slow to import, so it is
+    only imported when a tool is first needed. A process started by fork does not reuse its parent's tools.
+    :param tool_name: Name of the tool in casatools, e.g. 'table'
+    :returns: tool instance
+    """
+    tools = getattr(_tools, 'tools', None)
+    if tools is None or _tools.pid != os.getpid():
+        tools = _tools.tools = {}
+        _tools.pid = os.getpid()
+    if tool_name not in tools:
+        import casatools
+        tools[tool_name] = getattr(casatools, tool_name)()
+    return tools[tool_name]
+
+
+def discard_tool(tool_name):
+    """
+    Drop the calling thread's instance of a tool, so that the next use starts from a new one.
+    :param tool_name: Name of the tool in casatools
+    """
+    getattr(_tools, 'tools', {}).pop(tool_name, None)
+
+
+@contextmanager
+def open_tool(tool_name, path):
+    """
+    Open a table or measurement set with the calling thread's instance of a tool, and close it on leaving the
+    block, whether or not an error was raised. If the open itself fails, the instance is discarded so that no
+    state leaks into the next use.
+    :param tool_name: Name of the tool in casatools: 'msmetadata', 'ms' or 'table'
+    :param path: Table or measurement set to open
+    :returns: the open tool
+    """
+    tool = get_tool(tool_name)
+    try:
+        tool.open(path)
+    except Exception:
+        discard_tool(tool_name)
+        raise
+    try:
+        yield tool
+    finally:
+        tool.close()
+
+
+_snapshots = {}
+
+
+class MSMetadataSnapshot:
+    """
+    Metadata of one measurement set, collected lazily. The msmetadata tool, the main table and each sub-table are
+    opened at most once, the first time one of their values is needed, and the values are then kept for the run.
+    Use get_snapshot to share one instance between all callers.
+    :param ms_file: Input measurement set
+    """
+    # columns read from each sub-table when it is first opened
+    subtable_columns = {
+        'ANTENNA': ['DISH_DIAMETER', 'POSITION', 'FLAG_ROW'],
+        'FEED': ['POLARIZATION_TYPE', 'NUM_RECEPTORS'],
+        'FIELD': ['NAME', 'REFERENCE_DIR'],
+        'OBSERVATION': ['RELEASE_DATE', 'TIME_RANGE'],
+        'SPECTRAL_WINDOW': [],
+    }
+    # columns whose cells may differ in shape from row to row, read with getvarcol as a list of one array per row
+    subtable_varcolumns = {
+        'SPECTRAL_WINDOW': ['CHAN_FREQ', 'CHAN_WIDTH'],
+    }
+
+    def __init__(self, ms_file):
+        self.ms_file = ms_file
+        self._msmd_elements = None
+        self._subtables = {}
+        self._obstime = None
+        self._scan_sum = None
+        self._column_stats = None
+
+    @property
+    def msmd_elements(self):
+        """
+        Dictionary of everything read through msmetadata, collected with a single open.
+        """
+        if self._msmd_elements is None:
+            self._msmd_elements = self._collect_msmd()
+        return self._msmd_elements
+
+    def _collect_msmd(self):
+        with metrics.timed('casa.msmd', self.ms_file):
+            with open_tool('msmetadata', self.ms_file) as msmd:
+                antenna_ids = msmd.antennaids()
+                field_ids = range(msmd.nfields())
+                first_scan = msmd.scannumbers()[0]
+                int_time = msmd.exposuretime(first_scan)['value']
+                # the per-field timestamps are reduced to intervals straight away; the raw arrays are not kept
+                gap = TIME_GAP_INTEGRATIONS * int_time
+                field_intervals = [time_intervals(msmd.timesforfield(x), int_time, gap) for x in field_ids]
+
+                msmd_elements = {
+                    'mssources': msmd.fieldnames(),
+                    'phs_cntr': [msmd.phasecenter(x) for x in field_ids],
+                    'field_intervals': field_intervals,
+                    'tel_name': msmd.observatorynames(),
+                    'antennas': msmd.antennanames(),
+                    'ante_off': [msmd.antennaoffset(x) for x in antenna_ids],
+                    'ante_pos': [msmd.antennaposition(x) for x in antenna_ids],
+                    'obs_pos' : msmd.observatoryposition(),
+                    'prop_id' : msmd.projects()[0],
+                    #'num_scans': len(msmd.scansforfield(targets[0])),
+                    'int_time' : int_time
+                }
+
+        intervals = merge_intervals(field_intervals, gap)
+        msmd_elements['time_intervals'] = intervals
+        msmd_elements['exposure'] = float(np.sum(intervals[:, 1] - intervals[:, 0]))
+
+        # every spectral window is read from the SPECTRAL_WINDOW table in one open, rather than once per window
+        spectral_window = self.subtable('SPECTRAL_WINDOW')
+        spw = spectral_windows(spectral_window['CHAN_FREQ'], spectral_window['CHAN_WIDTH'])
+
+        # Dictionary of changes
+        elements_convert = {
+            'spw': spw,
+            'wl_upper': np.max(spw['wl_upper']),
+            'wl_lower': np.min(spw['wl_lower']),
+            'chan_res': np.sum(spw['wl_upper'] - spw['wl_lower']) / np.sum(spw['nchan']),
+            'nchan': int(np.sum(spw['nchan'])),
+            'bp_name': emerlin_band(spw['freq_min']),
+        }
+
+        # Update dictionary with converted values and additions.
+        msmd_elements.update(elements_convert)
+        return msmd_elements
+
+    def subtable(self, name):
+        """
+        Columns of a sub-table, read with a single open.
+        :param name: Sub-table name, one of subtable_columns
+        :returns: dictionary of column name to values
+        """
+        if name not in self._subtables:
+            with metrics.timed('casa.subtable', os.path.join(self.ms_file, name)):
+                with open_tool('table', os.path.join(self.ms_file, name)) as tb:
+                    columns = {col: tb.getcol(col) for col in self.subtable_columns[name]}
+                    for col in self.subtable_varcolumns.get(name, []):
+                        cells = tb.getvarcol(col)
+                        columns[col] = [np.ravel(cells['r{}'.format(i + 1)]) for i in range(len(cells))]
+                    self._subtables[name] = columns
+        return self._subtables[name]
+
+    @property
+    def obstime(self):
+        """
+        Start and end time of the observation in mjd sec.
+        """
+        if self._obstime is None:
+            self._obstime = self.time_range()
+        return self._obstime
+
+    def time_range(self, full_scan=False):
+        """
+        Find the start and end time of the observation without loading the TIME column. In order of preference
+        the range comes from the time intervals collected through msmetadata, which are shared with msmd_collect,
+        then from TIME_RANGE in the OBSERVATION table, and only then from a chunked scan of the TIME column.
+        :param full_scan: If True, always scan the TIME column
+        :returns: t_ini, t_end in mjd sec
+        """
+        if not full_scan:
+            intervals = self.msmd_elements['time_intervals']
+            if len(intervals):
+                return intervals[0, 0], intervals[-1, 1]
+            time_range = self.subtable('OBSERVATION')['TIME_RANGE']
+            t_ini, t_end = np.min(time_range[0]), np.max(time_range[1])
+            if 0 < t_ini < t_end:
+                return t_ini, t_end
+        return self.scan_time_column()
+
+    def scan_time_column(self, chunk_rows=CHUNK_ROWS):
+        """
+        Find the start and end time by reading the TIME column of the main table in blocks of chunk_rows, so memory
+        use does not grow with the size of the measurement set.
+        :param chunk_rows: Number of rows read per block
+        :returns: t_ini, t_end in mjd sec
+        """
+        t_ini, t_end = np.inf, -np.inf
+        for block in iter_columns(self.ms_file, ['TIME'], chunk_rows):
+            t_ini = min(t_ini, np.min(block['TIME']))
+            t_end = max(t_end, np.max(block['TIME']))
+        return t_ini, t_end
+
+    @property
+    def column_stats(self):
+        """
+        Statistics of the UVW, antenna and flag columns of the main table, see column_statistics. This reads every
+        row, so it is only collected when asked for, and is not part of load_snapshot.
+        """
+        if self._column_stats is None:
+            self._column_stats = column_statistics(self.ms_file)
+        return self._column_stats
+
+    @property
+    def scan_summary(self):
+        """
+        Summary of scan information in nested dictionaries.
+        """
+        if self._scan_sum is None:
+            with open_tool('ms', self.ms_file) as ms:
+                self._scan_sum = ms.getscansummary()
+        return self._scan_sum
+
+    @property
+    def polarization(self):
+        """
+        Polarisation type and number of dimensions, from the FEED table.
+        """
+        feed = self.subtable('FEED')
+        pol_type = list(feed['POLARIZATION_TYPE'][:,0])
+        if pol_type == ['R','L']:
+            pol_type = ['RR', 'LL']
+        return pol_type, feed['NUM_RECEPTORS'][0]
+
+    @property
+    def release_date(self):
+        """
+        Data release date, from the OBSERVATION table.
+        """
+        return mjdtodate(self.subtable('OBSERVATION')['RELEASE_DATE'][0]/60./60./24)
+
+
+def get_snapshot(ms_file):
+    """
+    Get the shared metadata snapshot of a measurement set, creating it on first use.
+    :param ms_file: Input measurement set
+    :returns: MSMetadataSnapshot
+    """
+    key = os.path.normpath(ms_file)
+    if key not in _snapshots:
+        _snapshots[key] = MSMetadataSnapshot(key)
+    return _snapshots[key]
+
+
+def clear_snapshots():
+    """
+    Release all measurement set snapshots, e.g. at the end of a run.
+    """
+    _snapshots.clear()
+
+
+def load_snapshot(ms_file):
+    """
+    Read everything the metadata of a measurement set plane needs into its snapshot. Only msmetadata and the
+    sub-tables are read; no column of the main table is scanned.
+    :param ms_file: Input measurement set
+    :returns: MSMetadataSnapshot, with no tables left to open
+    """
+    snapshot = get_snapshot(ms_file)
+    snapshot.msmd_elements
+    for name in snapshot.subtable_columns:
+        snapshot.subtable(name)
+    snapshot.obstime
+    return snapshot
+
+
+def prefetch_snapshots(ms_files, workers=4):
+    """
+    Load the snapshots of several measurement sets at once, each in its own worker process so that the casatools
+    tools, which are process-wide singletons, are never shared. The loaded snapshots are then used by every
+    function of this module without opening a table.
+    :param ms_files: Input measurement sets
+    :param workers: Number of worker processes. If 0 or 1, or if this is already a daemonic worker, e.g. in
+                    batch mode, the measurement sets are read one after another in this process.
+    """
+    ms_files = [x for x in dict.fromkeys(os.path.normpath(x) for x in ms_files) if x not in _snapshots]
+    if workers <= 1 or len(ms_files) <= 1 or multiprocessing.current_process().daemon:
+        for ms_file in ms_files:
+            load_snapshot(ms_file)
+        return
+    # spawn, as casatools is not fork safe; a fresh process per measurement set
+    context = multiprocessing.get_context('spawn')
+    collect = [(x, metrics.enabled()) for x in ms_files]
+    with context.Pool(processes=min(workers, len(ms_files)), maxtasksperchild=1) as pool:
+        for snapshot, worker_metrics in pool.imap(_load_snapshot_in_worker, collect):
+            _snapshots[snapshot.ms_file] = snapshot
+            if worker_metrics is not None:
+                metrics.merge(worker_metrics)
+
+
+def _load_snapshot_in_worker(args):
+    # metrics are per process, so a worker collects its own and hands them back with the snapshot
+    ms_file, collect_metrics = args
+    if collect_metrics:
+        metrics.start()
+    snapshot = load_snapshot(ms_file)
+    return snapshot, metrics.summary() if collect_metrics else None
+
+
+def iter_columns(ms_file, columns, chunk_rows=CHUNK_ROWS):
+    """
+    Read columns of the main table in blocks of rows, so that memory use is set by chunk_rows rather than by the
+    size of the measurement set. The table is held open until the generator is exhausted or closed, so do not open
+    other tables on the same thread while consuming it.
+    :param ms_file: Input measurement set
+    :param columns: Names of the columns to read
+    :param chunk_rows: Number of rows per block
+    :returns: generator of dictionaries of column name to the values for one block of rows
+    """
+    with open_tool('table', ms_file) as tb:
+        nrows = tb.nrows()
+        for startrow in range(0, nrows, chunk_rows):
+            block = {col: tb.getcol(col, startrow, chunk_rows) for col in columns}
+            metrics.add('rows_read', min(chunk_rows, nrows - startrow))
+            yield block
+
+
+def column_statistics(ms_file, chunk_rows=CHUNK_ROWS, uv_bins=UV_BINS):
+    """
+    Aggregate per-row values of the main table in a single streaming pass. Baseline lengths only include unflagged
+    cross-correlations.
+    :param ms_file: Input measurement set
+    :param chunk_rows: Number of rows per block
+    :param uv_bins: Bin edges in m for the baseline length histogram
+    :returns: dictionary of nrows, uvdist_min, uvdist_max (m), uv_hist, uv_bins, ant_rows (rows per antenna id)
+              and flag_fraction (fraction of rows flagged)
+    """
+    with metrics.timed('casa.column_stats', ms_file):
+        return _column_statistics(ms_file, chunk_rows, uv_bins)
+
+
+def _column_statistics(ms_file, chunk_rows, uv_bins):
+    nrows = 0
+    flagged = 0
+    uvdist_min, uvdist_max = np.inf, 0.
+    uv_hist = np.zeros(len(uv_bins) - 1, dtype=np.int64)
+    ant_rows = np.zeros(0, dtype=np.int64)
+    for block in iter_columns(ms_file, ['UVW', 'ANTENNA1', 'ANTENNA2', 'FLAG_ROW'], chunk_rows):
+        ante1, ante2, flag_row = block['ANTENNA1'], block['ANTENNA2'], block['FLAG_ROW']
+        nrows += len(ante1)
+        flagged += np.count_nonzero(flag_row)
+
+        counts = np.bincount(np.concatenate([ante1, ante2]))
+        if len(counts) > len(ant_rows):
+            ant_rows = np.pad(ant_rows, (0, len(counts) - len(ant_rows)))
+        ant_rows[:len(counts)] += counts
+
+        use = (ante1 != ante2) & ~flag_row
+        uvdist = np.hypot(block['UVW'][0][use], block['UVW'][1][use])
+        if uvdist.size:
+            uvdist_min = min(uvdist_min, uvdist.min())
+            uvdist_max = max(uvdist_max, uvdist.max())
+        uv_hist += np.histogram(uvdist, uv_bins)[0]
+
+    return {
+        'nrows': nrows,
+        'uvdist_min': uvdist_min if np.isfinite(uvdist_min) else 0.,
+        'uvdist_max': uvdist_max,
+        'uv_hist': uv_hist,
+        'uv_bins': uv_bins,
+        'ant_rows': ant_rows,
+        'flag_fraction': flagged / nrows if nrows else 0.,
+    }
+
+
+def get_column_stats(ms_file):
+    """
+    Get streaming statistics of the main table, computed once per measurement set.
+    :param ms_file: Input measurement set
+    :returns: dictionary, see column_statistics
+    """
+    return get_snapshot(ms_file).column_stats
+
+
+def spectral_windows(chan_freqs, chan_widths):
+    """
+    Wavelength coverage and resolving power of each spectral window, from the channels of every window at once.
+    :param chan_freqs: list of arrays of the channel centre frequencies in Hz, one array per spectral window, as
+                       CHAN_FREQ in the SPECTRAL_WINDOW table
+    :param chan_widths: list of arrays of the channel widths in Hz, as CHAN_WIDTH
+    :returns: dictionary of arrays with an element per spectral window that has channels: nchan, wl_lower and
+              wl_upper in m, and resolving_power, the centre frequency over the mean channel width; and
+              freq_min, the lowest channel frequency in Hz
+    :raises ValueError: if no spectral window has any channels
+    """
+    nchan = np.array([len(x) for x in chan_freqs])
+    if not np.any(nchan):
+        raise ValueError('No spectral window has any channels')
+    freqs = np.concatenate([np.ravel(x) for x in chan_freqs])
+    widths = np.abs(np.concatenate([np.ravel(x) for x in chan_widths]))
+    nchan = nchan[nchan > 0]
+    offsets = np.concatenate(([0], np.cumsum(nchan)[:-1]))
+    # the channels of a window are contiguous, so each window is a segment reduced with reduceat
+    freq_lower = np.minimum.reduceat(freqs - 0.5 * widths, offsets)
+    freq_upper = np.maximum.reduceat(freqs + 0.5 * widths, offsets)
+    mean_width = np.add.reduceat(widths, offsets) / nchan
+    return {
+        'nchan': nchan,
+        'wl_lower': freq2wl(freq_upper),
+        'wl_upper': freq2wl(freq_lower),
+        'resolving_power': 0.5 * (freq_lower + freq_upper) / mean_width,
+        'freq_min': np.min(freqs),
+    }
+
+
+def time_intervals(times, int_time, gap=0.):
+    """
+    Reduce the timestamps of a field to the contiguous intervals in which it was observed. Each timestamp is the
+    centre of an integration, so every interval is widened by half an integration at both ends.
+    :param times: Timestamps in mjd sec, in any order and possibly repeated, e.g. from msmd.timesforfield
+    :param int_time: Integration time in sec
+    :param gap: Longest gap in sec between the end of one integration and the start of the next that is bridged
+    :returns: array of shape (n, 2) of interval start and end times in mjd sec, in time order
+    """
+    times = np.unique(times)
+    if not len(times):
+        return np.empty((0, 2))
+    breaks = np.flatnonzero(np.diff(times) > int_time + gap)
+    starts = times[np.concatenate(([0], breaks + 1))]
+    ends = times[np.concatenate((breaks, [len(times) - 1]))]
+    return np.column_stack((starts - 0.5 * int_time, ends + 0.5 * int_time))
+
+
+def merge_intervals(intervals, gap=0.):
+    """
+    Merge overlapping intervals, or intervals separated by no more than gap, e.g. those of every field of an
+    observation into the times the array was observing.
+    :param intervals: list of arrays of shape (n, 2) of start and end times, see time_intervals
+    :param gap: Longest gap that is bridged, in the same units as the intervals
+    :returns: array of shape (n, 2) of merged start and end times, in time order
+    """
+    intervals = np.concatenate([np.reshape(x, (-1, 2)) for x in intervals] or [np.empty((0, 2))])
+    if not len(intervals):
+        return intervals
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+    # the end of the merged interval so far is the largest end seen, as one interval may contain the next
+    ends = np.maximum.accumulate(intervals[:, 1])
+    breaks = np.flatnonzero(intervals[1:, 0] - ends[:-1] > gap)
+    starts = intervals[np.concatenate(([0], breaks + 1)), 0]
+    ends = ends[np.concatenate((breaks, [len(intervals) - 1]))]
+    return np.column_stack((starts, ends))
 
-msmd = casatools.msmetadata()
-ms = casatools.ms()
-tb = casatools.table()
 
 def msmd_collect(ms_file, targ_name):
     """
@@ -19,53 +472,11 @@ def msmd_collect(ms_file, targ_name):
     metadata
 
     """
-    
-    msmd.open(ms_file)
-    nspw = msmd.nspw()
-
-    antenna_ids = msmd.antennaids()
-    field_ids = range(msmd.nfields())
     targets = targ_name.split(",")
     if len(targets) > 1:
         print("Warning: Multiple Science Targets, Position included for first target only.")
-    first_scan = msmd.scannumbers()[0]    
-
-    msmd_elements = {
-        'mssources': msmd.fieldnames(),
-        'phs_cntr': [msmd.phasecenter(x) for x in field_ids],
-        'field_time': [msmd.timesforfield(x) for x in field_ids],
-        'tel_name': msmd.observatorynames(),
-        'antennas': msmd.antennanames(),
-        'ante_off': [msmd.antennaoffset(x) for x in antenna_ids],
-        'ante_pos': [msmd.antennaposition(x) for x in antenna_ids],
-        'obs_pos' : msmd.observatoryposition(),
-        'wl_upper': msmd.chanfreqs(0)[0],
-        'wl_lower': msmd.chanfreqs(nspw-1)[-1],
-        'chan_res': msmd.chanwidths(0)[0],
-        'nchan'   : nspw * len(msmd.chanwidths(0)),
-        'prop_id' : msmd.projects()[0],
-        #'num_scans': len(msmd.scansforfield(targets[0])),
-        'int_time' : msmd.exposuretime(first_scan)['value']
-    }
 
-    # Not sure if this is still necessary with latest merge; keep for now? 
-    nice_order = ['Lo', 'Mk2', 'Pi', 'Da', 'Kn', 'De', 'Cm']
-    refant = [a for a in nice_order if a in msmd_elements['antennas']]
-    geo = msmd.antennaposition(refant[0])
-    msmd.close()
-
-    # Dictionary of changes
-    elements_convert = {
-        'wl_upper': freq2wl(msmd_elements['wl_upper']),
-        'wl_lower': freq2wl(msmd_elements['wl_lower']),
-        'chan_res': freq2wl(msmd_elements['chan_res']), 
-        'bp_name': emerlin_band(msmd_elements['wl_upper']),
-    }
-
-    # Update dictionary with converted values and additions.
-    msmd_elements.update(elements_convert)
-
-    return msmd_elements
+    return dict(get_snapshot(ms_file).msmd_elements)
 
 def ms_other_collect(ms_file):
     """
@@ -74,13 +485,16 @@ def ms_other_collect(ms_file):
     returns ms_other_elements: dictionary of non-msmd-retrievable elements \
                                which need various table/col combinations.
     """
+    snapshot = get_snapshot(ms_file)
+    obs_start_time, obs_stop_time = snapshot.obstime
+    polar_states, polar_dim = snapshot.polarization
 
     ms_other_elements = {
-        'data_release': get_release_date(ms_file),
-        'obs_start_time': get_obstime(ms_file)[0],
-        'obs_stop_time': get_obstime(ms_file)[1],
-        'polar_dim': get_polar(ms_file)[1],
-        'polar_states': get_polar(ms_file)[0]
+        'data_release': snapshot.release_date,
+        'obs_start_time': obs_start_time,
+        'obs_stop_time': obs_stop_time,
+        'polar_dim': polar_dim,
+        'polar_states': polar_states
     }
 
 
@@ -123,30 +537,65 @@ def get_polar(ms_file):
     :param ms_file: Name of measurement set
     :returns: polarisation type and number of dimensions.
     """
-    tb.open(ms_file+'/FEED')
-    polarization = tb.getcol('POLARIZATION_TYPE')
-    pol_dim = tb.getcol('NUM_RECEPTORS')[0]
-    tb.close()
-    pol_type = list(polarization[:,0])    
-    if pol_type == ['R','L']:
-        pol_type = ['RR', 'LL']
-    for i in range(len(pol_type)):
-        pol_type[i] = pol_type[i]
- 
-    return pol_type, pol_dim
+    return get_snapshot(ms_file).polarization
 
 def get_uvdist(ms_file):
     """
-    Collect list of uvdistances or baselines.
+    Collect list of uvdistances or baselines. For summary values use get_column_stats, which does not hold the
+    whole column in memory.
     :param ms_file: Name of measurement set
     :returns: list of uv distances in m.
     """
-    tb.open(ms_file)
-    uvw = tb.getcol('UVW')
-    tb.close()
-    uvdist = numpy.sqrt(uvw[0]**2+uvw[1]**2)
-    
-    return uvdist
+    uvdist = [np.hypot(block['UVW'][0], block['UVW'][1]) for block in iter_columns(ms_file, ['UVW'])]
+    return np.concatenate(uvdist) if uvdist else np.zeros(0)
+
+def angular_resolution(wavelength, baseline):
+    """
+    Diffraction-limited angular resolution of an interferometer, lambda / B.
+    :param wavelength: Wavelength in m, scalar or array
+    :param baseline: Baseline length in m
+    :returns: resolution in arcsec
+    """
+    return np.rad2deg(np.asarray(wavelength) / baseline) * 3600.
+
+def angular_separation(ra1, dec1, ra2, dec2):
+    """
+    Great circle distance between two positions.
+    :param ra1, dec1: first position in degrees
+    :param ra2, dec2: second position(s) in degrees, scalar or array
+    :returns: separation in degrees
+    """
+    ra1, dec1, ra2, dec2 = (np.deg2rad(x) for x in (ra1, dec1, ra2, dec2))
+    cos_sep = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+    return np.rad2deg(np.arccos(np.clip(cos_sep, -1., 1.)))
+
+def bounding_circle(ra, dec, radius=0.):
+    """
+    A circle enclosing circles of the same radius around several positions, centred on their mean direction so
+    that it does not depend on the order of the positions.
+    :param ra, dec: positions in degrees, arrays
+    :param radius: radius of the circle around each position in degrees
+    :returns: ra, dec and radius of the enclosing circle in degrees
+    """
+    ra_rad, dec_rad = np.deg2rad(ra), np.deg2rad(dec)
+    xyz = np.array([np.cos(dec_rad) * np.cos(ra_rad), np.cos(dec_rad) * np.sin(ra_rad), np.sin(dec_rad)])
+    x, y, z = np.mean(xyz, axis=1)
+    norm = np.sqrt(x * x + y * y + z * z)
+    if norm < 1e-9:
+        # positions spread evenly over the sky have no mean direction
+        return float(ra[0]), float(dec[0]), 180.
+    ra_c = np.rad2deg(np.arctan2(y, x)) % 360
+    dec_c = np.rad2deg(np.arcsin(np.clip(z / norm, -1., 1.)))
+    return float(ra_c), float(dec_c), float(radius + np.max(angular_separation(ra_c, dec_c, ra, dec)))
+
+def primary_beam_radius(wavelength, dish_diameter):
+    """
+    Half width at half maximum of the primary beam of a dish, 1.22 lambda / D / 2.
+    :param wavelength: Wavelength in m
+    :param dish_diameter: Dish diameter in m
+    :returns: radius in degrees
+    """
+    return np.rad2deg(0.5 * 1.22 * wavelength / dish_diameter)
 
 def get_scan_sum(ms_file):
     """
@@ -154,10 +603,7 @@ def get_scan_sum(ms_file):
     :param ms_file: input measurement set name
     :returns scan_sum: Summary of scan information in nested dictionaries
     """
-    ms.open(ms_file)
-    scan_sum = ms.getscansummary()
-    ms.close()
-    return scan_sum
+    return get_snapshot(ms_file).scan_summary
 
 def target_position(ms_file, target):
     """
@@ -168,12 +614,11 @@ def target_position(ms_file, target):
     :returns: [ra, dec] in degrees
     """
     targets = target.split(",")
-    tb.open(ms_file+'/FIELD')
-    source_name = tb.getcol('NAME')
-    source_ref = tb.getcol('REFERENCE_DIR')
+    field = get_snapshot(ms_file).subtable('FIELD')
+    source_name = field['NAME']
+    source_ref = field['REFERENCE_DIR']
     source_coords_ra = np.rad2deg(source_ref[0][0][source_name.tolist().index(targets[0])]) % 360
     source_coords_dec = np.rad2deg(source_ref[1][0][source_name.tolist().index(targets[0])]) % 360
-    tb.close()
     return [source_coords_ra, source_coords_dec]
 
 def target_position_all(ms_file):
@@ -183,12 +628,11 @@ def target_position_all(ms_file):
     :param target: target object name
     :returns: ra, dec, names (coords in degrees)
     """
-    tb.open(ms_file+'/FIELD')
-    source_name = tb.getcol('NAME')
-    source_ref = tb.getcol('REFERENCE_DIR')
+    field = get_snapshot(ms_file).subtable('FIELD')
+    source_name = field['NAME']
+    source_ref = field['REFERENCE_DIR']
     source_coords_ra = [np.rad2deg(x) % 360 for x in source_ref[0]]
     source_coords_dec = [np.rad2deg(x) % 360 for x in source_ref[1]]
-    tb.close()
     return {"ra":source_coords_ra[0], "dec":source_coords_dec[0], "name":source_name}
   
 def polar2cart(r, theta, phi):
@@ -202,6 +646,38 @@ def polar2cart(r, theta, phi):
     z = r * math.cos(theta)
     return {'x':x, 'y':y, 'z':z}
 
+def longest_baseline(positions, flags=None):
+    """
+    Length of the longest baseline between two antennas, from their positions rather than the UVW column.
+    :param positions: antenna positions in m, shape (3, number of antennas), as in the POSITION column of the
+                      ANTENNA table
+    :param flags: FLAG_ROW of the ANTENNA table; flagged antennas are left out
+    :returns: baseline length in m, 0 if there are fewer than two antennas
+    """
+    positions = np.asarray(positions, dtype=float).T
+    if flags is not None:
+        positions = positions[~np.asarray(flags, dtype=bool)]
+    if len(positions) < 2:
+        return 0.
+    return float(np.max(np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=-1)))
+
+def get_longest_baseline(ms_file):
+    """
+    Get the length of the longest baseline of the array.
+    :param ms_file: Name of measurement set
+    :returns: baseline length in m
+    """
+    antenna = get_snapshot(ms_file).subtable('ANTENNA')
+    return longest_baseline(antenna['POSITION'], antenna['FLAG_ROW'])
+
+def get_dish_diameters(ms_file):
+    """
+    Get the dish diameter of each antenna.
+    :param ms_file: Name of measurement set
+    :returns: array of diameters in m
+    """
+    return get_snapshot(ms_file).subtable('ANTENNA')['DISH_DIAMETER']
+
 def get_release_date(ms_file):
     """
     To do convert to ivoa:datetime
@@ -209,10 +685,7 @@ def get_release_date(ms_file):
     :param ms_file: Name of measurement set
     :returns rel_date: date in mjd seconds... which is what caom wants.
     """
-    tb.open(ms_file+'/OBSERVATION')
-    rel_date = mjdtodate(tb.getcol('RELEASE_DATE')[0]/60./60./24)
-    tb.close()
-    return rel_date
+    return get_snapshot(ms_file).release_date
 
 def mjdtodate(mjd):
     """
@@ -225,16 +698,14 @@ def mjdtodate(mjd):
     return date
 
 
-def get_obstime(ms_file):
+def get_obstime(ms_file, full_scan=False):
     """
     Retrieve start and end time of total observation in mjd seconds.
     :param ms_file: Name of measurement set
+    :param full_scan: If True, scan the whole TIME column rather than using the recorded time ranges
     :returns t_ini, t_end: datetimes initial (or start time), \
                            and Time End (finish time) in mjd sec
     """
-    ms.open(ms_file)
-    t = ms.getdata('TIME')['time']
-    t_ini = np.min(t)
-    t_end = np.max(t)
-    ms.close()
-    return t_ini, t_end
+    if full_scan:
+        return get_snapshot(ms_file).time_range(full_scan=True)
+    return get_snapshot(ms_file).obstime
@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class ChecksumCache:
+    """
+    Persistent cache of file checksums, stored in an SQLite database. An entry is only used while the stat signature
+    of the file (size, modification time and inode) is unchanged, so re-running on the same pipeline output only
+    hashes the files that have changed. Files within measurement sets are cached individually. When the cache holds
+    more than max_entries, the least recently used entries are evicted.
+    New entries and use times are held in memory and written in short transactions of up to flush_every changes,
+    and at every flush, so that several runs can share one cache directory at once.
+    :param cache_dir: Directory in which the database is kept, created if necessary
+    :param max_entries: Maximum number of files to keep in the cache
+    :param flush_every: Number of pending changes that are written to the database together
+    :param timeout: Seconds to wait for another run holding the database lock
+    """
+    db_name = 'checksums.sqlite'
+
+    def __init__(self, cache_dir, max_entries=1000000, flush_every=1000, timeout=60.):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_file = os.path.join(cache_dir, self.db_name)
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        # checksums are calculated on a thread pool, so the connection is shared behind a lock
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._used = {}
+        self._conn = sqlite3.connect(self.db_file, timeout=timeout, check_same_thread=False)
+        # readers do not block the writer, or each other, in write-ahead logging mode
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS checksums ('
+                           'path TEXT NOT NULL, algorithm TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, '
+                           'inode INTEGER, digest TEXT, last_used REAL, PRIMARY KEY (path, algorithm))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS checksums_last_used ON checksums (last_used)')
+        self._conn.commit()
+
+    def get(self, fqn, stat_result, algorithm='md5'):
+        """
+        Look up the checksum of a file.
+        :param fqn: Name and path of the file
+        :param stat_result: os.stat result for the file
+        :param algorithm: Name of the hash algorithm
+        :returns: hex digest, or None if the file is not cached or has changed
+        """
+        path = os.path.abspath(fqn)
+        with self._lock:
+            row = self._pending.get((path, algorithm))
+            if row is None:
+                row = self._conn.execute('SELECT size, mtime_ns, inode, digest FROM checksums '
+                                         'WHERE path = ? AND algorithm = ?', (path, algorithm)).fetchone()
+            if row and tuple(row[:3]) == (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino):
+                self._used[(path, algorithm)] = time.time()
+                self.hits += 1
+                self._flush_if_full()
+                return row[3]
+            self.misses += 1
+            return None
+
+    def put(self, fqn, stat_result, digest, algorithm='md5'):
+        """
+        Store the checksum of a file against its current stat signature.
+        :param fqn: Name and path of the file
+        :param stat_result: os.stat result for the file, taken before it was hashed
+        :param digest: hex digest of the file
+        :param algorithm: Name of the hash algorithm
+        """
+        with self._lock:
+            self._pending[(os.path.abspath(fqn), algorithm)] = (stat_result.st_size, stat_result.st_mtime_ns,
+                                                                stat_result.st_ino, digest, time.time())
+            self._flush_if_full()
+
+    def _flush_if_full(self):
+        if len(self._pending) + len(self._used) >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        # called with the lock held; the write transaction lasts only as long as these statements
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   [key + value for key, value in self._pending.items()])
+            self._conn.executemany('UPDATE checksums SET last_used = ? WHERE path = ? AND algorithm = ?',
+                                   [(used,) + key for key, used in self._used.items()])
+        self._pending = {}
+        self._used = {}
+
+    def flush(self):
+        """
+        Write the pending entries and use times to the database, e.g. at the end of each batch of files hashed.
+        """
+        with self._lock:
+            self._flush()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until at most max_entries remain.
+        :returns: Number of entries removed
+        """
+        with self._lock:
+            self._flush()
+            count = self._conn.execute('SELECT COUNT(*) FROM checksums').fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                self._conn.execute('DELETE FROM checksums WHERE rowid IN '
+                                   '(SELECT rowid FROM checksums ORDER BY last_used, rowid LIMIT ?)', (excess,))
+            self._conn.commit()
+        return max(excess, 0)
+
+    def stats(self):
+        """
+        :returns: dictionary of cache hits and misses since the cache was opened
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        """
+        Apply eviction and write all pending entries to disk.
+        """
+        self.evict()
+        self._conn.close()
+
+    def __str__(self):
+        return 'checksum cache {}: {} hits, {} misses'.format(self.db_file, self.hits, self.misses)
@@ -0,0 +1,154 @@
+import os
+import threading
+import zlib
+
+# algorithm of a manifest entry, from the length of its hex digest
+DIGEST_LENGTHS = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'sha512'}
+
+
+def read_manifest(manifest_file):
+    """
+    Read an md5sum style manifest: one '<hex digest>  <path>' line per file, with '*' before the path in binary
+    mode. Relative paths are relative to the directory of the manifest.
+    :param manifest_file: Name of the manifest
+    :returns: dictionary of (absolute path, algorithm) to hex digest
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    entries = {}
+    with open(manifest_file) as file:
+        for line in file:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            digest, _, path = line.partition(' ')
+            algorithm = DIGEST_LENGTHS.get(len(digest))
+            if algorithm is None or not path:
+                continue
+            path = path[1:] if path[:1] in (' ', '*') else path
+            entries[(os.path.abspath(os.path.join(base_dir, path)), algorithm)] = digest.lower()
+    return entries
+
+
+def find_manifests(storage_dir, names):
+    """
+    Find the manifests in a pipeline output directory and in its immediate subdirectories, e.g. splits/.
+    Measurement sets are not searched.
+    :param storage_dir: Pipeline output directory
+    :param names: File names of the manifests, e.g. ('MD5SUMS', 'SHA256SUMS')
+    :returns: list of the manifests found, those in storage_dir first
+    """
+    if not names or not os.path.isdir(storage_dir):
+        return []
+    directories = [storage_dir] + sorted(entry.path for entry in os.scandir(storage_dir)
+                                         if entry.is_dir() and not entry.name.endswith('.ms'))
+    return [os.path.join(directory, name) for directory in directories for name in names
+            if os.path.isfile(os.path.join(directory, name))]
+
+
+class ChecksumManifest:
+    """
+    Checksums from manifests written when pipeline outputs are moved to archive storage, used in place of hashing.
+    An entry is trusted while the file has not been modified since its manifest was written. Files that are not
+    listed, or have changed, fall through to a ChecksumCache if one is given, and are otherwise hashed. Has the
+    get and put methods of ChecksumCache, so it is passed to the hashing functions as their cache.
+    :param manifest_files: Names of the manifests, e.g. a global manifest and the one in the storage directory
+    :param cache: ChecksumCache for the files not in the manifests, or None
+    :param verify_fraction: Fraction of the listed files that are hashed anyway and compared with the manifest
+    """
+    def __init__(self, manifest_files, cache=None, verify_fraction=0.):
+        # later manifests take precedence, so a manifest in the storage directory overrides a global one
+        self.cache = cache
+        self.verify_fraction = verify_fraction
+        self.hits = 0
+        self.misses = 0
+        self.verified = 0
+        self.mismatches = []
+        self._entries = {}
+        self._to_verify = {}
+        self._lock = threading.Lock()
+        for manifest_file in manifest_files:
+            manifest_mtime = os.stat(manifest_file).st_mtime
+            for key, digest in read_manifest(manifest_file).items():
+                self._entries[key] = (digest, manifest_mtime)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sampled(self, path):
+        """
+        :param path: Absolute name of a file
+        :returns: True if the file is in the sample verified against the manifest. The sample depends only on the
+                  path, so it is the same on every run.
+        """
+        return zlib.crc32(path.encode('utf-8')) < self.verify_fraction * 2 ** 32
+
+    def get(self, fqn, stat_result, algorithm='md5'):
+        """
+        Look up the checksum of a file.
+        :param fqn: Name and path of the file
+        :param stat_result: os.stat result for the file
+        :param algorithm: Name of the hash algorithm
+        :returns: hex digest, or None if the file has to be hashed
+        """
+        path = os.path.abspath(fqn)
+        entry = self._entries.get((path, algorithm))
+        if entry is not None and stat_result.st_mtime <= entry[1]:
+            if not self.sampled(path):
+                with self._lock:
+                    self.hits += 1
+                return entry[0]
+            with self._lock:
+                self._to_verify[(path, algorithm)] = entry[0]
+            return None
+        with self._lock:
+            self.misses += 1
+        return self.cache.get(fqn, stat_result, algorithm) if self.cache is not None else None
+
+    def put(self, fqn, stat_result, digest, algorithm='md5'):
+        """
+        Receive the checksum of a file that was hashed, comparing it with the manifest if it was in the sample.
+        :param fqn: Name and path of the file
+        :param stat_result: os.stat result for the file, taken before it was hashed
+        :param digest: hex digest of the file
+        :param algorithm: Name of the hash algorithm
+        """
+        path = os.path.abspath(fqn)
+        with self._lock:
+            expected = self._to_verify.pop((path, algorithm), None)
+            if expected is not None:
+                self.verified += 1
+                if expected != digest:
+                    self.mismatches.append(path)
+                    print('Checksum of {} does not match its manifest: {} {}, file {}'.format(
+                        path, algorithm, expected, digest))
+        if self.cache is not None:
+            self.cache.put(fqn, stat_result, digest, algorithm)
+
+    def stats(self):
+        """
+        :returns: dictionary of files taken from the manifests (hits), files not listed or changed (misses), files
+                  verified and files whose checksum did not match
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'verified': self.verified,
+                'mismatches': len(self.mismatches)}
+
+    def flush(self):
+        """
+        Flush the checksum cache behind the manifests, if any.
+        """
+        if self.cache is not None:
+            self.cache.flush()
+
+    def close(self):
+        """
+        Close the checksum cache behind the manifests, if any.
+        """
+        if self.cache is not None:
+            self.cache.close()
+
+    def __str__(self):
+        text = 'checksum manifests: {} entries, {} hits, {} misses, {} verified, {} mismatches'.format(
+            len(self._entries), self.hits, self.misses, self.verified, len(self.mismatches))
+        if self.cache is not None:
+            text += '; ' + str(self.cache)
+        return text
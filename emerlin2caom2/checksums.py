@@ -0,0 +1,168 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from emerlin2caom2 import metrics
+
+# Measurement sets are directories of CASA table files, some of which are many GB. Files are read in large chunks
+# and hashed on a pool of threads; hashlib releases the GIL while digesting, so the threads run concurrently.
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+def file_digests(fqn, algorithms=('md5',), chunk_size=CHUNK_SIZE):
+    """
+    Calculate several digests of a single file in one sequential read. The file is read into one reusable buffer
+    with readinto, so no new bytes object is made per chunk, and every digest is updated from the same buffer.
+    :param fqn: Name and path of the file
+    :param algorithms: Names of hashlib algorithms, e.g. ('md5', 'sha256')
+    :param chunk_size: Number of bytes read per call
+    :returns: dictionary of algorithm to hex digest of the file contents
+    """
+    hashes = [hashlib.new(x) for x in algorithms]
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    nbytes = 0
+    with open(fqn, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            for hash_obj in hashes:
+                hash_obj.update(view[:n])
+            nbytes += n
+    metrics.add('bytes_hashed', nbytes)
+    metrics.add('files_hashed')
+    return {x: hash_obj.hexdigest() for x, hash_obj in zip(algorithms, hashes)}
+
+
+def file_md5(fqn, chunk_size=CHUNK_SIZE):
+    """
+    Calculate the md5 of a single file, reading it in large chunks.
+    :param fqn: Name and path of the file
+    :param chunk_size: Number of bytes read per call
+    :returns: md5 hex digest of the file contents
+    """
+    return file_digests(fqn, ('md5',), chunk_size)['md5']
+
+
+def list_files(dirname):
+    """
+    List every file within a directory, recursively. Symbolic links to directories are not followed.
+    :param dirname: Name of directory to list
+    :returns: List of file names, including path
+    """
+    file_list = []
+    for dirpath, dirnames, filenames in os.walk(dirname):
+        for f in filenames:
+            file_list.append(os.path.join(dirpath, f))
+    return file_list
+
+
+def digest_file(fqn, algorithms=('md5',), chunk_size=CHUNK_SIZE, cache=None, hash_missing=True, stat_result=None):
+    """
+    Calculate several digests of a single file, taking any already known from the cache. The cache is not
+    flushed, so that many files can be hashed as separate tasks on one pool; see digest_files.
+    :param fqn: Name and path of the file
+    :param algorithms: Names of hashlib algorithms, e.g. ('md5', 'sha256')
+    :param chunk_size: Number of bytes read per call
+    :param cache: ChecksumCache used to skip files that are unchanged since they were last hashed
+    :param hash_missing: If False, nothing is read and digests not found in the cache are None
+    :param stat_result: os.stat result for the file, if already known from a directory scan; otherwise the file
+                        is stat'ed again for the cache
+    :returns: dictionary of algorithm to hex digest
+    """
+    try:
+        if cache is None:
+            if not hash_missing:
+                return dict.fromkeys(algorithms)
+            return file_digests(fqn, algorithms, chunk_size)
+        if stat_result is None:
+            stat_result = os.stat(fqn)
+        digests = {x: cache.get(fqn, stat_result, x) for x in algorithms}
+        missing = tuple(x for x, hash_val in digests.items() if hash_val is None)
+        if missing and hash_missing:
+            digests.update(file_digests(fqn, missing, chunk_size))
+            for x in missing:
+                cache.put(fqn, stat_result, digests[x], x)
+        return digests
+    except FileNotFoundError:
+        # a dangling link hashes as an empty file, as in checksumdir
+        if os.path.islink(fqn):
+            return {x: hashlib.new(x).hexdigest() for x in algorithms}
+        raise
+
+
+@metrics.timed('checksum')
+def digest_files(file_list, algorithms=('md5',), workers=None, chunk_size=CHUNK_SIZE, cache=None,
+                 hash_missing=True, stat_results=None):
+    """
+    Calculate several digests of many files concurrently, reading each file once.
+    :param file_list: Names and paths of the files to hash
+    :param algorithms: Names of hashlib algorithms, e.g. ('md5', 'sha256')
+    :param workers: Size of the thread pool, defaults to MAX_WORKERS
+    :param chunk_size: Number of bytes read per call
+    :param cache: ChecksumCache used to skip files that are unchanged since they were last hashed, flushed once
+                  the files are hashed
+    :param hash_missing: If False, nothing is read and digests not found in the cache are None
+    :param stat_results: os.stat results for the files, in the same order as file_list, if already known from a
+                         directory scan; a file whose result is None is stat'ed again for the cache
+    :returns: List of dictionaries of algorithm to hex digest, in the same order as file_list
+    """
+    def _hash(fqn, stat_result=None):
+        return digest_file(fqn, algorithms, chunk_size, cache, hash_missing, stat_result)
+
+    if workers is None:
+        workers = MAX_WORKERS
+    if stat_results is None:
+        stat_results = [None] * len(file_list)
+    try:
+        if workers <= 1 or len(file_list) <= 1:
+            return [_hash(fqn, s) for fqn, s in zip(file_list, stat_results)]
+        with ThreadPoolExecutor(max_workers=min(workers, len(file_list))) as pool:
+            return list(pool.map(_hash, file_list, stat_results))
+    finally:
+        if cache is not None:
+            cache.flush()
+
+
+def hash_files(file_list, workers=None, chunk_size=CHUNK_SIZE, cache=None):
+    """
+    Calculate the md5 of many files concurrently.
+    :param file_list: Names and paths of the files to hash
+    :param workers: Size of the thread pool, defaults to MAX_WORKERS
+    :param chunk_size: Number of bytes read per call
+    :param cache: ChecksumCache used to skip files that are unchanged since they were last hashed
+    :returns: List of md5 hex digests, in the same order as file_list
+    """
+    return [x['md5'] for x in digest_files(file_list, ('md5',), workers, chunk_size, cache)]
+
+
+def reduce_hashes(hash_list, algorithm='md5'):
+    """
+    Combine per-file digests into a single digest. The digests are sorted first, so the result does not depend on
+    the order in which files were listed or hashed. With md5 this is the reduction used by checksumdir.
+    :param hash_list: hex digests of the individual files
+    :param algorithm: Name of the hashlib algorithm of the digests, also used to combine them
+    :returns: Combined hex digest
+    """
+    hash_obj = hashlib.new(algorithm)
+    for hash_val in sorted(hash_list):
+        hash_obj.update(hash_val.encode('utf-8'))
+    return hash_obj.hexdigest()
+
+
+def dirhash(dirname, workers=None, chunk_size=CHUNK_SIZE, cache=None):
+    """
+    Parallel replacement for checksumdir.dirhash(dirname, 'md5'), giving identical values.
+    :param dirname: Name of directory, e.g. a measurement set
+    :param workers: Size of the thread pool, defaults to MAX_WORKERS
+    :param chunk_size: Number of bytes read per call
+    :param cache: ChecksumCache used to skip files that are unchanged since they were last hashed
+    :returns: Combined md5 hex digest of the directory contents
+    """
+    if not os.path.isdir(dirname):
+        raise TypeError('{} is not a directory.'.format(dirname))
+    return reduce_hashes(hash_files(list_files(dirname), workers, chunk_size, cache))
@@ -0,0 +1,160 @@
+import datetime
+import os
+
+import yaml
+
+from emerlin2caom2 import batch
+from emerlin2caom2 import settings_file as set_f
+
+__all__ = [
+    'discover_runs',
+    'run_discovery'
+]
+
+# the template state.yml has minutes only; seconds are written back so no run is processed twice
+BOOKMARK_FORMATS = ('%d-%b-%Y %H:%M:%S', '%d-%b-%Y %H:%M')
+
+
+def parse_bookmark(value):
+    """
+    :param value: last_record of a bookmark, e.g. '14-Dec-2021 21:59', or a datetime if the yaml held one
+    :returns: datetime
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    for fmt in BOOKMARK_FORMATS:
+        try:
+            return datetime.datetime.strptime(str(value), fmt)
+        except ValueError:
+            pass
+    raise ValueError('Unrecognised bookmark time: ' + str(value))
+
+
+def read_state(state_file, bookmark_name):
+    """
+    :param state_file: name of the state yaml file
+    :param bookmark_name: key of the bookmark under bookmarks
+    :returns: the whole state as a dictionary, and the last_record time of the bookmark, or None if not set
+    """
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file) as file:
+            state = yaml.safe_load(file) or {}
+    last_record = state.get('bookmarks', {}).get(bookmark_name, {}).get('last_record')
+    return state, parse_bookmark(last_record) if last_record else None
+
+
+def write_state(state_file, state, bookmark_name, last_record):
+    """
+    Advance a bookmark. The file is replaced atomically, so an interrupted run leaves the previous state intact.
+    :param state_file: name of the state yaml file
+    :param state: the whole state, as returned by read_state; other bookmarks are kept
+    :param bookmark_name: key of the bookmark under bookmarks
+    :param last_record: datetime to store
+    """
+    state.setdefault('bookmarks', {}).setdefault(bookmark_name, {})['last_record'] = \
+        last_record.strftime(BOOKMARK_FORMATS[0])
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as file:
+        yaml.safe_dump(state, file, default_flow_style=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, state_file)
+
+
+def run_mtime(storage_name):
+    """
+    Time a pipeline output was last changed, from its eMCP_info.txt and measurement sets.
+    :param storage_name: path of the pipeline output directory
+    :returns: datetime, or None if it has none of these, i.e. it is not a finished pipeline output
+    """
+    obs_id = os.path.basename(storage_name.rstrip('/'))
+    candidates = [os.path.join(storage_name, 'weblog', 'info', 'eMCP_info.txt'),
+                  os.path.join(storage_name, '{}_avg.ms'.format(obs_id)),
+                  os.path.join(storage_name, '{}_sp.ms'.format(obs_id))]
+    mtimes = []
+    for fqn in candidates:
+        try:
+            mtimes.append(os.stat(fqn).st_mtime)
+        except FileNotFoundError:
+            pass
+    return datetime.datetime.fromtimestamp(max(mtimes)) if mtimes else None
+
+
+def discover_runs(root_dir, since=None, until=None):
+    """
+    Find the pipeline outputs directly under a root directory that changed after a bookmark.
+    :param root_dir: directory holding one pipeline output directory per run
+    :param since: only runs changed after this datetime are kept; all runs if None
+    :param until: runs changed after this datetime are left for a later discovery
+    :returns: list of (datetime, storage directory), oldest first
+    """
+    runs = []
+    with os.scandir(root_dir) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            mtime = run_mtime(entry.path)
+            if mtime is None or (since is not None and mtime <= since) or (until is not None and mtime > until):
+                continue
+            runs.append((mtime, entry.path))
+    return sorted(runs)
+
+
+def time_boxes(runs, interval):
+    """
+    Group runs into consecutive time boxes of interval length. A box starts at the oldest run not yet in a box,
+    so empty stretches of time are skipped.
+    :param runs: list of (datetime, storage directory), oldest first
+    :param interval: timedelta length of each box
+    :returns: list of (end of the box, list of storage directories)
+    """
+    boxes = []
+    for mtime, storage_name in runs:
+        if not boxes or mtime > boxes[-1][0]:
+            boxes.append((mtime + interval, []))
+        boxes[-1][1].append(storage_name)
+    return boxes
+
+
+def read_interval(config_file):
+    """
+    :param config_file: name of config.yml
+    :returns: the interval setting, in minutes
+    """
+    with open(config_file) as file:
+        return yaml.safe_load(file)['interval']
+
+
+def run_discovery(root_dir, state_file=None, bookmark_name=None, interval=None, workers=None, log_dir=None):
+    """
+    Process the pipeline outputs under root_dir that are new since the bookmark in the state file, one time box at a
+    time. The bookmark is advanced after each box that has no failures; if a box fails, discovery stops so that the
+    next invocation tries it again. Every run found is processed, including those already in the batch success
+    log, as a pipeline output rerun in place is found again by its newer modification time.
+    :param root_dir: directory holding one pipeline output directory per run
+    :param state_file: name of the state yaml file, defaults to set_f.state_file
+    :param bookmark_name: key of the bookmark, defaults to set_f.bookmark_name
+    :param interval: length of a time box in minutes, defaults to the interval in set_f.config_file
+    :param workers: number of worker processes, see batch.run_batch
+    :param log_dir: directory for the batch logs, see batch.run_batch
+    :returns: the datetime of the bookmark after discovery, or None if there was none and nothing was processed
+    """
+    state_file = state_file or set_f.state_file
+    bookmark_name = bookmark_name or set_f.bookmark_name
+    interval = datetime.timedelta(minutes=interval or read_interval(set_f.config_file))
+
+    state, last_record = read_state(state_file, bookmark_name)
+    # runs still being written now are left for the next discovery
+    started = datetime.datetime.now()
+    runs = discover_runs(root_dir, last_record, started)
+    print('Found {} new runs since {}'.format(len(runs), last_record))
+
+    for box_end, storage_names in time_boxes(runs, interval):
+        counts = batch.run_batch(storage_names, workers, log_dir, skip_done=False)
+        if counts['failed']:
+            print('Stopping discovery at the time box ending {}: {} runs failed'.format(box_end, counts['failed']))
+            break
+        last_record = min(box_end, started)
+        write_state(state_file, state, bookmark_name, last_record)
+    return last_record
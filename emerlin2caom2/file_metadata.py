@@ -1,8 +1,9 @@
 import os
-from hashlib import md5
+from datetime import datetime, timezone
 
 from cadcutils.util import date2ivoa
-from checksumdir import dirhash
+
+from emerlin2caom2.checksums import digest_files, reduce_hashes
 
 
 class FileInfo:
@@ -14,9 +15,10 @@ class FileInfo:
         - md5sum
         - file_type
         - encoding
+        - checksums, dictionary of algorithm to hex digest
     """
     def __init__(self, id, size=None, name=None, md5sum=None, lastmod=None,
-                 file_type=None, encoding=None):
+                 file_type=None, encoding=None, checksums=None):
         if not id:
             raise AttributeError(
                 'ID of the file in Storage Inventory is required')
@@ -27,6 +29,7 @@ class FileInfo:
         self.lastmod = lastmod
         self.file_type = file_type
         self.encoding = encoding
+        self.checksums = checksums if checksums is not None else {'md5': md5sum}
 
     def __str__(self):
         return (
@@ -36,6 +39,25 @@ class FileInfo:
                                self.md5sum))
 
 
+class TreeScan:
+    """
+    Metadata gathered in a single pass over a file, or over a directory tree such as a measurement set:
+        - fqn
+        - file_type
+        - size, excluding symbolic links within a directory
+        - mtime, the most recent modification time of any file
+        - files, the names and paths of the files to be hashed
+        - stats, the os.stat result of each file, following symbolic links, or None for a dangling link
+    """
+    def __init__(self, fqn, file_type, size=0, mtime=None, files=None, stats=None):
+        self.fqn = fqn
+        self.file_type = file_type
+        self.size = size
+        self.mtime = mtime
+        self.files = files if files is not None else []
+        self.stats = stats if stats is not None else [None] * len(self.files)
+
+
 def basename(name):
     """
     Adaptation of os.basename for use with directories, instead of files
@@ -49,31 +71,78 @@ def basename(name):
     return base_name
 
 
+def list_dir(path):
+    """
+    List the contents of a directory with a single os.scandir call.
+    :param path: Name of directory to list
+    :returns: List of os.DirEntry, sorted by name
+    """
+    with os.scandir(path) as it:
+        return sorted(it, key=lambda x: x.name)
+
+
+def scan_tree(fqn, entry=None):
+    """
+    Walk a file or directory once, collecting its size, content type, modification time and the files needed for
+    its checksum. Directories are walked with os.scandir, so the type and stat information cached on each
+    os.DirEntry is reused rather than fetched again.
+    :param fqn: Name and path of the file or directory
+    :param entry: os.DirEntry for fqn, if it is already known from a directory listing
+    :returns: TreeScan
+    """
+    fqn = os.fspath(fqn)
+    is_dir = entry.is_dir() if entry is not None else None
+    file_type = get_file_type(fqn, is_dir)
+    if file_type != 'application/measurement-set':
+        s = entry.stat() if entry is not None else os.stat(fqn)
+        return TreeScan(fqn, file_type, s.st_size, s.st_mtime, [fqn], [s])
+
+    scan = TreeScan(fqn, file_type)
+    pending = [fqn]
+    while pending:
+        with os.scandir(pending.pop()) as it:
+            for sub in it:
+                if sub.is_dir():
+                    # as with os.walk, do not descend into symbolic links to directories
+                    if not sub.is_symlink():
+                        pending.append(sub.path)
+                    continue
+                scan.files.append(sub.path)
+                # skip if it is symbolic link, keeping the stat of its target for the checksum cache
+                if sub.is_symlink():
+                    try:
+                        scan.stats.append(sub.stat())
+                    except FileNotFoundError:
+                        scan.stats.append(None)
+                    continue
+                s = sub.stat(follow_symlinks=False)
+                scan.stats.append(s)
+                scan.size += s.st_size
+                if scan.mtime is None or s.st_mtime > scan.mtime:
+                    scan.mtime = s.st_mtime
+    return scan
+
+
 def get_size(start_path='.'):
     """
     Get the size of all objects contained within an input directory, recursively.
     :param start_path: Name of directory to find size for
     :returns: Total size of the contents of start_path in bytes
     """
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(start_path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            # skip if it is symbolic link
-            if not os.path.islink(fp):
-                total_size += os.path.getsize(fp)
+    return scan_tree(start_path).size
 
-    return total_size
 
-
-def get_file_type(fqn):
+def get_file_type(fqn, is_dir=None):
     """
     Basic header extension to content_type lookup.
     :param fqn: Name and path of input data
+    :param is_dir: Whether fqn is a directory, if already known
     :returns: Content type
     """
     lower_fqn = fqn.lower()
-    if os.path.isdir(fqn):
+    if is_dir is None:
+        is_dir = os.path.isdir(fqn)
+    if is_dir:
         return 'application/measurement-set'
     elif lower_fqn.endswith('.fits') or lower_fqn.endswith('.fits.fz') or lower_fqn.endswith('.fits.bz2'):
         return 'application/fits'
@@ -95,33 +164,46 @@ def get_file_type(fqn):
         return 'text/plain'
 
 
-def get_local_file_info(fqn):
+def file_info(scan, file_digests, algorithms=('md5',)):
     """
-    Gets descriptive metadata for a directory of measurement set files on disk.
-    :param fqn: Fully-qualified name of the file on disk.
-    :return: FileInfo, no scheme on the md5sum value.
+    Make the FileInfo of a file or measurement set from its scan and the digests of the files in it.
+    :param scan: TreeScan from scan_tree
+    :param file_digests: dictionaries of algorithm to hex digest, in the same order as scan.files
+    :param algorithms: hashlib algorithms of the checksums
+    :returns: FileInfo, no scheme on the md5sum value. A checksum is only given if every file has a digest.
     """
-    file_type_local = get_file_type(fqn)
-
-    if file_type_local == 'application/measurement-set':
-        file_size = get_size(fqn)
-        final_hash_val = dirhash(fqn)  # very slow, may need to remove in future
-        file_id = os.path.dirname(fqn).split('/')[-1]
+    if scan.file_type == 'application/measurement-set':
+        checksums = {x: reduce_hashes([y[x] for y in file_digests], x) for x in algorithms
+                     if all(y[x] is not None for y in file_digests)}
+        file_id = os.path.dirname(scan.fqn).split('/')[-1]
 
     else:
-        file_id = os.path.basename(fqn)
-        s = os.stat(fqn)
-        file_size = s.st_size
-        hash_md5 = md5()
-        with open(fqn, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                hash_md5.update(chunk)
-        final_hash_val = hash_md5.hexdigest()
+        file_id = os.path.basename(scan.fqn)
+        checksums = {x: hash_val for x, hash_val in file_digests[0].items() if hash_val is not None}
 
     meta = FileInfo(
         id=file_id,
-        size=file_size,
-        md5sum=final_hash_val,
-        file_type=file_type_local,
+        size=scan.size,
+        md5sum=checksums.get('md5'),
+        checksums=checksums,
+        lastmod=datetime.fromtimestamp(scan.mtime, timezone.utc) if scan.mtime is not None else None,
+        file_type=scan.file_type,
     )
     return meta
+
+
+def get_local_file_info(fqn, entry=None, cache=None, algorithms=('md5',), hash_missing=True, workers=None):
+    """
+    Gets descriptive metadata for a directory of measurement set files on disk.
+    :param fqn: Fully-qualified name of the file on disk.
+    :param entry: os.DirEntry for fqn, if it is already known from a directory listing
+    :param cache: ChecksumCache used to skip re-hashing files that have not changed
+    :param algorithms: hashlib algorithms of the checksums, all calculated in one read of each file
+    :param hash_missing: If False, nothing is hashed: only checksums known to the cache for every file are given
+    :param workers: Number of files of a measurement set hashed at once, see checksums.digest_files
+    :return: FileInfo, no scheme on the md5sum value.
+    """
+    scan = scan_tree(fqn, entry)
+    file_digests = digest_files(scan.files, algorithms, workers, cache=cache, hash_missing=hash_missing,
+                                stat_results=scan.stats)
+    return file_info(scan, file_digests, algorithms)
@@ -1,5 +1,37 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from astropy.io import fits
 
+from emerlin2caom2 import metrics
+
+# CAOM relevant keywords of the primary header, by the name used in the output dictionary
+FITS_KEYWORDS = {
+    'coord_scheme': 'EQUINOX',
+    'ra_unit': 'CTYPE1',
+    'ra_deg': 'CRVAL1',
+    'dec_unit': 'CTYPE2',
+    'dec_deg': 'CRVAL2',
+    'wsc_version': 'WSCVERSI',
+    'central_freq': 'CRVAL3',
+    'pix_width': 'NAXIS1',
+    'pix_length': 'NAXIS2',
+    'pix_width_scale': 'CDELT1',
+    'pix_length_scale': 'CDELT2',
+}
+MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+def read_primary_header(fits_file):
+    """
+    Read the primary header of a fits file, without opening the HDU list or mapping the data. Only the header
+    blocks are read, and the file is closed straight away.
+    :param fits_file: name and location of fits file
+    :returns: astropy Header
+    """
+    with open(fits_file, 'rb') as f:
+        return fits.Header.fromfile(f)
+
 
 def header_extraction(fits_file):
     """
@@ -7,20 +39,22 @@ def header_extraction(fits_file):
     :param fits_file: name and location of fits file
     :returns: dictionary of metadata
     """
-    hdu = fits.open(fits_file)
-    newhead = hdu[0].header
-
-    fits_out = dict()
-
-    fits_out['coord_scheme'] = newhead['EQUINOX']
-    fits_out['ra_unit'] = newhead['CTYPE1']
-    fits_out['ra_deg'] = newhead['CRVAL1']
-    fits_out['dec_unit'] = newhead['CTYPE2']
-    fits_out['dec_deg'] = newhead['CRVAL2']
-    fits_out['wsc_version'] = newhead['WSCVERSI']
-    fits_out['central_freq'] = newhead['CRVAL3']
-    fits_out['pix_width'] = newhead['NAXIS1']
-    fits_out['pix_length'] = newhead['NAXIS2']
-    fits_out['pix_width_scale'] = newhead['CDELT1']
-    fits_out['pix_length_scale'] = newhead['CDELT2']
-    return fits_out
+    with metrics.timed('fits.header', fits_file):
+        newhead = read_primary_header(fits_file)
+
+    return {key: newhead[keyword] for key, keyword in FITS_KEYWORDS.items()}
+
+
+def header_extraction_many(fits_files, workers=None):
+    """
+    Extract CAOM relevant metadata from many fits files concurrently.
+    :param fits_files: names and locations of fits files
+    :param workers: Size of the thread pool, defaults to MAX_WORKERS
+    :returns: list of dictionaries of metadata, in the same order as fits_files
+    """
+    if workers is None:
+        workers = MAX_WORKERS
+    if workers <= 1 or len(fits_files) <= 1:
+        return [header_extraction(x) for x in fits_files]
+    with ThreadPoolExecutor(max_workers=min(workers, len(fits_files))) as pool:
+        return list(pool.map(header_extraction, fits_files))
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from lxml import etree
+
+__all__ = [
+    'IngestDigests',
+    'xml_digest'
+]
+
+# attributes in the caom2 namespace are entity ids and checksums, which change on every run
+CAOM2_NAMESPACE = 'http://www.opencadc.org/caom2/xml/'
+
+
+def read_xml(xml_output_name):
+    """
+    :param xml_output_name: XML document as bytes, or xml file containing it
+    :returns: the XML document as bytes
+    """
+    if isinstance(xml_output_name, bytes):
+        return xml_output_name
+    with open(xml_output_name, 'rb') as f:
+        return f.read()
+
+
+def xml_digest(xml_output_name):
+    """
+    Digest of the canonical form of an observation's XML. The caom2 id, lastModified and checksum attributes are
+    removed first, so two documents describing the same metadata have the same digest.
+    :param xml_output_name: XML document as bytes, or xml file containing it
+    :returns: sha256 hex digest
+    """
+    root = etree.fromstring(read_xml(xml_output_name))
+    for element in root.iter(etree.Element):
+        for name in [x for x in element.attrib if x.startswith('{' + CAOM2_NAMESPACE)]:
+            del element.attrib[name]
+    return hashlib.sha256(etree.tostring(root, method='c14n')).hexdigest()
+
+
+class IngestDigests:
+    """
+    Record of the XML digest of each observation last ingested, stored in an SQLite database. An observation
+    whose digest has not changed since it was ingested does not need to be uploaded again.
+    :param digest_dir: Directory in which the database is kept, created if necessary
+    """
+    db_name = 'ingested.sqlite'
+
+    def __init__(self, digest_dir):
+        os.makedirs(digest_dir, exist_ok=True)
+        self.db_file = os.path.join(digest_dir, self.db_name)
+        # uploads run on a thread pool, so the connection is shared behind a lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS ingested ('
+                           'uri TEXT PRIMARY KEY, digest TEXT, ingested REAL)')
+        self._conn.commit()
+
+    def get(self, obs_uri):
+        """
+        :param obs_uri: uri of the observation
+        :returns: digest of the XML last ingested for the observation, or None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT digest FROM ingested WHERE uri = ?', (str(obs_uri),)).fetchone()
+        return row[0] if row else None
+
+    def put(self, obs_uri, digest):
+        """
+        Record that an observation was ingested.
+        :param obs_uri: uri of the observation
+        :param digest: digest of the XML ingested, from xml_digest
+        """
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO ingested VALUES (?, ?, ?)', (str(obs_uri), digest, time.time()))
+            self._conn.commit()
+
+    def discard(self, obs_uri):
+        """
+        Forget an observation, e.g. once its record has been deleted.
+        :param obs_uri: uri of the observation
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM ingested WHERE uri = ?', (str(obs_uri),))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __str__(self):
+        return 'ingest digests {}'.format(self.db_file)
@@ -0,0 +1,151 @@
+import threading
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from lxml import etree
+
+from emerlin2caom2 import api_requests as api
+from emerlin2caom2.ingest_digests import read_xml, xml_digest
+
+__all__ = [
+    'IngestQueue',
+    'ingest_observation',
+    'published_uris'
+]
+
+# status codes of a successful post, put or delete
+SUCCESS_CODES = (200, 201, 204)
+
+
+def with_observation_id(xml_data, machine_id):
+    """
+    Set the caom2 id of the observation in an XML document, so that it replaces the record with that id.
+    :param xml_data: XML document as bytes
+    :param machine_id: id of the existing record
+    :returns: XML document as bytes
+    """
+    root = etree.fromstring(xml_data)
+    root.set('{' + root.nsmap['caom2'] + '}id', machine_id)
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8')
+
+
+def ingest_observation(caller, obs_uri, xml_output_name, machine_id, replace_old_data, digests=None,
+                       update_in_place=False):
+    """
+    Upload one observation, replacing an existing record if allowed. The delete always completes before the post.
+    :param caller: object with the base_url of the database, e.g. EmerlinMetadata
+    :param obs_uri: uri of the observation
+    :param xml_output_name: XML document as bytes, or xml file containing metadata to ingest
+    :param machine_id: id of the existing record, a list of ids if there are duplicates, or None
+    :param replace_old_data: If True, an existing record is deleted and replaced
+    :param digests: IngestDigests of the observations already ingested. An existing record is left alone if the
+                    XML has not changed since it was ingested.
+    :param update_in_place: If True, an existing record is replaced with a single put instead of delete and post
+    :returns: list of (action, status code) for each step taken
+    """
+    digest = None
+    if digests is not None:
+        xml_output_name = read_xml(xml_output_name)
+        digest = xml_digest(xml_output_name)
+
+    if not machine_id:
+        steps = [('insert', api.request_post(caller, xml_output_name))]
+    elif not isinstance(machine_id, str):
+        return [('skip, multiple records', None)]
+    elif digest is not None and digests.get(obs_uri) == digest:
+        return [('skip, unchanged', None)]
+    elif not replace_old_data:
+        return [('skip, record exists', None)]
+    elif update_in_place:
+        xml_data = with_observation_id(read_xml(xml_output_name), machine_id)
+        steps = [('update', api.request_put(caller, machine_id, xml_data))]
+    else:
+        del_stat = api.request_delete(caller, machine_id)
+        steps = [('delete', del_stat), ('update', api.request_post(caller, xml_output_name))]
+
+    if digest is not None and steps[-1][1] in SUCCESS_CODES:
+        digests.put(obs_uri, digest)
+    return steps
+
+
+def published_uris(results):
+    """
+    :param results: list of (uri, list of (action, status code)), as returned by IngestQueue.close
+    :returns: set of the uris, as strings, whose record was inserted or replaced by these uploads
+    """
+    return {str(obs_uri) for obs_uri, steps in results
+            if steps and steps[-1][0] in ('insert', 'update') and steps[-1][1] in SUCCESS_CODES}
+
+
+class IngestQueue:
+    """
+    Uploads observations on a bounded pool of threads, so that network round trips overlap with building the rest
+    of the metadata. Submissions for the same uri are run in order, one after the other, and a submission after one
+    that created the record looks up the id of the new record.
+    :param caller: object with the base_url of the database, e.g. EmerlinMetadata
+    :param existing: dictionary of uri to existing record id(s), from api.find_existing_bulk
+    :param replace_old_data: If True, existing records are deleted and replaced
+    :param workers: Maximum number of concurrent uploads
+    :param digests: IngestDigests used to skip observations that have not changed, or None
+    :param update_in_place: If True, existing records are replaced with a single put
+    """
+    def __init__(self, caller, existing, replace_old_data, workers=4, digests=None, update_in_place=False):
+        self.caller = caller
+        self.existing = existing
+        self.replace_old_data = replace_old_data
+        self.digests = digests
+        self.update_in_place = update_in_place
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._last = {}
+        self._futures = []
+
+    def submit(self, obs_uri, xml_output_name):
+        """
+        Queue an observation for upload.
+        :param obs_uri: uri of the observation
+        :param xml_output_name: XML document as bytes, or xml file containing metadata to ingest
+        """
+        with self._lock:
+            previous = self._last.get(obs_uri)
+            future = self._pool.submit(self._ingest, obs_uri, xml_output_name, previous)
+            self._last[obs_uri] = future
+            self._futures.append(future)
+
+    def _ingest(self, obs_uri, xml_output_name, previous):
+        try:
+            if previous is not None:
+                # an earlier submission is always ahead in the pool queue, so this cannot deadlock
+                if published_uris([previous.result()]):
+                    # the earlier submission created the record, so its id is not the one found when the
+                    # queue started
+                    machine_id = api.find_existing(self.caller, obs_uri)
+                    with self._lock:
+                        self.existing[str(obs_uri)] = machine_id
+            with self._lock:
+                machine_id = self.existing.get(str(obs_uri))
+            steps = ingest_observation(self.caller, obs_uri, xml_output_name, machine_id,
+                                       self.replace_old_data, self.digests, self.update_in_place)
+        except Exception as e:
+            print('Upload of {} failed:\n{}'.format(obs_uri, traceback.format_exc()))
+            steps = [('error', '{}: {}'.format(type(e).__name__, e))]
+        return obs_uri, steps
+
+    def close(self):
+        """
+        Wait for all uploads to finish and print a summary of the status codes.
+        :returns: list of (uri, list of (action, status code)) in submission order
+        """
+        self._pool.shutdown(wait=True)
+        results = [x.result() for x in self._futures]
+
+        counts = Counter((action, status) for _, steps in results for action, status in steps)
+        print('Ingested {} observations: '.format(len(results)) +
+              ', '.join('{} {}: {}'.format(action, status, n) if status is not None else '{}: {}'.format(action, n)
+                        for (action, status), n in sorted(counts.items(), key=str)))
+        for obs_uri, steps in results:
+            for action, status in steps:
+                if status is not None and status not in SUCCESS_CODES:
+                    print(str(obs_uri) + ' ' + action + ' failed with status: ' + str(status))
+        return results
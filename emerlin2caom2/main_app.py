@@ -1,28 +1,37 @@
+import io
 import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from os.path import exists
 from pathlib import Path
-import requests
-import pyvo as vo
 
 from caom2 import SimpleObservation, ObservationIntentType, Target, Telescope, TypedOrderedDict, Plane, Artifact, \
     ReleaseType, ObservationWriter, Provenance, Position, Point, Energy, TargetPosition, \
     Interval, TypedSet, Polarization, shape, Proposal, Instrument, DerivedObservation, Time, DataProductType, \
     PolarizationState, DataLinkSemantics, EnergyBand
 
-from pkg_resources import Environment
-from setuptools.config.expand import canonic_data_files
-
 from emerlin2caom2 import casa_reader as casa
+from emerlin2caom2.checksum_cache import ChecksumCache
+from emerlin2caom2.checksum_manifest import ChecksumManifest, find_manifests
+from emerlin2caom2.checksums import digest_file
 from emerlin2caom2 import file_metadata as msmd
 from emerlin2caom2 import fits_reader as fr
+from emerlin2caom2 import metrics
 from emerlin2caom2 import settings_file as set_f
 from emerlin2caom2 import api_requests as api
+from emerlin2caom2.ingest_digests import IngestDigests
+from emerlin2caom2.ingest_queue import IngestQueue, ingest_observation, published_uris
+from emerlin2caom2.plane_matcher import PlaneMatcher
 
 __all__ = [
     'EmerlinMetadata',
     'emcp2dict'
 ]
 
+# radius in degrees beyond which the target fields of a measurement set are too far apart to be given one position
+MAX_BOUNDS_RADIUS = 10.
+
 
 def emcp2dict(emcp_file):
     '''
@@ -75,6 +84,15 @@ def role_extractor(pickle_dict):
 
     return role_rev, name_ra, name_dec
 
+def write_xml_file(xml_output_name, xml_data):
+    """
+    Write an XML document, serialised in memory, to disk.
+    :param xml_output_name: name and path of the file
+    :param xml_data: XML document as bytes
+    """
+    with open(xml_output_name, 'wb') as f:
+        f.write(xml_data)
+
 def basename(name):
     """
     Adaptation of os.basename for use with directories, instead of files
@@ -92,22 +110,37 @@ def basename(name):
 class EmerlinMetadata:
     """
     Populates an XML document with caom format metadata, extracted from an input measurement set.
-    :param storage_name: Name of measurement set
+    Nothing is read from disk until the metadata is built, so instances are cheap to create.
+    :param storage_name: Name of the e-MERLIN pipeline output directory
     :param xml_out_dir: Location for writing the output XML
+    :param base_url: Location of the database, needed for upload
+    :param upload: If True, upload the observations to base_url
+    :param replace_old_data: If True, replace existing records with the same uri
+    :param checksum_cache_dir: Directory for the persistent checksum cache, disabled if empty
+    :param checksum_cache_max_entries: Maximum number of files held in the checksum cache
+    :param upload_workers: Maximum number of concurrent uploads
+    :param ingest_digest_dir: Directory recording the XML last ingested for each observation, so that unchanged
+                              observations are skipped. Disabled if empty
+    :param update_in_place: If True, changed records are replaced with a single put instead of delete and post
+    :param observable_directory: Directory for the metrics json of each run, disabled if empty
+    :param profile_execution: If True, a cProfile dump of each run is also written to observable_directory
+    :param casa_workers: Number of processes reading measurement sets at once, 0 to read them in this process
+    :param file_workers: Number of files hashed at once, including the files within each measurement set
+    :param checksum_algorithms: hashlib algorithms calculated in one read of each file. The first is used for the
+                                artifact content checksum
+    :param checksum_manifest: md5sum style manifest whose checksums are used instead of hashing, disabled if empty
+    :param checksum_manifest_names: Names of the manifests looked for in the storage directory and its
+                                    subdirectories, used as well as checksum_manifest
+    :param manifest_verify_fraction: Fraction of the files in the manifests hashed anyway to check them
+    :param defer_checksums: If True, observations are published with the size and type of each artifact as soon
+                            as the measurement sets are read. Checksums not already in the cache or manifests are
+                            calculated afterwards and the observation is then updated with them. Observations with
+                            a digest in ingest_digest_dir were ingested before, and are hashed before publishing so
+                            that their complete records are not replaced by ones without checksums.
+    :param write_xml_files: If True, keep a copy of each XML document in xml_out_dir. Uploads are sent from memory
+                            either way.
     :returns: Name of the output xml, id for the observation in the xml file
     """
-    storage_name = set_f.storage_name
-    xml_out_dir = set_f.xmldir
-    if xml_out_dir[-1] != '/':
-        xml_out_dir += '/'
-
-    base_url = set_f.base_url
-    obs_id = basename(storage_name)
-    ms_dir_main = storage_name + '/{}_avg.ms'.format(obs_id)  # maybe flimsy? depends on the rigidity of the em pipeline
-    ms_dir_spectral = storage_name + '/{}_sp.ms'.format(obs_id)
-    pickle_file = storage_name + '/weblog/info/eMCP_info.txt'
-    pickle_obj = emcp2dict(pickle_file)
-    roles, target_ra, target_dec = role_extractor(pickle_obj)
     polarization_states = {'I': PolarizationState.I,
                          'Q': PolarizationState.Q,
                          'U': PolarizationState.U,
@@ -127,38 +160,131 @@ class EmerlinMetadata:
                          'CPOLI': PolarizationState.CPOLI,
                          'NPOLI': PolarizationState.NPOLI}
 
-    def artifact_metadata(self, observation, plane_id, artifact_full_name, plots):
+    def __init__(self, storage_name, xml_out_dir, base_url='', upload=False, replace_old_data=False,
+                 checksum_cache_dir='', checksum_cache_max_entries=1000000, upload_workers=4, write_xml_files=True,
+                 ingest_digest_dir='', update_in_place=False, observable_directory='', profile_execution=False,
+                 casa_workers=4, file_workers=4, checksum_algorithms=('md5',), checksum_manifest='',
+                 checksum_manifest_names=(), manifest_verify_fraction=0., defer_checksums=False):
+        self.storage_name = storage_name.rstrip('/')
+        self.xml_out_dir = xml_out_dir
+        if self.xml_out_dir[-1] != '/':
+            self.xml_out_dir += '/'
+
+        self.base_url = base_url
+        self.upload = upload
+        self.replace_old_data = replace_old_data
+        self.checksum_cache_dir = checksum_cache_dir
+        self.checksum_cache_max_entries = checksum_cache_max_entries
+        self.checksum_cache = None
+        self.upload_workers = upload_workers
+        self.ingest_digest_dir = ingest_digest_dir
+        self.update_in_place = update_in_place
+        self.observable_directory = observable_directory
+        self.profile_execution = profile_execution
+        self.casa_workers = casa_workers
+        self.file_workers = file_workers
+        self.checksum_algorithms = tuple(checksum_algorithms)
+        self.checksum_manifest = checksum_manifest
+        self.checksum_manifest_names = tuple(checksum_manifest_names)
+        self.manifest_verify_fraction = manifest_verify_fraction
+        self.defer_checksums = defer_checksums
+        self.deferred_checksums = []
+        self.hash_missing = True
+        self._file_pool = None
+        self._file_info = {}
+        self.pending_ingest = []
+        self.ingest_queue = None
+        self.write_xml_files = write_xml_files
+        self.writer = ObservationWriter()
+        self._xml_sink = None
+        self._xml_writes = []
+        self.obs_id = basename(self.storage_name)
+        self.ms_dir_main = self.storage_name + '/{}_avg.ms'.format(self.obs_id)  # maybe flimsy? depends on the rigidity of the em pipeline
+        self.ms_dir_spectral = self.storage_name + '/{}_sp.ms'.format(self.obs_id)
+        self.pickle_file = self.storage_name + '/weblog/info/eMCP_info.txt'
+
+    @classmethod
+    def from_settings(cls, storage_name=None):
+        """
+        Create an instance from the values in settings_file.py.
+        :param storage_name: Pipeline output directory, overriding set_f.storage_name
+        """
+        return cls(storage_name or set_f.storage_name, set_f.xmldir, base_url=set_f.base_url, upload=set_f.upload,
+                   replace_old_data=set_f.replace_old_data, checksum_cache_dir=set_f.checksum_cache_dir,
+                   checksum_cache_max_entries=set_f.checksum_cache_max_entries, upload_workers=set_f.upload_workers,
+                   write_xml_files=set_f.write_xml_files, ingest_digest_dir=set_f.ingest_digest_dir,
+                   update_in_place=set_f.update_in_place,
+                   observable_directory=set_f.observable_directory if set_f.observe_execution else '',
+                   profile_execution=set_f.profile_execution, casa_workers=set_f.casa_workers,
+                   file_workers=set_f.file_workers, checksum_algorithms=set_f.checksum_algorithms,
+                   checksum_manifest=set_f.checksum_manifest, checksum_manifest_names=set_f.checksum_manifest_names,
+                   manifest_verify_fraction=set_f.manifest_verify_fraction, defer_checksums=set_f.defer_checksums)
+
+    @cached_property
+    def pickle_obj(self):
+        """
+        Contents of eMCP_info.txt, read on first use.
+        """
+        return emcp2dict(self.pickle_file)
+
+    @cached_property
+    def _roles(self):
+        """
+        Source roles and names from role_extractor, worked out on first use.
+        """
+        return role_extractor(self.pickle_obj)
+
+    @property
+    def roles(self):
+        return self._roles[0]
+
+    @property
+    def target_ra(self):
+        return self._roles[1]
+
+    @property
+    def target_dec(self):
+        return self._roles[2]
+
+    def artifact_metadata(self, observation, plane_id, artifact_full_name, plots, entry=None):
         """
         Creates metadata for physical artifacts, including type, size and hash value
         :param observation: observation class to add artifact to
         :param plane_id: plane to add artifact metadata to
         :param artifact_full_name: full location of target object
         :param plots: name of artifact only, no path
+        :param entry: os.DirEntry of the artifact from the weblog listing, if available
         """
         plane = observation.planes[plane_id]
         art_uri = 'uri:{}'.format(plots)
 
         artifact = Artifact(art_uri, DataLinkSemantics.AUXILIARY, ReleaseType.DATA)
         plane.artifacts[art_uri] = artifact
-        meta_data = msmd.get_local_file_info(artifact_full_name)
+        with metrics.timed('artifact', artifact_full_name):
+            meta_data = self.local_file_info(artifact_full_name, entry)
 
         artifact.content_type = meta_data.file_type
         artifact.content_length = meta_data.size
-        artifact.content_checksum = 'md5:{}'.format(meta_data.md5sum)
+        artifact.content_checksum = self.content_checksum(meta_data)
+        if artifact.content_checksum is None:
+            self.deferred_checksums.append((artifact, artifact_full_name))
 
 
-    def fits_plane_metadata(self, observation, fits_full_name, images, plane_id):
+    @metrics.timed('fits_plane')
+    def fits_plane_metadata(self, observation, fits_full_name, images, plane_id, fits_header_data=None):
         """
         Creates metadata for fits files, currently includes only basic information with scope to add more
         :param observation: Class to add metadata to
         :param fits_full_name: String format name and path to fits file
         :param images: String name of fits file, no path
         :param plane_id: String id to allocate correct plane
+        :param fits_header_data: metadata already read with fr.header_extraction_many, read from the file if None
         :returns: plane created for fits file to be passed to the artifact function
         """
 
         plane = observation.planes[plane_id]
-        fits_header_data = fr.header_extraction(fits_full_name + images)
+        if fits_header_data is None:
+            fits_header_data = fr.header_extraction(fits_full_name + images)
 
 
         ra_pos = fits_header_data['ra_deg']
@@ -188,6 +314,7 @@ class EmerlinMetadata:
         provenance.version = fits_header_data['wsc_version']
 
 
+    @metrics.timed('measurement_set')
     def measurement_set_metadata(self, observation, ms_dir, plane_id):
         """
         Creates metadata for measurement sets, extracting infomation from the ms itself, as well as the pickle file
@@ -207,21 +334,31 @@ class EmerlinMetadata:
         #Release date to-do convert to ivoa:datetime
         plane.data_release = ms_other["data_release"]
 
-        # Make an Energy object for this Plane (bounds,samples required)
-        plane.energy = Energy(Interval(msmd_dict["wl_lower"], msmd_dict["wl_upper"]), [shape.SubInterval(msmd_dict["wl_lower"], msmd_dict["wl_upper"])]) 
+        # Make an Energy object for this Plane (bounds,samples required), with a sample per spectral window
+        spw = msmd_dict["spw"]
+        energy_samples = [shape.SubInterval(spw["wl_lower"][i], spw["wl_upper"][i])
+                          for i in np.argsort(spw["wl_lower"])]
+        plane.energy = Energy(Interval(msmd_dict["wl_lower"], msmd_dict["wl_upper"]), energy_samples)
+        plane.energy.resolving_power = float(np.median(spw["resolving_power"]))
+        plane.energy.resolving_power_bounds = Interval(float(np.min(spw["resolving_power"])),
+                                                       float(np.max(spw["resolving_power"])))
 
         plane.energy.bandpass_name = str(msmd_dict["bp_name"])
         
         plane.energy.sample_size = msmd_dict["chan_res"]
         plane.energy.dimension = msmd_dict["nchan"]      
+
+        plane.position = self.ms_position_metadata(ms_dir, msmd_dict)
  
         # Plane Time Object (2.5 bounds, samples required)
-        # If more than one time sample needed, then use a for loop to add samples.
-        time_sample = shape.SubInterval(ms_other["obs_start_time"], ms_other["obs_stop_time"])
+        # one sample per contiguous stretch of data, with the gaps between them (e.g. slews) left out
+        time_samples = [shape.SubInterval(start, stop) for start, stop in msmd_dict["time_intervals"]]
+        if not time_samples:
+            time_samples = [shape.SubInterval(ms_other["obs_start_time"], ms_other["obs_stop_time"])]
         time_bounds = Interval(ms_other["obs_start_time"], ms_other["obs_stop_time"])
-        plane.time = Time(time_bounds, [time_sample])
-        
-        #plane.time.exposure = msmd_dict["int_time"]
+        plane.time = Time(time_bounds, time_samples)
+        plane.time.exposure = msmd_dict["exposure"]
+        plane.time.resolution = msmd_dict["int_time"]
         #plane.time.dimension = msmd_dict["num_scans"]
 
         # Polarisation (Polarization) object needs at least one state as arg.
@@ -250,11 +387,14 @@ class EmerlinMetadata:
         artifact = Artifact(art_uri, DataLinkSemantics.THIS, ReleaseType.DATA)
         plane.artifacts[art_uri] = artifact
 
-        meta_data = msmd.get_local_file_info(ms_dir)
+        with metrics.timed('measurement_set.checksum', ms_dir):
+            meta_data = self.local_file_info(ms_dir)
 
         artifact.content_type = meta_data.file_type
         artifact.content_length = meta_data.size
-        artifact.content_checksum = 'md5:{}'.format(meta_data.md5sum)
+        artifact.content_checksum = self.content_checksum(meta_data)
+        if artifact.content_checksum is None:
+            self.deferred_checksums.append((artifact, ms_dir))
 
         return plane
         ### These components need their output value to be changed somewhat
@@ -262,6 +402,41 @@ class EmerlinMetadata:
         # provenance.keywords = str([key for key, value in pickle_obj['input_steps'].items() if value == 1])
 
 
+    def ms_position_metadata(self, ms_dir, msmd_dict):
+        """
+        Creates position metadata for measurement sets, from the target fields only, so that calibrators far from
+        the targets do not widen the bounds. A measurement set without target fields, e.g. a calibrator split, uses
+        all of its fields. Each field is sampled by a circle the size of the primary beam of the smallest dish,
+        and the bounds are the circle around their mean direction that encloses every sample. The angular
+        resolution comes from the longest baseline between unflagged antennas in the ANTENNA table.
+        :param ms_dir: string path and name of measurement set
+        :param msmd_dict: dictionary of metadata extracted from the measurement set
+        :returns: Position, or None if the fields are too far apart, see MAX_BOUNDS_RADIUS
+        """
+        fields = [i for i, name in enumerate(msmd_dict['mssources'])
+                  if self.roles.get(name, '').startswith('target')]
+        if not fields:
+            fields = range(len(msmd_dict['mssources']))
+        ra = np.array([np.rad2deg(msmd_dict['phs_cntr'][i]['m0']['value']) % 360 for i in fields])
+        dec = np.array([np.rad2deg(msmd_dict['phs_cntr'][i]['m1']['value']) for i in fields])
+        beam_radius = casa.primary_beam_radius(msmd_dict['wl_upper'], np.min(casa.get_dish_diameters(ms_dir)))
+
+        ra_c, dec_c, radius = casa.bounding_circle(ra, dec, beam_radius)
+        if radius > MAX_BOUNDS_RADIUS:
+            print('Warning: the fields of {} span {:.1f} degrees, no position is given'.format(ms_dir, 2 * radius))
+            return None
+        samples = shape.MultiShape([shape.Circle(Point(x, y), beam_radius) for x, y in zip(ra, dec)])
+        position = Position(shape.Circle(Point(ra_c, dec_c), radius), samples)
+
+        baseline = casa.get_longest_baseline(ms_dir)
+        if baseline > 0:
+            res_lower, res_upper = casa.angular_resolution([msmd_dict['wl_lower'], msmd_dict['wl_upper']], baseline)
+            position.resolution = 0.5 * (res_lower + res_upper)
+            position.resolution_bounds = Interval(res_lower, res_upper)
+        return position
+
+
+    @metrics.timed('simple_observation')
     def build_simple_observation_telescope(self, casa_info, ante_id):
         """
         :param casa_info: dictionary of metadata extracted from measurement set
@@ -288,14 +463,14 @@ class EmerlinMetadata:
 
 
         xml_output_name = self.xml_out_dir + self.obs_id + '_' + casa_info['antennas'][int(ante_id)] + '.xml'
-        writer = ObservationWriter()
-        writer.write(observation, xml_output_name)
+        xml_data = self.write_observation(observation, xml_output_name)
 
-        self.ingest_manager(observation.uri, xml_output_name)
+        self.enqueue_ingest(observation.uri, xml_data)
 
         return observation
 
 
+    @metrics.timed('simple_observation')
     def build_simple_observation_target(self, casa_info, target_name, target_ra, target_dec):
         """
         :param casa_info: dictionary of metadata extracted from measurement set
@@ -318,10 +493,9 @@ class EmerlinMetadata:
         # observation.proposal = Proposal(casa_info['prop_id']) # Uncomment once vo-dml sorted for proposal.id
 
         xml_output_name = self.xml_out_dir + self.obs_id + '_' + target_name + '.xml'
-        writer = ObservationWriter()
-        writer.write(observation, xml_output_name)
+        xml_data = self.write_observation(observation, xml_output_name)
 
-        self.ingest_manager(observation.uri, xml_output_name)
+        self.enqueue_ingest(observation.uri, xml_data)
 
         return observation
 
@@ -329,13 +503,92 @@ class EmerlinMetadata:
     def build_metadata(self):
         """
         Builds metadata for e-merlin pipeline output, including main and calibration measurement sets, fits images,
-        plots and pickle file metadata. The target measurement set and output destination are defined within the
-        settings_file.py.
+        plots and pickle file metadata. The target pipeline output and output destination are given to the
+        constructor, see from_settings to take them from settings_file.py.
+        """
+        if self.observable_directory:
+            metrics.start(self.profile_execution)
+
+        if self.checksum_cache_dir:
+            self.checksum_cache = ChecksumCache(self.checksum_cache_dir, self.checksum_cache_max_entries)
+        manifests = find_manifests(self.storage_name, self.checksum_manifest_names)
+        if self.checksum_manifest:
+            manifests.insert(0, self.checksum_manifest)
+        if manifests:
+            self.checksum_cache = ChecksumManifest(manifests, self.checksum_cache, self.manifest_verify_fraction)
+
+        try:
+            self.build_observation()
+        except BaseException:
+            # do not hash the files still queued before the error is raised, which could take hours
+            self.finish_file_info(cancel=True)
+            raise
+        finally:
+            # the checksums hashed so far are kept even if the run fails
+            self.finish_file_info()
+            if self.checksum_cache is not None:
+                print(self.checksum_cache)
+                self.checksum_cache.close()
+                self.checksum_cache = None
+
+        # If uploading is enabled, check for existing data records matching uri.
+        # If a single record exists, and replacing data is enabled, then delete and
+        # replace.  If multiple records exist then log error for analysis. 
+        with metrics.timed('ingest.wait'):
+            self.finish_ingest()
+        self.finish_xml_files()
+
+        if self.observable_directory:
+            print('Metrics written to ' + metrics.write(self.obs_id, self.observable_directory))
+
+    def build_observation(self):
+        """
+        Build the derived and simple observations of the pipeline output and queue them for upload, see
+        build_metadata, which opens and closes the checksum cache around this.
         """
+        observation = DerivedObservation('EMERLIN', self.obs_id, 'correlator')
+        self.hash_missing = not self.defer_checksums or self.previously_ingested(observation.uri)
+
+        # list everything up front: the measurement sets are hashed on a thread pool while they are read in worker
+        # processes, then the matched plots, images and splits are hashed while the observation is assembled here
+        plot_entries = [plots for directory in msmd.list_dir(self.storage_name + '/weblog/plots/')
+                        for plots in msmd.list_dir(directory.path)]
+        image_listing = [(directory, msmd.list_dir(directory.path))
+                         for directory in msmd.list_dir(self.storage_name + '/weblog/images/')]
+        split_entries = []
+        if os.path.isdir(self.storage_name + '/splits/'):
+            split_entries = [x for x in msmd.list_dir(self.storage_name + '/splits/') if x.name.split('.')[-1] == 'ms']
+        main_ms_dirs = [self.ms_dir_main] + ([self.ms_dir_spectral] if os.path.isdir(self.ms_dir_spectral) else [])
+
+        self.prefetch_file_info([(x, None) for x in main_ms_dirs])
+        with metrics.timed('casa.prefetch'):
+            casa.prefetch_snapshots(main_ms_dirs + [x.path + '/' for x in split_entries], self.casa_workers)
 
         casa_info = casa.msmd_collect(self.ms_dir_main, self.pickle_obj['targets'])
         # casa_other = casa.ms_other_collect(self.ms_dir_main)
-        observation = DerivedObservation('EMERLIN', self.obs_id, 'correlator')
+
+        # every plot, image directory and split is assigned to a plane in one pass over its name, and only those
+        # assigned are hashed
+        plane_id_list = list(casa_info['mssources']) + [basename(self.ms_dir_main)]
+        if os.path.isdir(self.ms_dir_spectral):
+            plane_id_list.append(basename(self.ms_dir_spectral))
+        matcher = PlaneMatcher(plane_id_list)
+        plots_matched = [(plots, matcher.match(plots.name)) for plots in plot_entries]
+        plots_matched = [(plots, plane_id_single) for plots, plane_id_single in plots_matched if plane_id_single]
+        image_dirs = []
+        for directory, image_entries in image_listing:
+            main_fits = [x.name for x in image_entries if x.name.endswith('-image.fits')]
+            if main_fits:
+                plane_id_single = matcher.match(directory.name)
+                if plane_id_single:
+                    image_dirs.append((directory, image_entries, main_fits[0], plane_id_single))
+        splits_matched = [(directory, matcher.match(directory.name)) for directory in split_entries]
+        splits_matched = [(directory, plane_id_single) for directory, plane_id_single in splits_matched
+                          if plane_id_single]
+        matcher.report('weblog plots, images and splits')
+        self.prefetch_file_info([(x.path + '/', None) for x, _ in splits_matched] +
+                                [(x.path, x) for x, _ in plots_matched] +
+                                [(x.path, x) for _, entries, _, _ in image_dirs for x in entries])
 
         for tele in range(len(casa_info['antennas'])):
             simple_observation = self.build_simple_observation_telescope(casa_info, tele)
@@ -347,6 +600,9 @@ class EmerlinMetadata:
                                                                       target_information["dec"][i])
             observation.members.add(simple_observation.uri)
 
+        # every uri of the run is now known, so uploads can start while the planes are built
+        self.start_ingest([observation.uri])
+
         observation.obs_type = 'science'
         observation.intent = ObservationIntentType.SCIENCE
 
@@ -354,7 +610,6 @@ class EmerlinMetadata:
 
         observation.planes = TypedOrderedDict(Plane)
 
-        plane_id_list = []
         for plane_target in casa_info['mssources']:
             plane = Plane(plane_target)
             observation.planes[plane_target] = plane
@@ -377,13 +632,10 @@ class EmerlinMetadata:
             provenance.version = self.pickle_obj['pipeline_version']
             provenance.run_id = self.pickle_obj['run']
 
-            plane_id_list.append(plane_target)
-
         ms_plane_id = basename(self.ms_dir_main)
         plane = Plane(ms_plane_id)
         plane.data_product_type = DataProductType('visibility')
         observation.planes[ms_plane_id] = plane
-        plane_id_list.append(ms_plane_id)
         self.measurement_set_metadata(observation, self.ms_dir_main, ms_plane_id)
 
         my_file = Path(self.ms_dir_spectral)
@@ -391,36 +643,26 @@ class EmerlinMetadata:
             sp_plane_id = basename(self.ms_dir_spectral)
             plane = Plane(sp_plane_id)
             observation.planes[sp_plane_id] = plane
-            plane_id_list.append(sp_plane_id)
             plane.data_product_type = DataProductType('spectrum')
             self.measurement_set_metadata(observation, self.ms_dir_spectral, sp_plane_id)
 
-        for directory in os.listdir(self.storage_name + '/weblog/plots/'):
-            for plots in os.listdir(self.storage_name + '/weblog/plots/' + directory + '/'):
-                plot_full_name = self.storage_name + '/weblog/plots/' + directory + '/' + plots
-                plane_id_single = [x for x in plane_id_list if x in plots]
-                if plane_id_single:
-                    self.artifact_metadata(observation, plane_id_single[0], plot_full_name, plots)
-
-        for directory in os.listdir(self.storage_name + '/weblog/images/'):
-            main_fits = [x for x in os.listdir(self.storage_name + '/weblog/images/' + directory + '/') if x.endswith('-image.fits')]
-            plane_id_full = self.storage_name + '/weblog/images/' + directory + '/'
-            if main_fits:
-                plane_id_single = [x for x in plane_id_list if x in directory]
-                self.fits_plane_metadata(observation, plane_id_full, main_fits[0], plane_id_single[0])
-                 # will this break?
-                for images in os.listdir(self.storage_name + '/weblog/images/' + directory + '/'):
-                    images_full_name = self.storage_name + '/weblog/images/' + directory + '/' + images
-                    self.artifact_metadata(observation, plane_id_single[0], images_full_name, images)
-
-        if os.path.isdir(self.storage_name + '/splits/'):
-            for directory in os.listdir(self.storage_name + '/splits/'):
-                extension = directory.split('.')[-1]
-                if extension == 'ms':
-                    plane_id_full = self.storage_name + '/splits/' + directory + '/'
-                    plane_id_single = [x for x in plane_id_list if x in directory]
-                    self.measurement_set_metadata(observation, plane_id_full, plane_id_single[0])
+        for plots, plane_id_single in plots_matched:
+            self.artifact_metadata(observation, plane_id_single, plots.path, plots.name, plots)
+
+        # the headers of every main image are read at once, then the planes are filled in order
+        fits_headers = fr.header_extraction_many([directory.path + '/' + x for directory, _, x, _ in image_dirs])
+        for (directory, image_entries, main_fits, plane_id_single), fits_header_data in zip(image_dirs, fits_headers):
+            plane_id_full = directory.path + '/'
+            self.fits_plane_metadata(observation, plane_id_full, main_fits, plane_id_single, fits_header_data)
+            for images in image_entries:
+                self.artifact_metadata(observation, plane_id_single, images.path, images.name, images)
+
+        for directory, plane_id_single in splits_matched:
+            plane_id_full = directory.path + '/'
+            self.measurement_set_metadata(observation, plane_id_full, plane_id_single)
+        self.finish_file_info()
         # currently not handling flag_versions as casa will not read "ms1" version measurement sets
+        casa.clear_snapshots()
         
         # removed for now but this structure can be used for auxiliary measurement sets in future
         # for directory in os.listdir(self.storage_name + '/weblog/calib/'):
@@ -438,42 +680,207 @@ class EmerlinMetadata:
         # structure of observation outside of functions?
         xml_output_name = self.xml_out_dir + self.obs_id + '.xml'
         
-        writer = ObservationWriter()
-        writer.write(observation, xml_output_name)
+        xml_data = self.write_observation(observation, xml_output_name)
+        self.enqueue_ingest(observation.uri, xml_data)
 
-        # If uploading is enabled, check for existing data records matching uri.
-        # If a single record exists, and replacing data is enabled, then delete and
-        # replace.  If multiple records exist then log error for analysis. 
-        self.ingest_manager(observation.uri, xml_output_name)
+        if self.deferred_checksums:
+            # the observation is published without these checksums first, then updated once they are known
+            with metrics.timed('ingest.wait'):
+                published = self.finish_ingest()
+            self.backfill_checksums(observation, xml_output_name, published)
+
+    def prefetch_file_info(self, items):
+        """
+        Start finding the size, checksum and type of files and measurement sets on a thread pool, so that they are
+        ready when their artifacts are built. Each item is scanned on the pool, and each file it holds is then
+        hashed as a task of its own on the same pool, so that the files of a large measurement set are hashed side
+        by side, with file_workers files read at once in all.
+        :param items: list of (name and path, os.DirEntry or None)
+        """
+        if self._file_pool is None:
+            self._file_pool = ThreadPoolExecutor(max_workers=max(self.file_workers, 1))
+        for fqn, entry in items:
+            if fqn not in self._file_info:
+                self._file_info[fqn] = self._file_pool.submit(self._scan_and_hash, self._file_pool, fqn, entry,
+                                                              self.hash_missing)
+
+    def _scan_and_hash(self, pool, fqn, entry, hash_missing):
+        # runs on the pool, and only queues the hashing of the files, so it never waits for other tasks
+        scan = msmd.scan_tree(fqn, entry)
+        return scan, [pool.submit(digest_file, x, self.checksum_algorithms, cache=self.checksum_cache,
+                                  hash_missing=hash_missing, stat_result=stat_result)
+                      for x, stat_result in zip(scan.files, scan.stats)]
+
+    def local_file_info(self, fqn, entry=None):
+        """
+        File information of an artifact, from prefetch_file_info if it was started there.
+        :param fqn: name and path of the file or measurement set
+        :param entry: os.DirEntry of the file, if available
+        :returns: FileInfo
+        """
+        future = self._file_info.pop(fqn, None)
+        if future is not None:
+            scan, digest_futures = future.result()
+            return msmd.file_info(scan, [x.result() for x in digest_futures], self.checksum_algorithms)
+        return msmd.get_local_file_info(fqn, entry, self.checksum_cache, self.checksum_algorithms,
+                                        self.hash_missing)
+
+    def content_checksum(self, meta_data):
+        """
+        :param meta_data: FileInfo of an artifact
+        :returns: checksum uri of the artifact, e.g. md5:0cc175b9c0f1b6a831c399e269772661, or None if the checksum
+                  was deferred
+        """
+        algorithm = self.checksum_algorithms[0]
+        if meta_data.checksums.get(algorithm) is None:
+            return None
+        return '{}:{}'.format(algorithm, meta_data.checksums[algorithm])
+
+    def previously_ingested(self, obs_uri):
+        """
+        :param obs_uri: uri of an observation
+        :returns: True if ingest_digest_dir holds a digest of the observation, i.e. an earlier run ingested it
+        """
+        if not self.ingest_digest_dir:
+            return False
+        digests = IngestDigests(self.ingest_digest_dir)
+        try:
+            return digests.get(obs_uri) is not None
+        finally:
+            digests.close()
+
+    def backfill_checksums(self, observation, xml_output_name, published=()):
+        """
+        Calculate the checksums deferred while the observation was built, fill them into its artifacts and queue
+        the observation again, so that the record published without them is updated.
+        :param observation: the observation already published
+        :param xml_output_name: file name for the archival copy of the XML
+        :param published: results of the first upload, from finish_ingest
+        """
+        deferred, self.deferred_checksums = self.deferred_checksums, []
+        print('Calculating {} deferred checksums of {}'.format(len(deferred), observation.uri))
+
+        self.hash_missing = True
+        with metrics.timed('checksum.backfill'):
+            self.prefetch_file_info([(fqn, None) for _, fqn in deferred])
+            for artifact, fqn in deferred:
+                meta_data = self.local_file_info(fqn)
+                artifact.content_length = meta_data.size
+                artifact.content_checksum = self.content_checksum(meta_data)
+            self.finish_file_info()
+
+        xml_data = self.write_observation(observation, xml_output_name)
+        self.enqueue_ingest(observation.uri, xml_data)
+        # a record this run inserted or replaced is updated whatever replace_old_data says; a record the first
+        # upload left alone is only replaced if replace_old_data allows it
+        if str(observation.uri) in published_uris(published):
+            self.start_ingest(replace_old_data=True)
+        else:
+            self.start_ingest()
+
+    def finish_file_info(self, cancel=False):
+        """
+        Wait for any prefetched file information that was not used and stop the pool, then flush the checksum
+        cache.
+        :param cancel: If True, files not yet being hashed are dropped, and only those in progress are waited for
+        """
+        if self._file_pool is not None:
+            self._file_pool.shutdown(wait=True, cancel_futures=cancel)
+            self._file_pool = None
+        self._file_info = {}
+        if self.checksum_cache is not None:
+            self.checksum_cache.flush()
+
+    def write_observation(self, observation, xml_output_name):
+        """
+        Serialise an observation to XML in memory, with the writer shared by the whole run. If write_xml_files
+        is set, the document is also saved to xml_output_name on a background thread.
+        :param observation: observation to serialise
+        :param xml_output_name: file name for the archival copy of the XML
+        :returns: the XML document as bytes
+        """
+        buffer = io.BytesIO()
+        with metrics.timed('xml.write', observation.uri):
+            self.writer.write(observation, buffer)
+        xml_data = buffer.getvalue()
+        if self.write_xml_files:
+            if self._xml_sink is None:
+                self._xml_sink = ThreadPoolExecutor(max_workers=1)
+            self._xml_writes.append(self._xml_sink.submit(write_xml_file, xml_output_name, xml_data))
+        return xml_data
+
+    def finish_xml_files(self):
+        """
+        Wait for the background XML file writes, raising the first error if any failed.
+        """
+        if self._xml_sink is not None:
+            self._xml_sink.shutdown(wait=True)
+            self._xml_sink = None
+        xml_writes, self._xml_writes = self._xml_writes, []
+        for future in xml_writes:
+            future.result()
+
+    def enqueue_ingest(self, obs_uri, xml_output_name):
+        """
+        Hand a written observation to the upload queue, or hold it until start_ingest if the queue is not running.
+        :param obs_uri: uri of the observation
+        :param xml_output_name: the XML document as bytes, or an xml file containing metadata to ingest
+        """
+        if self.ingest_queue is None:
+            self.pending_ingest.append((obs_uri, xml_output_name))
+        else:
+            self.ingest_queue.submit(obs_uri, xml_output_name)
 
-    def ingest_manager(self, obs_uri, xml_output_name):
+    def start_ingest(self, expected_uris=(), replace_old_data=None):
+        """
+        Start the upload queue. Existing records for the held observations and for expected_uris are found with
+        a single bulk TAP lookup.
+        :param expected_uris: uris of observations that will be submitted later
+        :param replace_old_data: If given, overrides self.replace_old_data for this queue
+        """
+        if not self.upload or self.ingest_queue is not None:
+            return
+        uris = [obs_uri for obs_uri, _ in self.pending_ingest] + list(expected_uris)
+        existing = api.find_existing_bulk(self, uris)
+        digests = IngestDigests(self.ingest_digest_dir) if self.ingest_digest_dir else None
+        if replace_old_data is None:
+            replace_old_data = self.replace_old_data
+        self.ingest_queue = IngestQueue(self, existing, replace_old_data, self.upload_workers, digests,
+                                        self.update_in_place)
+        for obs_uri, xml_output_name in self.pending_ingest:
+            self.ingest_queue.submit(obs_uri, xml_output_name)
+        self.pending_ingest = []
+
+    def finish_ingest(self):
+        """
+        Wait for all uploads to complete and print a summary.
+        :returns: list of (uri, list of (action, status code)), empty if upload is disabled
+        """
+        self.start_ingest()
+        results = []
+        if self.ingest_queue is not None:
+            results = self.ingest_queue.close()
+            if self.ingest_queue.digests is not None:
+                self.ingest_queue.digests.close()
+        self.ingest_queue = None
+        self.pending_ingest = []
+        return results
+
+    def ingest_manager(self, obs_uri, xml_output_name, existing=None):
         """
         Conditional to check for existing records, upload status, and unexpected duplicates,
-        and decide what to do next, with warnings/prints to log.  
+        and decide what to do next, with warnings/prints to log. Uploads one observation straight away; a
+        run uses the queue in enqueue_ingest instead.
         :obs_uri: uri from observation i.e. TS8004_C_001_20190801_1252+5634
         :param xml_output_name: xml file containing metadata to ingest.  
+        :param existing: dictionary of uri to record id from api.find_existing_bulk; if not given the record
+                         is looked up on its own
         """ 
-        if set_f.upload:
-            machine_id = api.find_existing(self, obs_uri)
-            if machine_id:
-                if set_f.replace_old_data and isinstance(machine_id, str):
-                    del_stat = api.request_delete(self, machine_id)
-                    if del_stat == 204:
-                        print(obs_uri + " deleted.")
-                    else:
-                        print(obs_uri + " attempted delete with status code: " + str(del_stat))
-                    create_stat = api.request_post(self, xml_output_name)
-                    if create_stat == 201:
-                        print(obs_uri + " ingested.")
-                    else:
-                        print(obs_uri + "attempted update with status code: " + create_stat)
-                else:
-                    print("Multiple records found; no action taken.")
+        if self.upload:
+            if existing is None:
+                machine_id = api.find_existing(self, obs_uri)
             else:
-                create_stat = api.request_post(self, xml_output_name)
-                if create_stat == 201:
-                    print(obs_uri + " ingested.")
-                else:
-                    print(obs_uri + " attempted insert with status code: " + str(create_stat))
-
-
+                machine_id = existing.get(str(obs_uri))
+            for action, status in ingest_observation(self, obs_uri, xml_output_name, machine_id,
+                                                     self.replace_old_data, update_in_place=self.update_in_place):
+                print(str(obs_uri) + ' ' + action + ': ' + str(status))
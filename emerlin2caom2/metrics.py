@@ -0,0 +1,144 @@
+import cProfile
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = [
+    'add',
+    'enabled',
+    'merge',
+    'start',
+    'summary',
+    'timed',
+    'write'
+]
+
+# Metrics are collected per process: a run of build_metadata, or one run per worker process in batch mode.
+# Stages may be timed from several threads at once, e.g. while hashing, so all updates are made behind a lock.
+_lock = threading.Lock()
+_enabled = False
+_started = None
+_stages = {}
+_counters = {}
+_events = []
+_profiler = None
+
+
+def start(profile=False):
+    """
+    Clear any previous metrics and start collecting.
+    :param profile: If True, also run cProfile on the calling thread until write is called
+    """
+    global _enabled, _started, _profiler
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        _events.clear()
+        _started = time.time()
+        _enabled = True
+    if profile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+@contextmanager
+def timed(stage, item=None):
+    """
+    Time a stage of the run, as a context manager or a decorator. Does nothing unless metrics have been started.
+    :param stage: name of the stage, e.g. 'casa.msmd'
+    :param item: the file, measurement set or request being processed; if given, the time is also recorded as an
+                 individual event
+    """
+    if not _enabled:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        with _lock:
+            totals = _stages.setdefault(stage, {'count': 0, 'seconds': 0., 'max_seconds': 0.})
+            totals['count'] += 1
+            totals['seconds'] += seconds
+            totals['max_seconds'] = max(totals['max_seconds'], seconds)
+            if item is not None:
+                _events.append({'stage': stage, 'item': str(item), 'seconds': seconds})
+
+
+def add(counter, value=1):
+    """
+    Add to a counter, e.g. bytes hashed or rows read. Does nothing unless metrics have been started.
+    :param counter: name of the counter
+    :param value: amount to add
+    """
+    if _enabled:
+        with _lock:
+            _counters[counter] = _counters.get(counter, 0) + value
+
+
+def enabled():
+    """
+    :returns: True if metrics are being collected in this process
+    """
+    return _enabled
+
+
+def merge(other):
+    """
+    Add the metrics collected in another process, e.g. a worker reading a measurement set, to those of this one.
+    Does nothing unless metrics have been started.
+    :param other: dictionary returned by summary in the other process
+    """
+    if not _enabled:
+        return
+    with _lock:
+        for stage, other_totals in other['stages'].items():
+            totals = _stages.setdefault(stage, {'count': 0, 'seconds': 0., 'max_seconds': 0.})
+            totals['count'] += other_totals['count']
+            totals['seconds'] += other_totals['seconds']
+            totals['max_seconds'] = max(totals['max_seconds'], other_totals['max_seconds'])
+        for counter, value in other['counters'].items():
+            _counters[counter] = _counters.get(counter, 0) + value
+        _events.extend(other['events'])
+
+
+def summary():
+    """
+    :returns: dictionary of the metrics collected so far
+    """
+    with _lock:
+        return {
+            'started': datetime.datetime.fromtimestamp(_started).isoformat() if _started else None,
+            'wall_seconds': time.time() - _started if _started else 0.,
+            'stages': {k: dict(v) for k, v in _stages.items()},
+            'counters': dict(_counters),
+            'events': list(_events),
+        }
+
+
+def write(run_name, out_dir):
+    """
+    Stop collecting and write the metrics of a run to a json file, and the cProfile statistics if profiling.
+    :param run_name: name of the run, e.g. the observation id
+    :param out_dir: directory for the output, created if necessary
+    :returns: name of the json file
+    """
+    global _enabled, _profiler
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.join(out_dir, '{}_{}'.format(run_name, datetime.datetime.now().strftime('%Y%m%dT%H%M%S')))
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(stem + '.prof')
+        _profiler = None
+
+    metrics = summary()
+    metrics['run'] = run_name
+    _enabled = False
+    json_file = stem + '_metrics.json'
+    with open(json_file, 'w') as file:
+        json.dump(metrics, file, indent=2)
+    return json_file
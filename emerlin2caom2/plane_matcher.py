@@ -0,0 +1,48 @@
+import re
+
+__all__ = [
+    'PlaneMatcher'
+]
+
+
+class PlaneMatcher:
+    """
+    Assigns weblog plots, image directories and split measurement sets to planes, by the plane id found within
+    their names. All plane ids are compiled into a single pattern, so each name is matched in one pass rather than
+    once per plane. When several plane ids occur in a name the longest is used, and among those the first in the
+    name, so overlapping ids such as 1252+56 and 1252+5634 are resolved the same way on every run.
+    Names that match no plane are kept in unmatched.
+    :param plane_ids: ids of the planes of the observation
+    """
+    def __init__(self, plane_ids):
+        self.plane_ids = list(plane_ids)
+        self.unmatched = []
+        ids = sorted(set(self.plane_ids), key=lambda x: (-len(x), x))
+        # a lookahead finds the longest id starting at every position, including overlapping ones
+        self._pattern = re.compile('(?=({}))'.format('|'.join(re.escape(x) for x in ids))) if ids else None
+
+    def match(self, name):
+        """
+        :param name: name of a file or directory, without its path
+        :returns: the plane id found in name, or None if there is none
+        """
+        best = None
+        if self._pattern is not None:
+            for found in self._pattern.finditer(name):
+                plane_id = found.group(1)
+                if best is None or len(plane_id) > len(best):
+                    best = plane_id
+        if best is None:
+            self.unmatched.append(name)
+        return best
+
+    def report(self, context=''):
+        """
+        Print the names that could not be assigned to a plane.
+        :param context: description of what was being matched, e.g. 'weblog plots'
+        :returns: list of the unmatched names
+        """
+        if self.unmatched:
+            print('No plane found for {} {}: {}'.format(len(self.unmatched), context or 'names',
+                                                        ', '.join(self.unmatched)))
+        return self.unmatched
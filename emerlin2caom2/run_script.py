@@ -1,5 +1,47 @@
-from emerlin2caom2 import main_app
+import argparse
+
+from emerlin2caom2 import batch
+from emerlin2caom2 import discovery
+from emerlin2caom2 import settings_file as set_f
 
 def run_em_2_caom():
-    a = main_app.EmerlinMetadata()
+    parser = argparse.ArgumentParser(description='Create and ingest CAOM metadata for an e-MERLIN pipeline output. '
+                                                 'Defaults are taken from settings_file.py.')
+    parser.add_argument('storage_name', nargs='?', default=set_f.storage_name,
+                        help='path of the e-MERLIN pipeline output')
+    parser.add_argument('--xmldir', default=set_f.xmldir, help='directory where the xml files are written')
+    parser.add_argument('--dry-run', action='store_true', help='write the xml files without uploading them')
+    parser.add_argument('--defer-checksums', action='store_true',
+                        help='publish before hashing, then update the observation with the checksums')
+    args = parser.parse_args()
+
+    # main_app pulls in caom2 and numpy, so it is only imported once the arguments are known
+    from emerlin2caom2 import main_app
+    a = main_app.EmerlinMetadata.from_settings(args.storage_name)
+    a.xml_out_dir = args.xmldir if args.xmldir.endswith('/') else args.xmldir + '/'
+    if args.dry_run:
+        a.upload = False
+    if args.defer_checksums:
+        a.defer_checksums = True
     a.build_metadata()
+
+def run_em_2_caom_batch():
+    parser = argparse.ArgumentParser(description='Create and ingest CAOM metadata for many e-MERLIN pipeline outputs.')
+    parser.add_argument('sources', nargs='+',
+                        help='files listing one pipeline output directory per line, or glob patterns of directories')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--log-dir', default=None, help='directory for the success, failure and retry logs')
+    args = parser.parse_args()
+    batch.run_batch(args.sources, args.workers, args.log_dir)
+
+def run_em_2_caom_discover():
+    parser = argparse.ArgumentParser(description='Create and ingest CAOM metadata for the e-MERLIN pipeline outputs '
+                                                 'that are new since the bookmark in the state file.')
+    parser.add_argument('root_dir', help='directory holding one pipeline output directory per run')
+    parser.add_argument('--state-file', default=None, help='state yaml file holding the bookmark')
+    parser.add_argument('--interval', type=int, default=None, help='length of each time box, in minutes')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--log-dir', default=None, help='directory for the success, failure and retry logs')
+    args = parser.parse_args()
+    discovery.run_discovery(args.root_dir, args.state_file, interval=args.interval, workers=args.workers,
+                            log_dir=args.log_dir)
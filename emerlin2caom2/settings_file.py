@@ -1,6 +1,50 @@
+import os
+
 storage_name = '' # string path and name of emerlin output, e.g. '/home/h14471mj/e-merlin/casa6_docker/prod/TS8004_C_001_20190801'
 xmldir = '' # directory where xml file will be generated, e.g. './data/'
+write_xml_files = True # if False, the xml is only held in memory for upload and no files are written
 
 upload = True
 replace_old_data = True
 base_url = '' # location of database e.g. 'https://src-data-repo.co.uk/torkeep/observations/EMERLIN'
+rootca = '' # path to your rootCA.pem or rootCA.crt file, if needed to verify the database certificate
+
+# http connections to the database
+request_timeout = (10, 120) # seconds to wait to connect, and for a response
+request_retries = 3 # retries on connection errors, 429 and 5xx responses
+request_backoff = 0.5 # seconds, doubled after each retry
+request_pool_size = 10 # connections kept alive
+upload_workers = 4 # observations uploaded at once
+casa_workers = 4 # measurement sets read at once, each in its own process; 0 reads them in the main process
+file_workers = 4 # files hashed at once, including the files within each measurement set
+ingest_digest_dir = '' # directory recording what was last ingested, e.g. './cache/'; unchanged observations are skipped
+update_in_place = False # replace changed records with a single put instead of delete and post, if the database allows
+
+checksum_cache_dir = '' # directory for the persistent checksum cache, e.g. './cache/'; leave empty to disable
+checksum_cache_max_entries = 1000000 # least recently used files are evicted beyond this number
+checksum_algorithms = ('md5',) # e.g. ('sha256', 'md5'); all are calculated in one read, the first is used in the xml
+checksum_manifest = '' # md5sum style manifest covering all storage, e.g. '/archive/MD5SUMS'; leave empty to disable
+checksum_manifest_names = ('MD5SUMS', 'SHA256SUMS') # manifests looked for within each pipeline output directory
+manifest_verify_fraction = 0. # e.g. 0.01 to hash 1 % of the files in the manifests anyway and report mismatches
+defer_checksums = False # publish new observations before hashing, then update them with the checksums
+
+# execution metrics, as in config/config.yml
+observe_execution = False # write a json file of the time spent in each stage, bytes hashed and rows read per run
+observable_directory = './metrics/'
+profile_execution = False # also write a cProfile dump per run, for use with pstats or snakeviz
+
+# batch mode, see run-emerlin-batch
+batch_workers = 4 # number of pipeline outputs processed at once
+log_file_directory = './logs/' # directory for the todo, success, failure, retry and progress files
+todo_file_name = 'todo.txt'
+success_log_file_name = 'success_log.txt'
+failure_log_file_name = 'failure_log.txt'
+retry_file_name = 'retries.txt'
+progress_file_name = 'progress.txt'
+
+# discovery mode, see run-emerlin-discover
+# relative to the config directory of this repository, not the directory the command is run from, e.g. by cron
+config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
+config_file = os.path.join(config_dir, 'config.yml') # the interval setting, in minutes, is the length of each time box
+state_file = os.path.join(config_dir, 'state.yml') # holds the bookmark of the last run processed
+bookmark_name = 'emerlin_timestamp'
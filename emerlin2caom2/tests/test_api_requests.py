@@ -0,0 +1,88 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
+
+import api_requests
+from api_requests import get_session, close_session, request_post, request_delete, adql_string, \
+    find_existing_bulk, find_existing
+
+
+@pytest.fixture
+def caller():
+    return SimpleNamespace(base_url='https://example.org/observations/EMERLIN')
+
+
+@pytest.fixture
+def mock_session():
+    session = MagicMock()
+    with patch('api_requests.get_session', return_value=session):
+        yield session
+
+
+def test_get_session_shared():
+    close_session()
+    session = get_session()
+    assert get_session() is session
+    adapter = session.get_adapter('https://example.org')
+    assert adapter.max_retries.total == api_requests.set_f.request_retries
+    assert 503 in adapter.max_retries.status_forcelist
+    close_session()
+    assert get_session() is not session
+    close_session()
+
+
+def test_request_post(caller, mock_session, tmp_path):
+    xml_file = tmp_path / "obs.xml"
+    xml_file.write_bytes(b"<Observation/>")
+    mock_session.post.return_value.status_code = 201
+
+    assert request_post(caller, str(xml_file)) == 201
+    args, kwargs = mock_session.post.call_args
+    assert args == (caller.base_url,)
+    assert kwargs['data'] == b"<Observation/>"
+    assert kwargs['timeout'] == api_requests.set_f.request_timeout
+
+
+def test_request_post_bytes(caller, mock_session):
+    mock_session.post.return_value.status_code = 201
+
+    assert request_post(caller, b"<Observation/>") == 201
+    assert mock_session.post.call_args.kwargs['data'] == b"<Observation/>"
+
+
+def test_request_delete(caller, mock_session):
+    mock_session.delete.return_value.status_code = 204
+
+    assert request_delete(caller, 'abc123') == 204
+    mock_session.delete.assert_called_once_with(caller.base_url + '/abc123',
+                                                timeout=api_requests.set_f.request_timeout)
+
+
+def test_adql_string():
+    assert adql_string("caom:EMERLIN/TS8004") == "'caom:EMERLIN/TS8004'"
+    assert adql_string("O'Brien") == "'O''Brien'"
+
+
+@pytest.fixture
+def mock_tap_service():
+    rows = [{'uri': 'caom:EMERLIN/a', 'id': 'id-a'},
+            {'uri': 'caom:EMERLIN/b', 'id': 'id-b1'},
+            {'uri': 'caom:EMERLIN/b', 'id': 'id-b2'}]
+    service = MagicMock()
+    service.search.side_effect = lambda query: [x for x in rows if adql_string(x['uri']) in query]
+    with patch('api_requests.get_tap_service', return_value=service):
+        yield service
+
+
+def test_find_existing_bulk(caller, mock_tap_service):
+    uris = ['caom:EMERLIN/a', 'caom:EMERLIN/b', 'caom:EMERLIN/c', 'caom:EMERLIN/a']
+    result = find_existing_bulk(caller, uris, chunk_size=2)
+
+    assert result == {'caom:EMERLIN/a': 'id-a', 'caom:EMERLIN/b': ['id-b1', 'id-b2']}
+    assert mock_tap_service.search.call_count == 2
+    assert "WHERE uri IN ('caom:EMERLIN/a', 'caom:EMERLIN/b')" in mock_tap_service.search.call_args_list[0][0][0]
+
+
+def test_find_existing(caller, mock_tap_service):
+    assert find_existing(caller, 'caom:EMERLIN/a') == 'id-a'
+    assert find_existing(caller, 'caom:EMERLIN/c') is None
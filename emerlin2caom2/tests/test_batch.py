@@ -0,0 +1,85 @@
+import pytest
+from unittest.mock import patch, MagicMock
+
+from batch import read_storage_list, read_log, append_log, run_batch
+
+
+@pytest.fixture
+def mock_storage(tmp_path):
+    # Create mock pipeline output directories and a stray file
+    for name in ["TS8004_C_001_20190801", "TS8004_L_001_20190802", "CY9999_C_002_20200101"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "TS8004_C_notes.txt").write_text("not a pipeline output")
+    return tmp_path
+
+
+def test_read_storage_list_glob(mock_storage):
+    result = read_storage_list([str(mock_storage / "TS8004_*")])
+    assert result == [str(mock_storage / "TS8004_C_001_20190801"), str(mock_storage / "TS8004_L_001_20190802")]
+
+
+def test_read_storage_list_file(mock_storage):
+    list_file = mock_storage / "runs.txt"
+    list_file.write_text("# backfill\n{0}/CY9999_C_002_20200101/\n\n{0}/TS8004_C_001_20190801\n".format(mock_storage))
+    result = read_storage_list([str(list_file), str(mock_storage / "TS8004_C_*")])
+    assert result == [str(mock_storage / "CY9999_C_002_20200101"), str(mock_storage / "TS8004_C_001_20190801")]
+
+
+def test_log_round_trip(tmp_path):
+    log_file = str(tmp_path / "success_log.txt")
+    assert read_log(log_file) == set()
+    append_log(log_file, "/data/TS8004_C_001_20190801", "2024-01-01T00:00:00")
+    append_log(log_file, "/data/TS8004_L_001_20190802", "2024-01-01T00:01:00")
+    assert read_log(log_file) == {"/data/TS8004_C_001_20190801", "/data/TS8004_L_001_20190802"}
+
+
+@pytest.fixture
+def in_process_pool():
+    # run the batch in this process, with process_storage failing for any storage directory named *_L_*
+    pool = MagicMock()
+    pool.__enter__.return_value.imap_unordered.side_effect = lambda func, items: map(func, items)
+    processed = []
+
+    def process_storage(storage_name):
+        processed.append(storage_name)
+        if '_L_' in storage_name:
+            return storage_name, 'Traceback (most recent call last):\nRuntimeError: cannot open table\n'
+        return storage_name, None
+
+    with patch('batch.multiprocessing.get_context') as mock_context, \
+            patch('batch.process_storage', side_effect=process_storage):
+        mock_context.return_value.Pool.return_value = pool
+        yield processed
+
+
+def test_run_batch_logs(mock_storage, in_process_pool, tmp_path):
+    log_dir = tmp_path / "logs"
+    counts = run_batch([str(mock_storage / "*_0*")], workers=2, log_dir=str(log_dir))
+
+    assert counts == {'succeeded': 2, 'failed': 1, 'skipped': 0}
+    assert len(in_process_pool) == 3
+    assert read_log(str(log_dir / "success_log.txt")) == {str(mock_storage / "CY9999_C_002_20200101"),
+                                                          str(mock_storage / "TS8004_C_001_20190801")}
+    assert read_log(str(log_dir / "retries.txt")) == {str(mock_storage / "TS8004_L_001_20190802")}
+    failure = (log_dir / "failure_log.txt").read_text().split('\t')
+    assert failure[0] == str(mock_storage / "TS8004_L_001_20190802")
+    assert failure[-1] == "RuntimeError: cannot open table\n"
+    assert (log_dir / "todo.txt").read_text().splitlines() == read_storage_list([str(mock_storage / "*_0*")])
+    assert (log_dir / "progress.txt").read_text().count('\n') == 3
+
+
+def test_run_batch_resumes(mock_storage, in_process_pool, tmp_path):
+    log_dir = tmp_path / "logs"
+    run_batch([str(mock_storage / "*_0*")], log_dir=str(log_dir))
+    del in_process_pool[:]
+
+    # a second batch skips the runs that succeeded, retries the failure and truncates the retry file
+    with patch('batch.process_storage', side_effect=lambda x: in_process_pool.append(x) or (x, None)):
+        counts = run_batch([str(log_dir / "retries.txt")], log_dir=str(log_dir))
+    assert counts == {'succeeded': 1, 'failed': 0, 'skipped': 0}
+    assert in_process_pool == [str(mock_storage / "TS8004_L_001_20190802")]
+    assert read_log(str(log_dir / "retries.txt")) == set()
+
+    counts = run_batch([str(mock_storage / "*_0*")], log_dir=str(log_dir))
+    assert counts == {'succeeded': 0, 'failed': 0, 'skipped': 3}
+    assert len(in_process_pool) == 1
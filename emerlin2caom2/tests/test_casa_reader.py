@@ -1,4 +1,5 @@
 import pytest
+import threading
 import numpy as np
 from unittest.mock import patch, MagicMock
 from datetime import datetime
@@ -6,7 +7,11 @@ import casa_reader
 # Import the functions you want to test
 from casa_reader import (msmd_collect, ms_other_collect, emerlin_band, freq2wl,
                          get_polar, get_scan_sum, target_position, polar2cart,
-                         get_release_date, mjdtodate, get_obstime)
+                         get_release_date, mjdtodate, get_obstime, MSMetadataSnapshot,
+                         get_snapshot, clear_snapshots, column_statistics, get_uvdist,
+                         angular_resolution, angular_separation, primary_beam_radius, prefetch_snapshots,
+                         time_intervals, merge_intervals, spectral_windows, longest_baseline, load_snapshot,
+                         bounding_circle)
 
 
 
@@ -39,6 +44,271 @@ def test_freq2wl():
 
 # Add more tests for other functions...
 
+# Test measurement set snapshots
+@pytest.fixture
+def mock_tb():
+    tools = {'table': MagicMock()}
+    with patch('casa_reader.get_tool', side_effect=lambda name: tools.setdefault(name, MagicMock())):
+        yield tools['table']
+
+
+def test_get_tool_per_thread():
+    casatools = MagicMock()
+    casatools.table.side_effect = MagicMock
+    with patch.dict('sys.modules', {'casatools': casatools}):
+        casa_reader.discard_tool('table')
+        tool = casa_reader.get_tool('table')
+        assert casa_reader.get_tool('table') is tool
+        other = []
+        thread = threading.Thread(target=lambda: other.append(casa_reader.get_tool('table')))
+        thread.start()
+        thread.join()
+        assert other[0] is not tool
+        casa_reader.discard_tool('table')
+
+
+def test_open_tool_discards_tool_on_failed_open(mock_tb):
+    mock_tb.open.side_effect = RuntimeError
+    with patch('casa_reader.discard_tool') as mock_discard:
+        with pytest.raises(RuntimeError):
+            with casa_reader.open_tool('table', 'dummy.ms'):
+                pass
+    mock_discard.assert_called_once_with('table')
+    mock_tb.close.assert_not_called()
+
+
+def test_get_snapshot_memoized():
+    clear_snapshots()
+    snapshot = get_snapshot('dummy.ms')
+    assert isinstance(snapshot, MSMetadataSnapshot)
+    assert get_snapshot('dummy.ms/') is snapshot
+    clear_snapshots()
+    assert get_snapshot('dummy.ms') is not snapshot
+
+
+def test_prefetch_snapshots_in_process():
+    clear_snapshots()
+    get_snapshot('a.ms')
+    with patch('casa_reader.load_snapshot') as mock_load:
+        prefetch_snapshots(['a.ms', 'b.ms/', 'b.ms', 'c.ms'], workers=0)
+    assert [x.args[0] for x in mock_load.call_args_list] == ['b.ms', 'c.ms']
+    clear_snapshots()
+
+
+def test_load_snapshot_in_worker_returns_metrics():
+    def load_snapshot(ms_file):
+        casa_reader.metrics.add('rows_read', 5)
+        return MSMetadataSnapshot(ms_file)
+
+    with patch('casa_reader.load_snapshot', side_effect=load_snapshot):
+        snapshot, worker_metrics = casa_reader._load_snapshot_in_worker(('a.ms', True))
+        assert snapshot.ms_file == 'a.ms'
+        assert worker_metrics['counters'] == {'rows_read': 5}
+        casa_reader.metrics._enabled = False
+        assert casa_reader._load_snapshot_in_worker(('a.ms', False))[1] is None
+
+
+def test_prefetch_snapshots_merges_worker_metrics():
+    clear_snapshots()
+    casa_reader.metrics.start()
+    worker_metrics = {'stages': {'casa.msmd': {'count': 1, 'seconds': 2., 'max_seconds': 2.}},
+                      'counters': {'rows_read': 10}, 'events': [{'stage': 'casa.msmd', 'item': 'a.ms', 'seconds': 2.}]}
+    pool = MagicMock()
+    pool.__enter__.return_value.imap.side_effect = lambda func, items: [
+        (MSMetadataSnapshot(ms_file), worker_metrics) for ms_file, collect in items if collect]
+    with patch('casa_reader.multiprocessing.get_context') as mock_context:
+        mock_context.return_value.Pool.return_value = pool
+        prefetch_snapshots(['a.ms', 'b.ms'], workers=2)
+
+    summary = casa_reader.metrics.summary()
+    casa_reader.metrics._enabled = False
+    assert summary['stages']['casa.msmd'] == {'count': 2, 'seconds': 4., 'max_seconds': 2.}
+    assert summary['counters'] == {'rows_read': 20}
+    assert len(summary['events']) == 2
+    assert sorted(casa_reader._snapshots) == ['a.ms', 'b.ms']
+    clear_snapshots()
+
+
+def test_snapshot_opens_subtable_once(mock_tb):
+    columns = {'POLARIZATION_TYPE': np.array([['R', 'R'], ['L', 'L']]), 'NUM_RECEPTORS': np.array([2, 2])}
+    mock_tb.getcol.side_effect = lambda col: columns[col]
+    clear_snapshots()
+
+    assert get_polar('dummy.ms') == (['RR', 'LL'], 2)
+    assert get_polar('dummy.ms') == (['RR', 'LL'], 2)
+    mock_tb.open.assert_called_once_with('dummy.ms/FEED')
+    mock_tb.close.assert_called_once()
+    clear_snapshots()
+
+
+# Test observation time range
+def test_time_range_from_time_intervals():
+    snapshot = MSMetadataSnapshot('dummy.ms')
+    snapshot._msmd_elements = {'time_intervals': np.array([[10., 20.], [25., 30.]])}
+    assert snapshot.time_range() == (10., 30.)
+
+
+def test_time_range_from_observation_table():
+    snapshot = MSMetadataSnapshot('dummy.ms')
+    snapshot._msmd_elements = {'time_intervals': np.empty((0, 2))}
+    snapshot._subtables['OBSERVATION'] = {'TIME_RANGE': np.array([[10.], [30.]])}
+    assert snapshot.time_range() == (10., 30.)
+
+
+def test_time_intervals():
+    times = np.array([16., 0., 4., 4., 8., 28., 32., 44.])
+    # a missing integration at 12 s is bridged, the gaps before 28 s and 44 s are not
+    assert time_intervals(times, 4., gap=4.).tolist() == [[-2., 18.], [26., 34.], [42., 46.]]
+    assert time_intervals(np.array([]), 4.).shape == (0, 2)
+
+
+def test_merge_intervals():
+    field_intervals = [np.array([[0., 10.], [40., 50.]]), np.empty((0, 2)), np.array([[10., 12.], [2., 4.]]),
+                       np.array([[15., 20.]])]
+    assert merge_intervals(field_intervals).tolist() == [[0., 12.], [15., 20.], [40., 50.]]
+    assert merge_intervals(field_intervals, gap=5.).tolist() == [[0., 20.], [40., 50.]]
+    assert merge_intervals([]).shape == (0, 2)
+
+
+def test_snapshot_keeps_time_intervals_only(mock_tb):
+    msmd = MagicMock()
+    msmd.nfields.return_value = 2
+    msmd.scannumbers.return_value = [1]
+    msmd.exposuretime.return_value = {'value': 2.}
+    msmd.timesforfield.side_effect = lambda x: np.arange(0., 20., 2.) + 100. * x
+    snapshot = MSMetadataSnapshot('dummy.ms')
+    snapshot._subtables['SPECTRAL_WINDOW'] = {'CHAN_FREQ': [np.array([5e9])], 'CHAN_WIDTH': [np.array([1e6])]}
+    with patch('casa_reader.open_tool') as mock_open:
+        mock_open.return_value.__enter__.return_value = msmd
+        elements = snapshot.msmd_elements
+
+    assert 'field_time' not in elements
+    assert elements['time_intervals'].tolist() == [[-1., 19.], [99., 119.]]
+    assert elements['exposure'] == pytest.approx(40.)
+
+
+def test_spectral_windows():
+    # two windows of different widths and channel counts, the second with descending frequencies
+    chan_freqs = [np.array([1.0e9, 1.1e9, 1.2e9, 1.3e9]), np.array([2.0e9, 1.9e9])]
+    chan_widths = [np.full(4, 0.1e9), np.full(2, -0.1e9)]
+    spw = spectral_windows(chan_freqs, chan_widths)
+
+    assert spw['nchan'].tolist() == [4, 2]
+    assert spw['wl_lower'] == pytest.approx([freq2wl(1.35e9), freq2wl(2.05e9)])
+    assert spw['wl_upper'] == pytest.approx([freq2wl(0.95e9), freq2wl(1.85e9)])
+    assert spw['resolving_power'] == pytest.approx([11.5, 19.5])
+    assert spw['freq_min'] == 1.0e9
+
+
+def test_spectral_windows_without_channels():
+    with pytest.raises(ValueError):
+        spectral_windows([np.array([])], [np.array([])])
+
+
+def test_snapshot_spectral_windows(mock_tb):
+    cells = {'CHAN_FREQ': {'r1': np.array([[5e9], [5.1e9]]), 'r2': np.array([[6e9]])},
+             'CHAN_WIDTH': {'r1': np.array([[1e8], [1e8]]), 'r2': np.array([[1e8]])}}
+    mock_tb.getvarcol.side_effect = lambda col: cells[col]
+    spectral_window = MSMetadataSnapshot('dummy.ms').subtable('SPECTRAL_WINDOW')
+
+    mock_tb.open.assert_called_once_with('dummy.ms/SPECTRAL_WINDOW')
+    mock_tb.getcol.assert_not_called()
+    assert [x.tolist() for x in spectral_window['CHAN_FREQ']] == [[5e9, 5.1e9], [6e9]]
+    assert spectral_windows(spectral_window['CHAN_FREQ'], spectral_window['CHAN_WIDTH'])['nchan'].tolist() == [2, 1]
+
+
+def test_time_range_full_scan(mock_tb):
+    time_col = np.array([5., 3., 9., 1., 7.])
+    mock_tb.nrows.return_value = len(time_col)
+    mock_tb.getcol.side_effect = lambda col, startrow, nrow: time_col[startrow:startrow + nrow]
+    snapshot = MSMetadataSnapshot('dummy.ms')
+
+    assert snapshot.scan_time_column(chunk_rows=2) == (1., 9.)
+    assert mock_tb.getcol.call_count == 3
+    assert snapshot.time_range(full_scan=True) == (1., 9.)
+
+
+# Test streaming column statistics
+@pytest.fixture
+def mock_main_table(mock_tb):
+    columns = {
+        'UVW': np.array([[3., 0., 6., 30., 0.], [4., 0., 8., 40., 0.], [0., 0., 0., 0., 0.]]),
+        'ANTENNA1': np.array([0, 1, 0, 1, 2]),
+        'ANTENNA2': np.array([1, 1, 2, 2, 2]),
+        'FLAG_ROW': np.array([False, False, False, True, False]),
+    }
+    mock_tb.nrows.return_value = 5
+    mock_tb.getcol.side_effect = lambda col, startrow, nrow: columns[col][..., startrow:startrow + nrow]
+    return mock_tb
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 2, 5])
+def test_column_statistics(mock_main_table, chunk_rows):
+    stats = column_statistics('dummy.ms', chunk_rows=chunk_rows, uv_bins=np.array([0., 6., 12.]))
+
+    assert stats['nrows'] == 5
+    assert stats['uvdist_min'] == 5.
+    assert stats['uvdist_max'] == 10.  # flagged 50 m baseline and autocorrelations are excluded
+    assert stats['uv_hist'].tolist() == [1, 1]
+    assert stats['ant_rows'].tolist() == [2, 4, 4]
+    assert stats['flag_fraction'] == pytest.approx(0.2)
+    mock_main_table.close.assert_called_once()
+
+
+def test_get_uvdist(mock_main_table):
+    assert get_uvdist('dummy.ms').tolist() == [5., 0., 10., 50., 0.]
+
+
+def test_longest_baseline():
+    positions = np.array([[0., 3., 0., 100.], [0., 4., 0., 0.], [0., 0., 12., 0.]])
+    assert longest_baseline(positions) == pytest.approx(np.hypot(100., 12.))
+    assert longest_baseline(positions, np.array([False, False, False, True])) == pytest.approx(np.hypot(5., 12.))
+    assert longest_baseline(positions[:, :1]) == 0.
+
+
+def test_load_snapshot_does_not_scan_main_table():
+    clear_snapshots()
+    with patch('casa_reader.MSMetadataSnapshot.subtable'), \
+            patch('casa_reader.MSMetadataSnapshot.msmd_elements'), \
+            patch('casa_reader.MSMetadataSnapshot.obstime'), \
+            patch('casa_reader.iter_columns', side_effect=AssertionError('main table was scanned')):
+        load_snapshot('dummy.ms')
+    clear_snapshots()
+
+
+def test_angular_resolution():
+    # 1 m at a baseline of 206265 m is 1 arcsec
+    assert angular_resolution(1., 180. * 3600. / np.pi) == pytest.approx(1.)
+
+
+def test_angular_separation():
+    assert angular_separation(10., 0., np.array([10., 20.]), np.array([90., 0.])) == pytest.approx([90., 10.])
+
+
+def test_bounding_circle():
+    assert bounding_circle(np.array([10.]), np.array([20.]), 0.5) == pytest.approx((10., 20., 0.5))
+    ra, dec, radius = bounding_circle(np.array([359., 1.]), np.array([0., 0.]), 0.5)
+    assert (ra % 360, dec, radius) == pytest.approx((0., 0., 1.5), abs=1e-9)
+    # the circle does not depend on the order of the fields
+    ra_list, dec_list = np.array([50., 52., 51.]), np.array([30., 30., 31.])
+    assert bounding_circle(ra_list, dec_list) == pytest.approx(bounding_circle(ra_list[::-1], dec_list[::-1]))
+    assert bounding_circle(np.array([0., 180.]), np.array([0., 0.]))[2] == 180.
+
+
+def test_primary_beam_radius():
+    assert primary_beam_radius(0.2, 25.) == pytest.approx(np.rad2deg(0.61 * 0.2 / 25.))
+
+
+def test_snapshot_closes_on_error(mock_tb):
+    mock_tb.getcol.side_effect = RuntimeError
+    clear_snapshots()
+
+    with pytest.raises(RuntimeError):
+        get_release_date('dummy.ms')
+    mock_tb.close.assert_called_once()
+    clear_snapshots()
+
+
 # Test polar2cart function
 def test_polar2cart():
     result = polar2cart(1, np.pi / 4, np.pi / 4)
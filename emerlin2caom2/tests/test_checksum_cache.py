@@ -0,0 +1,98 @@
+import pytest
+import os
+from hashlib import md5
+
+from checksum_cache import ChecksumCache
+from checksums import hash_files
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ChecksumCache(str(tmp_path / "cache"), max_entries=2)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    fqn = tmp_path / "image.fits"
+    fqn.write_bytes(b"test data")
+    return str(fqn)
+
+
+def test_cache_miss_then_hit(cache, data_file):
+    stat_result = os.stat(data_file)
+    assert cache.get(data_file, stat_result) is None
+    cache.put(data_file, stat_result, 'abc123')
+    assert cache.get(data_file, stat_result) == 'abc123'
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_cache_changed_file(cache, data_file):
+    cache.put(data_file, os.stat(data_file), 'abc123')
+    with open(data_file, 'ab') as f:
+        f.write(b" more data")
+    assert cache.get(data_file, os.stat(data_file)) is None
+
+
+def test_cache_algorithms_are_separate(cache, data_file):
+    stat_result = os.stat(data_file)
+    cache.put(data_file, stat_result, 'abc123')
+    assert cache.get(data_file, stat_result, algorithm='sha256') is None
+
+
+def test_cache_persistent(tmp_path, data_file):
+    stat_result = os.stat(data_file)
+    first = ChecksumCache(str(tmp_path / "cache"))
+    first.put(data_file, stat_result, 'abc123')
+    first.close()
+    second = ChecksumCache(str(tmp_path / "cache"))
+    assert second.get(data_file, stat_result) == 'abc123'
+    second.close()
+
+
+def test_cache_evicts_least_recently_used(cache, tmp_path):
+    names = []
+    for i in range(3):
+        fqn = tmp_path / "plot_{}.png".format(i)
+        fqn.write_bytes(b"plot")
+        names.append(str(fqn))
+        cache.put(names[-1], os.stat(names[-1]), 'hash_{}'.format(i))
+    cache.get(names[0], os.stat(names[0]))
+    assert cache.evict() == 1
+    assert cache.get(names[1], os.stat(names[1])) is None
+    assert cache.get(names[0], os.stat(names[0])) == 'hash_0'
+
+
+def test_hash_files_with_cache(cache, data_file):
+    assert hash_files([data_file], cache=cache) == [md5(b"test data").hexdigest()]
+    assert hash_files([data_file], cache=cache) == [md5(b"test data").hexdigest()]
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_caches_share_directory(tmp_path, data_file):
+    # two runs, e.g. batch workers, using the same cache at once
+    stat_result = os.stat(data_file)
+    first = ChecksumCache(str(tmp_path / "cache"), timeout=1.)
+    second = ChecksumCache(str(tmp_path / "cache"), timeout=1.)
+    assert first.get(data_file, stat_result) is None
+    first.put(data_file, stat_result, 'abc123')
+    second.put(data_file, stat_result, 'abc123')
+    second.flush()
+    first.flush()
+    assert second.get(data_file, stat_result) == 'abc123'
+    first.close()
+    second.close()
+
+
+def test_cache_flushes_in_batches(tmp_path, data_file):
+    stat_result = os.stat(data_file)
+    cache = ChecksumCache(str(tmp_path / "cache"), flush_every=3)
+    reader = ChecksumCache(str(tmp_path / "cache"))
+    cache.put(data_file, stat_result, 'abc123')
+    assert cache.get(data_file, stat_result) == 'abc123'
+    assert reader.get(data_file, stat_result) is None
+    cache.put(data_file, stat_result, 'abc123', algorithm='sha256')
+    assert reader.get(data_file, stat_result) == 'abc123'
+    cache.close()
+    reader.close()
@@ -0,0 +1,81 @@
+import os
+from hashlib import md5, sha256
+
+from checksum_manifest import ChecksumManifest, read_manifest, find_manifests
+
+
+def write_manifest(path, lines, mtime=None):
+    path.write_text(''.join(x + '\n' for x in lines))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_read_manifest(tmp_path):
+    digest = sha256(b'b').hexdigest()
+    manifest = write_manifest(tmp_path / 'SUMS', ['# comment', 'a' * 32 + '  a.txt', digest + ' *sub/b.fits',
+                                                  'short  c.txt', ''])
+    assert read_manifest(manifest) == {(str(tmp_path / 'a.txt'), 'md5'): 'a' * 32,
+                                       (str(tmp_path / 'sub' / 'b.fits'), 'sha256'): digest}
+
+
+def test_find_manifests(tmp_path):
+    (tmp_path / 'splits').mkdir()
+    (tmp_path / 'obs_avg.ms').mkdir()
+    write_manifest(tmp_path / 'MD5SUMS', [])
+    write_manifest(tmp_path / 'splits' / 'MD5SUMS', [])
+    write_manifest(tmp_path / 'obs_avg.ms' / 'MD5SUMS', [])
+    assert find_manifests(str(tmp_path), ('MD5SUMS', 'SHA256SUMS')) == [str(tmp_path / 'MD5SUMS'),
+                                                                        str(tmp_path / 'splits' / 'MD5SUMS')]
+    assert find_manifests(str(tmp_path), ()) == []
+
+
+def test_manifest_trusted_until_file_modified(tmp_path):
+    fqn = tmp_path / 'a.txt'
+    fqn.write_bytes(b'data')
+    os.utime(fqn, (1000, 1000))
+    manifest = ChecksumManifest([write_manifest(tmp_path / 'MD5SUMS', ['f' * 32 + '  a.txt'], mtime=2000)])
+
+    assert manifest.get(str(fqn), os.stat(fqn)) == 'f' * 32
+    assert manifest.get(str(fqn), os.stat(fqn), 'sha256') is None
+    os.utime(fqn, (3000, 3000))
+    assert manifest.get(str(fqn), os.stat(fqn)) is None
+    assert manifest.stats() == {'hits': 1, 'misses': 2, 'verified': 0, 'mismatches': 0}
+
+
+def test_manifest_falls_through_to_cache(tmp_path):
+    class Cache(dict):
+        def get(self, fqn, stat_result, algorithm='md5'):
+            return dict.get(self, (fqn, algorithm))
+
+        def put(self, fqn, stat_result, digest, algorithm='md5'):
+            self[(fqn, algorithm)] = digest
+
+        def flush(self):
+            pass
+
+    fqn = tmp_path / 'b.txt'
+    fqn.write_bytes(b'data')
+    cache = Cache()
+    manifest = ChecksumManifest([write_manifest(tmp_path / 'MD5SUMS', [])], cache)
+    assert manifest.get(str(fqn), os.stat(fqn)) is None
+    manifest.put(str(fqn), os.stat(fqn), 'e' * 32)
+    assert manifest.get(str(fqn), os.stat(fqn)) == 'e' * 32
+
+
+def test_manifest_verify_sample(tmp_path, capsys):
+    good = tmp_path / 'good.txt'
+    bad = tmp_path / 'bad.txt'
+    good.write_bytes(b'good')
+    bad.write_bytes(b'bad')
+    lines = [md5(b'good').hexdigest() + '  good.txt', '0' * 32 + '  bad.txt']
+    manifest = ChecksumManifest([write_manifest(tmp_path / 'MD5SUMS', lines, mtime=os.stat(bad).st_mtime + 10)],
+                                verify_fraction=1.)
+
+    for fqn, data in ((good, b'good'), (bad, b'bad')):
+        assert manifest.get(str(fqn), os.stat(fqn)) is None
+        manifest.put(str(fqn), os.stat(fqn), md5(data).hexdigest())
+
+    assert manifest.stats() == {'hits': 0, 'misses': 0, 'verified': 2, 'mismatches': 1}
+    assert manifest.mismatches == [str(bad)]
+    assert 'bad.txt does not match its manifest' in capsys.readouterr().out
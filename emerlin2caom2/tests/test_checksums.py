@@ -0,0 +1,132 @@
+import pytest
+from unittest.mock import patch
+import os
+from hashlib import md5, sha256
+
+from checksums import file_md5, file_digests, digest_file, digest_files, list_files, hash_files, reduce_hashes, \
+    dirhash
+
+
+@pytest.fixture
+def mock_measurement_set(tmp_path):
+    # Create a mock measurement set with a nested sub-table
+    ms_dir = tmp_path / "test_avg.ms"
+    (ms_dir / "ANTENNA").mkdir(parents=True)
+    (ms_dir / "table.dat").write_bytes(b"main table")
+    (ms_dir / "table.f0").write_bytes(b"x" * 100000)
+    (ms_dir / "ANTENNA" / "table.dat").write_bytes(b"antenna table")
+    return ms_dir
+
+
+def expected_dirhash(contents):
+    # Reduction used by checksumdir.dirhash: md5 of the sorted md5s of each file
+    hash_md5 = md5()
+    for hash_val in sorted(md5(x).hexdigest() for x in contents):
+        hash_md5.update(hash_val.encode('utf-8'))
+    return hash_md5.hexdigest()
+
+
+def test_file_md5(tmp_path):
+    fqn = tmp_path / "file.txt"
+    fqn.write_bytes(b"test data" * 1000)
+    assert file_md5(fqn, chunk_size=7) == md5(b"test data" * 1000).hexdigest()
+
+
+@pytest.mark.parametrize("chunk_size", [7, 9000, 8 * 1024 * 1024])
+def test_file_digests(tmp_path, chunk_size):
+    fqn = tmp_path / "file.txt"
+    fqn.write_bytes(b"test data" * 1000)
+    assert file_digests(fqn, ('md5', 'sha256'), chunk_size) == {'md5': md5(b"test data" * 1000).hexdigest(),
+                                                                 'sha256': sha256(b"test data" * 1000).hexdigest()}
+
+
+def test_digest_files_cache_per_algorithm(mock_measurement_set):
+    file_list = list_files(mock_measurement_set)
+    cache = {}
+
+    class DictCache:
+        def get(self, fqn, stat_result, algorithm='md5'):
+            return cache.get((fqn, algorithm))
+
+        def put(self, fqn, stat_result, digest, algorithm='md5'):
+            cache[(fqn, algorithm)] = digest
+
+        def flush(self):
+            pass
+
+    hash_files(file_list, cache=DictCache())
+    with patch('checksums.file_digests', wraps=file_digests) as mock_digests:
+        result = digest_files(file_list, ('md5', 'sha256'), cache=DictCache())
+    # only the sha256 is missing from the cache
+    assert {x.args[1] for x in mock_digests.call_args_list} == {('sha256',)}
+    assert result == [file_digests(x, ('md5', 'sha256')) for x in file_list]
+
+
+def test_digest_files_without_hashing(mock_measurement_set):
+    file_list = sorted(list_files(mock_measurement_set))
+
+    class DictCache:
+        def get(self, fqn, stat_result, algorithm='md5'):
+            return 'cached' if fqn == file_list[0] else None
+
+        def put(self, fqn, stat_result, digest, algorithm='md5'):
+            raise AssertionError('nothing is hashed')
+
+        def flush(self):
+            pass
+
+    with patch('checksums.file_digests', side_effect=AssertionError('file was hashed')):
+        assert digest_files(file_list, cache=DictCache(), hash_missing=False) == \
+            [{'md5': 'cached'}, {'md5': None}, {'md5': None}]
+        assert digest_files(file_list, hash_missing=False) == [{'md5': None}] * 3
+
+
+def test_digest_file_does_not_flush(mock_measurement_set):
+    fqn = str(mock_measurement_set / "table.dat")
+    stat_result = os.stat(fqn)
+    puts = []
+
+    class DictCache:
+        def get(self, fqn, stat_result, algorithm='md5'):
+            return None
+
+        def put(self, fqn, stat_result, digest, algorithm='md5'):
+            puts.append((fqn, stat_result, digest, algorithm))
+
+        def flush(self):
+            raise AssertionError('cache was flushed')
+
+    assert digest_file(fqn, cache=DictCache(), stat_result=stat_result) == {'md5': md5(b"main table").hexdigest()}
+    assert puts == [(fqn, stat_result, md5(b"main table").hexdigest(), 'md5')]
+
+
+def test_list_files(mock_measurement_set):
+    names = sorted(os.path.relpath(x, mock_measurement_set) for x in list_files(mock_measurement_set))
+    assert names == [os.path.join("ANTENNA", "table.dat"), "table.dat", "table.f0"]
+
+
+def test_hash_files_keeps_order(mock_measurement_set):
+    file_list = list_files(mock_measurement_set)
+    assert hash_files(file_list, workers=4) == [file_md5(x) for x in file_list]
+
+
+def test_hash_files_dangling_link(tmp_path):
+    link = tmp_path / "dangling"
+    os.symlink(tmp_path / "missing", link)
+    assert hash_files([str(link)]) == [md5().hexdigest()]
+
+
+def test_reduce_hashes_order_independent():
+    hash_list = [md5(x).hexdigest() for x in (b"a", b"b", b"c")]
+    assert reduce_hashes(hash_list) == reduce_hashes(hash_list[::-1])
+
+
+@pytest.mark.parametrize("workers", [1, 2, 8])
+def test_dirhash(mock_measurement_set, workers):
+    expected = expected_dirhash([b"main table", b"x" * 100000, b"antenna table"])
+    assert dirhash(mock_measurement_set, workers=workers, chunk_size=4096) == expected
+
+
+def test_dirhash_not_directory(tmp_path):
+    with pytest.raises(TypeError):
+        dirhash(tmp_path / "missing.ms")
@@ -0,0 +1,104 @@
+import datetime
+import os
+import pytest
+import yaml
+from unittest.mock import patch, MagicMock
+
+import batch
+import settings_file as set_f
+
+from discovery import parse_bookmark, read_state, write_state, discover_runs, time_boxes, run_discovery, \
+    read_interval
+
+
+def make_run(root, name, mtime):
+    info = root / name / 'weblog' / 'info'
+    info.mkdir(parents=True)
+    (info / 'eMCP_info.txt').write_text('{}')
+    os.utime(info / 'eMCP_info.txt', (mtime.timestamp(), mtime.timestamp()))
+    return str(root / name)
+
+
+def test_parse_bookmark():
+    assert parse_bookmark('14-Dec-2021 21:59') == datetime.datetime(2021, 12, 14, 21, 59)
+    assert parse_bookmark('14-Dec-2021 21:59:30') == datetime.datetime(2021, 12, 14, 21, 59, 30)
+    with pytest.raises(ValueError):
+        parse_bookmark('yesterday')
+
+
+def test_write_state_keeps_other_bookmarks(tmp_path):
+    state_file = str(tmp_path / 'state.yml')
+    with open(state_file, 'w') as file:
+        yaml.safe_dump({'bookmarks': {'other': {'last_record': '01-Jan-2020 00:00'},
+                                      'emerlin': {'last_record': '14-Dec-2021 21:59'}}}, file)
+
+    state, last_record = read_state(state_file, 'emerlin')
+    assert last_record == datetime.datetime(2021, 12, 14, 21, 59)
+    write_state(state_file, state, 'emerlin', datetime.datetime(2022, 1, 1, 12, 0, 5))
+
+    state, last_record = read_state(state_file, 'emerlin')
+    assert last_record == datetime.datetime(2022, 1, 1, 12, 0, 5)
+    assert state['bookmarks']['other']['last_record'] == '01-Jan-2020 00:00'
+    assert os.listdir(tmp_path) == ['state.yml']
+
+
+def test_discover_runs(tmp_path):
+    old = make_run(tmp_path, 'TS8004_C_001_20190801', datetime.datetime(2021, 1, 1))
+    new = make_run(tmp_path, 'TS8004_C_001_20220101', datetime.datetime(2022, 1, 1))
+    (tmp_path / 'not_a_run').mkdir()
+
+    assert [x for _, x in discover_runs(str(tmp_path))] == [old, new]
+    assert discover_runs(str(tmp_path), since=datetime.datetime(2021, 12, 14, 21, 59)) == \
+        [(datetime.datetime(2022, 1, 1), new)]
+
+
+def test_time_boxes():
+    start = datetime.datetime(2022, 1, 1)
+    runs = [(start + datetime.timedelta(minutes=x), str(x)) for x in (0, 5, 10, 11, 60)]
+    assert time_boxes(runs, datetime.timedelta(minutes=10)) == [
+        (start + datetime.timedelta(minutes=10), ['0', '5', '10']),
+        (start + datetime.timedelta(minutes=21), ['11']),
+        (start + datetime.timedelta(minutes=70), ['60']),
+    ]
+
+
+def test_run_discovery_stops_at_failed_box(tmp_path):
+    runs = tmp_path / 'runs'
+    first = make_run(runs, 'a', datetime.datetime(2022, 1, 1))
+    second = make_run(runs, 'b', datetime.datetime(2022, 1, 2))
+    state_file = str(tmp_path / 'state.yml')
+
+    with patch('discovery.batch.run_batch', side_effect=[{'failed': 0}, {'failed': 1}]) as run_batch:
+        last_record = run_discovery(str(runs), state_file, 'emerlin', interval=60)
+
+    assert [x.args[0] for x in run_batch.call_args_list] == [[first], [second]]
+    assert last_record == datetime.datetime(2022, 1, 1, 1, 0)
+    assert read_state(state_file, 'emerlin')[1] == last_record
+
+
+def test_run_discovery_reruns_ingested_run(tmp_path):
+    runs = tmp_path / 'runs'
+    log_dir = tmp_path / 'logs'
+    log_dir.mkdir()
+    rerun = make_run(runs, 'a', datetime.datetime(2022, 1, 2))
+    # ingested before the bookmark, then rerun in place
+    batch.append_log(str(log_dir / 'success_log.txt'), rerun, '2022-01-01T00:00:00')
+    state_file = str(tmp_path / 'state.yml')
+    write_state(state_file, {}, 'emerlin', datetime.datetime(2022, 1, 1, 12, 0))
+
+    pool = MagicMock()
+    pool.__enter__.return_value.imap_unordered.side_effect = lambda func, items: map(func, items)
+    processed = []
+    with patch('discovery.batch.multiprocessing.get_context') as mock_context, \
+            patch('discovery.batch.process_storage', side_effect=lambda x: processed.append(x) or (x, None)):
+        mock_context.return_value.Pool.return_value = pool
+        run_discovery(str(runs), state_file, 'emerlin', interval=60, log_dir=str(log_dir))
+
+    assert processed == [rerun]
+    assert read_state(state_file, 'emerlin')[1] == datetime.datetime(2022, 1, 2, 1, 0)
+
+
+def test_default_config_independent_of_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert os.path.isabs(set_f.state_file)
+    assert read_interval(set_f.config_file) > 0
@@ -1,10 +1,14 @@
 import pytest
 import os
 from datetime import datetime
-from unittest.mock import patch, mock_open
-from hashlib import md5
+from unittest.mock import patch
+from hashlib import md5, sha256
 
-from file_metadata import FileInfo, basename, get_size, get_file_type, get_local_file_info
+from checksum_manifest import ChecksumManifest
+from checksums import digest_files
+
+from file_metadata import FileInfo, TreeScan, basename, list_dir, scan_tree, get_size, get_file_type, \
+    get_local_file_info
 
 
 # Tests for FileInfo class
@@ -71,38 +75,105 @@ def test_get_file_type_directory():
         assert get_file_type("/path/to/directory") == "application/measurement-set"
 
 
+# Tests for list_dir and scan_tree functions
+@pytest.fixture
+def mock_measurement_set(tmp_path):
+    # Create a mock measurement set with a sub-table and a symbolic link
+    ms_dir = tmp_path / "measurement" / "test_avg.ms"
+    (ms_dir / "ANTENNA").mkdir(parents=True)
+    (ms_dir / "table.dat").write_bytes(b"main table")
+    (ms_dir / "ANTENNA" / "table.dat").write_bytes(b"antenna")
+    os.symlink(ms_dir / "table.dat", ms_dir / "table.link")
+    return ms_dir
+
+
+def test_list_dir(mock_measurement_set):
+    assert [x.name for x in list_dir(mock_measurement_set)] == ["ANTENNA", "table.dat", "table.link"]
+
+
+def test_scan_tree_measurement_set(mock_measurement_set):
+    scan = scan_tree(str(mock_measurement_set))
+    assert isinstance(scan, TreeScan)
+    assert scan.file_type == 'application/measurement-set'
+    assert scan.size == 17  # symbolic link is not counted
+    assert len(scan.files) == 3
+    assert scan.mtime == max(os.stat(x).st_mtime for x in scan.files)
+
+
+def test_scan_tree_from_dir_entry(mock_measurement_set):
+    entry = [x for x in list_dir(mock_measurement_set) if x.name == "table.dat"][0]
+    scan = scan_tree(entry.path, entry)
+    assert scan.file_type == 'text/plain'
+    assert scan.size == 10
+    assert scan.files == [entry.path]
+
+
 # Tests for get_local_file_info function
-@patch('file_metadata.get_file_type')
-@patch('file_metadata.get_size')
-@patch('file_metadata.dirhash')
-@patch('os.stat')
-@patch('builtins.open', new_callable=mock_open, read_data=b'test data')
-def test_get_local_file_info_measurement_set(mock_open, mock_stat, mock_dirhash, mock_get_size, mock_get_file_type):
-    mock_get_file_type.return_value = 'application/measurement-set'
-    mock_get_size.return_value = 1000
-    mock_dirhash.return_value = 'mock_hash'
-
-    result = get_local_file_info('/path/to/measurement/set')
+def test_get_local_file_info_measurement_set(mock_measurement_set):
+    result = get_local_file_info(str(mock_measurement_set) + '/')
 
+    file_hashes = sorted([md5(b"main table").hexdigest()] * 2 + [md5(b"antenna").hexdigest()])
     assert isinstance(result, FileInfo)
-    assert result.id == "measurement"
-    assert result.size == 1000
-    assert result.md5sum == 'mock_hash'
+    assert result.id == "test_avg.ms"
+    assert result.size == 17
+    assert result.md5sum == md5("".join(file_hashes).encode('utf-8')).hexdigest()
     assert result.file_type == 'application/measurement-set'
 
 
-@patch('file_metadata.get_file_type')
-@patch('os.stat')
-@patch('builtins.open', new_callable=mock_open, read_data=b'test data')
-def test_get_local_file_info_regular_file(mock_open, mock_stat, mock_get_file_type):
-    mock_get_file_type.return_value = 'text/plain'
-    mock_stat.return_value.st_size = 9  # Length of 'test data'
+def test_get_local_file_info_regular_file(tmp_path):
+    fqn = tmp_path / 'file.txt'
+    fqn.write_bytes(b'test data')
 
-    result = get_local_file_info('/path/to/file.txt')
+    result = get_local_file_info(str(fqn), algorithms=('md5', 'sha256'))
 
     assert isinstance(result, FileInfo)
     assert result.id == "file.txt"
     assert result.size == 9
     assert result.md5sum == md5(b'test data').hexdigest()
+    assert result.checksums['sha256'] == sha256(b'test data').hexdigest()
     assert result.file_type == 'text/plain'
 
+
+def test_get_local_file_info_from_manifest(mock_measurement_set):
+    lines = ['{}  {}'.format('a' * 32, os.path.relpath(x, mock_measurement_set.parent))
+             for x in scan_tree(str(mock_measurement_set)).files]
+    manifest_file = mock_measurement_set.parent / 'MD5SUMS'
+    manifest_file.write_text('\n'.join(lines) + '\n')
+    manifest = ChecksumManifest([str(manifest_file)])
+
+    with patch('emerlin2caom2.checksums.file_digests', side_effect=AssertionError('file was hashed')):
+        result = get_local_file_info(str(mock_measurement_set), cache=manifest)
+    assert result.md5sum == md5(('a' * 32 * 3).encode('utf-8')).hexdigest()
+    assert manifest.stats()['hits'] == 3
+
+
+def test_get_local_file_info_deferred_checksum(mock_measurement_set):
+    with patch('emerlin2caom2.checksums.file_digests', side_effect=AssertionError('file was hashed')):
+        result = get_local_file_info(str(mock_measurement_set) + '/', hash_missing=False)
+        regular = get_local_file_info(str(mock_measurement_set / 'table.dat'), hash_missing=False)
+    assert result.size == 17
+    assert result.checksums == {}
+    assert result.md5sum is None
+    assert regular.size == 10
+    assert regular.checksums == {}
+
+
+def test_get_local_file_info_workers(mock_measurement_set):
+    with patch('file_metadata.digest_files', wraps=digest_files) as mock_digest:
+        result = get_local_file_info(str(mock_measurement_set) + '/', workers=1)
+    assert mock_digest.call_args.args[2] == 1
+    assert result.size == 17
+
+
+def test_get_local_file_info_reuses_scan_stat(mock_measurement_set):
+    lines = ['{}  {}'.format('a' * 32, os.path.relpath(x, mock_measurement_set.parent))
+             for x in scan_tree(str(mock_measurement_set)).files]
+    manifest_file = mock_measurement_set.parent / 'MD5SUMS'
+    manifest_file.write_text('\n'.join(lines) + '\n')
+    manifest = ChecksumManifest([str(manifest_file)])
+
+    with patch('emerlin2caom2.checksums.os.stat', wraps=os.stat) as mock_stat:
+        result = get_local_file_info(str(mock_measurement_set), cache=manifest)
+    assert result.md5sum == md5(('a' * 32 * 3).encode('utf-8')).hexdigest()
+    stat_paths = {x.args[0] for x in mock_stat.call_args_list}
+    assert not stat_paths.intersection(scan_tree(str(mock_measurement_set)).files)
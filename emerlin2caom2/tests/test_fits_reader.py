@@ -1,8 +1,9 @@
+import numpy as np
 import pytest
 from astropy.io import fits
 from astropy.io.fits.header import Header
-from unittest.mock import patch, MagicMock
-from fits_reader import header_extraction
+from unittest.mock import patch
+from fits_reader import header_extraction, header_extraction_many, read_primary_header
 
 
 @pytest.fixture
@@ -23,17 +24,14 @@ def mock_fits_header():
 
 
 @pytest.fixture
-def mock_fits_hdu(mock_fits_header):
-    mock_hdu = MagicMock()
-    mock_hdu.header = mock_fits_header
-    return mock_hdu
+def fits_file(mock_fits_header, tmp_path):
+    fqn = str(tmp_path / 'image.fits')
+    mock_fits_header.tofile(fqn)
+    return fqn
 
 
-@patch('astropy.io.fits.open')
-def test_header_extraction(mock_fits_open, mock_fits_hdu):
-    mock_fits_open.return_value = [mock_fits_hdu]
-
-    result = header_extraction('dummy.fits')
+def test_header_extraction(fits_file):
+    result = header_extraction(fits_file)
 
     assert isinstance(result, dict)
     assert result['coord_scheme'] == 2000.0
@@ -49,23 +47,40 @@ def test_header_extraction(mock_fits_open, mock_fits_hdu):
     assert result['pix_length_scale'] == 0.00277777
 
 
-@patch('astropy.io.fits.open')
-def test_header_extraction_missing_key(mock_fits_open, mock_fits_hdu, mock_fits_header):
+def test_header_extraction_missing_key(mock_fits_header, fits_file):
     del mock_fits_header['WSCVERSI']
-    mock_fits_open.return_value = [mock_fits_hdu]
+    mock_fits_header.tofile(fits_file, overwrite=True)
 
     with pytest.raises(KeyError):
-        header_extraction('dummy.fits')
-
+        header_extraction(fits_file)
 
-@patch('astropy.io.fits.open')
-def test_header_extraction_file_not_found(mock_fits_open):
-    mock_fits_open.side_effect = FileNotFoundError
 
+def test_header_extraction_file_not_found():
     with pytest.raises(FileNotFoundError):
         header_extraction('nonexistent.fits')
 
 
+def test_header_extraction_data_not_read(tmp_path):
+    fqn = str(tmp_path / 'image.fits')
+    fits.PrimaryHDU(np.zeros((1, 1, 64, 64), dtype=np.float32)).writeto(fqn)
+
+    with patch('astropy.io.fits.open') as mock_fits_open:
+        assert read_primary_header(fqn)['NAXIS1'] == 64
+    mock_fits_open.assert_not_called()
+
+
+def test_header_extraction_many(mock_fits_header, tmp_path):
+    fits_files = []
+    for i in range(5):
+        mock_fits_header['CRVAL3'] = 1.4e9 + i
+        fits_files.append(str(tmp_path / '{}.fits'.format(i)))
+        mock_fits_header.tofile(fits_files[-1])
+
+    results = header_extraction_many(fits_files, workers=3)
+    assert [x['central_freq'] for x in results] == [1.4e9 + i for i in range(5)]
+    assert header_extraction_many(fits_files, workers=1) == results
+
+
 # @patch('astropy.io.fits.open')
 # def test_header_extraction_invalid_fits(mock_fits_open):
 #     mock_fits_open.side_effect = fits.InvalidHDUException
@@ -0,0 +1,37 @@
+from ingest_digests import IngestDigests, xml_digest
+
+XML = b"""<?xml version='1.0' encoding='UTF-8'?>
+<caom2:Observation xmlns:caom2="http://www.opencadc.org/caom2/xml/v2.4"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:type="caom2:DerivedObservation" caom2:id="{}">
+  <caom2:collection>EMERLIN</caom2:collection>
+  <caom2:observationID>{}</caom2:observationID>
+  <caom2:planes><caom2:plane caom2:id="{}"><caom2:productID>p</caom2:productID></caom2:plane></caom2:planes>
+</caom2:Observation>
+"""
+
+
+def make_xml(obs_id, *ids):
+    return XML.replace(b'{}', b'%s') % (ids[0].encode(), obs_id.encode(), ids[1].encode())
+
+
+def test_xml_digest_ignores_ids(tmp_path):
+    first = make_xml('TS8004', 'aaaa-0001', 'aaaa-0002')
+    xml_file = tmp_path / 'obs.xml'
+    xml_file.write_bytes(first)
+
+    assert xml_digest(first) == xml_digest(make_xml('TS8004', 'bbbb-0001', 'bbbb-0002'))
+    assert xml_digest(first) == xml_digest(str(xml_file))
+    assert xml_digest(first) != xml_digest(make_xml('TS8005', 'aaaa-0001', 'aaaa-0002'))
+
+
+def test_ingest_digests(tmp_path):
+    digests = IngestDigests(str(tmp_path))
+    assert digests.get('caom:EMERLIN/a') is None
+    digests.put('caom:EMERLIN/a', 'abc')
+    digests.close()
+
+    digests = IngestDigests(str(tmp_path))
+    assert digests.get('caom:EMERLIN/a') == 'abc'
+    digests.discard('caom:EMERLIN/a')
+    assert digests.get('caom:EMERLIN/a') is None
+    digests.close()
@@ -0,0 +1,142 @@
+import pytest
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from ingest_digests import IngestDigests, xml_digest
+from ingest_queue import IngestQueue, ingest_observation, published_uris
+
+
+@pytest.fixture
+def caller():
+    return SimpleNamespace(base_url='https://example.org/observations/EMERLIN')
+
+
+@pytest.fixture
+def mock_api():
+    calls = []
+    lock = threading.Lock()
+
+    def request_delete(caller, machine_id):
+        time.sleep(0.01)
+        with lock:
+            calls.append(('delete', machine_id))
+        return 204
+
+    def request_post(caller, xml_output_name):
+        with lock:
+            calls.append(('post', xml_output_name))
+        return 201
+
+    with patch('ingest_queue.api.request_delete', side_effect=request_delete), \
+            patch('ingest_queue.api.request_post', side_effect=request_post):
+        yield calls
+
+
+@pytest.mark.parametrize("machine_id,replace,expected", [
+    (None, True, [('insert', 201)]),
+    ('id-a', True, [('delete', 204), ('update', 201)]),
+    ('id-a', False, [('skip, record exists', None)]),
+    (['id-a', 'id-b'], True, [('skip, multiple records', None)]),
+])
+def test_ingest_observation(caller, mock_api, machine_id, replace, expected):
+    assert ingest_observation(caller, 'caom:EMERLIN/a', 'a.xml', machine_id, replace) == expected
+
+
+XML = (b'<caom2:Observation xmlns:caom2="http://www.opencadc.org/caom2/xml/v2.4" caom2:id="new-id">'
+       b'<caom2:observationID>a</caom2:observationID></caom2:Observation>')
+
+
+def test_ingest_observation_skips_unchanged(caller, mock_api, tmp_path):
+    digests = IngestDigests(str(tmp_path))
+    assert ingest_observation(caller, 'caom:EMERLIN/a', XML, None, True, digests) == [('insert', 201)]
+    assert digests.get('caom:EMERLIN/a') == xml_digest(XML)
+
+    assert ingest_observation(caller, 'caom:EMERLIN/a', XML, 'id-a', True, digests) == [('skip, unchanged', None)]
+    changed = XML.replace(b'>a<', b'>b<')
+    assert ingest_observation(caller, 'caom:EMERLIN/a', changed, 'id-a', True, digests) == \
+        [('delete', 204), ('update', 201)]
+    assert digests.get('caom:EMERLIN/a') == xml_digest(changed)
+    digests.close()
+
+
+def test_ingest_observation_update_in_place(caller, mock_api):
+    with patch('ingest_queue.api.request_put', return_value=200) as request_put:
+        assert ingest_observation(caller, 'caom:EMERLIN/a', XML, 'id-a', True, update_in_place=True) == \
+            [('update', 200)]
+    assert mock_api == []
+    args = request_put.call_args.args
+    assert args[1] == 'id-a'
+    assert b'caom2:id="id-a"' in args[2]
+
+
+def test_ingest_queue_orders_delete_before_post(caller, mock_api):
+    existing = {'caom:EMERLIN/{}'.format(i): 'id-{}'.format(i) for i in range(10)}
+    queue = IngestQueue(caller, existing, replace_old_data=True, workers=4)
+    for i in range(12):
+        queue.submit('caom:EMERLIN/{}'.format(i), '{}.xml'.format(i))
+    results = queue.close()
+
+    assert [uri for uri, _ in results] == ['caom:EMERLIN/{}'.format(i) for i in range(12)]
+    assert results[11][1] == [('insert', 201)]
+    for i in range(10):
+        assert mock_api.index(('delete', 'id-{}'.format(i))) < mock_api.index(('post', '{}.xml'.format(i)))
+
+
+def test_ingest_queue_same_uri_in_order(caller, mock_api):
+    queue = IngestQueue(caller, {'caom:EMERLIN/a': 'id-a'}, replace_old_data=True, workers=4)
+    with patch('ingest_queue.api.find_existing', return_value='id-b'):
+        queue.submit('caom:EMERLIN/a', 'first.xml')
+        queue.submit('caom:EMERLIN/a', 'second.xml')
+        queue.close()
+
+    posts = [x for x in mock_api if x[0] == 'post']
+    assert posts == [('post', 'first.xml'), ('post', 'second.xml')]
+
+
+def test_ingest_queue_replaces_record_inserted_earlier(caller, mock_api):
+    queue = IngestQueue(caller, {}, replace_old_data=True, workers=4)
+    with patch('ingest_queue.api.find_existing', return_value='id-new') as find_existing:
+        queue.submit('caom:EMERLIN/a', 'first.xml')
+        queue.submit('caom:EMERLIN/a', 'second.xml')
+        results = queue.close()
+
+    find_existing.assert_called_once_with(caller, 'caom:EMERLIN/a')
+    assert [steps for _, steps in results] == [[('insert', 201)], [('delete', 204), ('update', 201)]]
+    assert mock_api == [('post', 'first.xml'), ('delete', 'id-new'), ('post', 'second.xml')]
+
+
+def test_ingest_queue_records_errors(caller, capsys):
+    error = ConnectionError('Max retries exceeded with url: /observations/EMERLIN')
+    with patch('ingest_queue.api.request_post', side_effect=error):
+        queue = IngestQueue(caller, {}, replace_old_data=True)
+        queue.submit('caom:EMERLIN/a', 'a.xml')
+        assert queue.close() == [('caom:EMERLIN/a', [
+            ('error', 'ConnectionError: Max retries exceeded with url: /observations/EMERLIN')])]
+    out = capsys.readouterr().out
+    assert 'Traceback' in out
+    assert 'caom:EMERLIN/a error failed with status: ConnectionError: Max retries' in out
+
+
+def test_published_uris():
+    results = [('caom:EMERLIN/a', [('insert', 201)]),
+               ('caom:EMERLIN/b', [('skip, record exists', None)]),
+               ('caom:EMERLIN/c', [('delete', 204), ('update', 201)]),
+               ('caom:EMERLIN/d', [('insert', 500)])]
+    assert published_uris(results) == {'caom:EMERLIN/a', 'caom:EMERLIN/c'}
+
+
+def test_ingest_queue_reports_failures(caller, mock_api, capsys):
+    with patch('ingest_queue.api.request_put', return_value=200):
+        queue = IngestQueue(caller, {'caom:EMERLIN/a': 'id-a'}, replace_old_data=True, update_in_place=True)
+        queue.submit('caom:EMERLIN/a', XML)
+        queue.submit('caom:EMERLIN/b', XML)
+        queue.close()
+    assert 'failed' not in capsys.readouterr().out
+
+    with patch('ingest_queue.api.request_post', return_value=500):
+        queue = IngestQueue(caller, {}, replace_old_data=True)
+        queue.submit('caom:EMERLIN/a', XML)
+        queue.close()
+    assert 'caom:EMERLIN/a insert failed with status: 500' in capsys.readouterr().out
@@ -0,0 +1,78 @@
+import json
+import os
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def collecting():
+    metrics.start()
+    yield
+    metrics._enabled = False
+
+
+def test_not_collecting():
+    metrics._enabled = False
+    with metrics.timed('stage'):
+        pass
+    metrics.add('bytes_hashed', 10)
+    assert 'stage' not in metrics.summary()['stages']
+
+
+def test_timed_and_counters(collecting):
+    with metrics.timed('casa.msmd', 'a.ms'):
+        pass
+
+    @metrics.timed('fits.header')
+    def read_header():
+        return 1
+
+    assert read_header() == 1
+    assert read_header() == 1
+    metrics.add('bytes_hashed', 10)
+    metrics.add('bytes_hashed', 5)
+
+    summary = metrics.summary()
+    assert summary['stages']['casa.msmd']['count'] == 1
+    assert summary['stages']['fits.header']['count'] == 2
+    assert summary['counters'] == {'bytes_hashed': 15}
+    assert [(x['stage'], x['item']) for x in summary['events']] == [('casa.msmd', 'a.ms')]
+
+
+def test_timed_records_failures(collecting):
+    with pytest.raises(ValueError):
+        with metrics.timed('http.post'):
+            raise ValueError
+    assert metrics.summary()['stages']['http.post']['count'] == 1
+
+
+def test_write(tmp_path):
+    metrics.start(profile=True)
+    with metrics.timed('xml.write'):
+        pass
+    json_file = metrics.write('TS8004', str(tmp_path))
+
+    with open(json_file) as file:
+        written = json.load(file)
+    assert written['run'] == 'TS8004'
+    assert written['stages']['xml.write']['count'] == 1
+    assert os.path.exists(json_file.replace('_metrics.json', '.prof'))
+    metrics.add('bytes_hashed')
+    assert 'bytes_hashed' not in metrics.summary()['counters']
+
+
+def test_merge(collecting):
+    with metrics.timed('casa.msmd', 'a.ms'):
+        pass
+    metrics.add('rows_read', 3)
+    seconds = metrics.summary()['stages']['casa.msmd']['seconds']
+    metrics.merge({'stages': {'casa.msmd': {'count': 1, 'seconds': 100., 'max_seconds': 100.},
+                              'casa.subtable': {'count': 2, 'seconds': 1., 'max_seconds': 0.6}},
+                   'counters': {'rows_read': 7}, 'events': [{'stage': 'casa.msmd', 'item': 'b.ms', 'seconds': 100.}]})
+
+    summary = metrics.summary()
+    assert summary['stages']['casa.msmd'] == {'count': 2, 'seconds': seconds + 100., 'max_seconds': 100.}
+    assert summary['stages']['casa.subtable']['count'] == 2
+    assert summary['counters'] == {'rows_read': 10}
+    assert [x['item'] for x in summary['events']] == ['a.ms', 'b.ms']
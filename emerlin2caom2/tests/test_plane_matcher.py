@@ -0,0 +1,26 @@
+from plane_matcher import PlaneMatcher
+
+
+def test_match():
+    matcher = PlaneMatcher(['1252+5634', '1302+5748', 'TS8004_C_001_20190801_avg.ms'])
+    assert matcher.match('TS8004_C_001_20190801_1252+5634_amp.png') == '1252+5634'
+    assert matcher.match('1302+5748_img') == '1302+5748'
+    assert matcher.match('TS8004_C_001_20190801_avg.ms_uvcov.png') == 'TS8004_C_001_20190801_avg.ms'
+    assert matcher.unmatched == []
+
+
+def test_match_overlapping_ids():
+    matcher = PlaneMatcher(['1252+56', '1252+5634', '34_bp'])
+    # the longest id wins, even where a shorter id starts earlier or overlaps it
+    assert matcher.match('plot_1252+5634_bp.png') == '1252+5634'
+    assert matcher.match('plot_1252+56_bp.png') == '1252+56'
+    assert PlaneMatcher(['ab', 'bcd']).match('abcd') == 'bcd'
+    # ids of equal length: the first in the name
+    assert PlaneMatcher(['xyz', 'abc']).match('xyz_abc') == 'xyz'
+
+
+def test_unmatched():
+    matcher = PlaneMatcher(['1252+5634'])
+    assert matcher.match('0319+4130.png') is None
+    assert PlaneMatcher([]).match('a.png') is None
+    assert matcher.report('plots') == ['0319+4130.png']